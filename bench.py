@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import socket
+import sqlite3
+import asyncio
+import subprocess
+import argparse
+import platform
+import tempfile
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+WORDS = ("beetroot", "cabbage", "potatoes", "carrots", "onion", "garlic", "tomatoes", "pepper", "salt", "butter",
+         "flour", "eggs", "milk", "cream", "cheese", "rice", "pasta", "chicken", "beef", "pork", "fish", "apples",
+         "walnuts", "honey", "sugar", "lemon", "dill", "parsley", "mushrooms", "beans")
+
+
+# Scenarios which don't change data, run against every number of server workers.
+READ_SCENARIOS = ("get_recipe", "get_recipes_batch", "list_recipes", "list_recipes_next_page", "list_recipes_filtered",
+                  "list_recipes_newest", "list_category", "search", "recipes_by_ingredients", "top", "top_category",
+                  "list_categories", "list_categories_with_stats", "metrics")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Scenario(NamedTuple):
+    """
+    Requests of one endpoint: request(number) returns method, URL and keyword arguments of httpx request.
+    """
+
+    name: str
+    request: Callable[[int], Tuple[str, str, Dict[str, Any]]]
+    expected: int = 200
+    share: float = 1.0
+
+
+def seed(path: str, recipes: int, categories: int, rng: random.Random) -> None:
+    """
+    Fills the database with categories and recipes with skewed popularity, and the index of recipe ingredients.
+    Args:
+        path: SQLite database file with created schema.
+        recipes: Number of recipes.
+        categories: Number of categories.
+        rng: Random generator.
+
+    Returns:
+        None.
+    """
+
+    ingredients = {number: rng.sample(WORDS, 5) for number in range(1, recipes + 1)}
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executemany("INSERT INTO recipe_cat (id, title) VALUES (?, ?)",
+                               ((number, f"Category {number}") for number in range(1, categories + 1)))
+        connection.executemany(
+            "INSERT INTO recipes (id, title, category, cooking_time, ingredients, description, views, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+            ((number, f"Recipe {number}", rng.randint(1, categories), rng.randint(1, 180),
+              ", ".join(names), " ".join(rng.choices(WORDS, k=12)), int(rng.paretovariate(1.2)) - 1)
+             for number, names in ingredients.items())
+        )
+        # Words are already normalized ingredient names.
+        connection.executemany("INSERT INTO ingredients (id, name) VALUES (?, ?)", enumerate(WORDS, 1))
+        connection.executemany("INSERT INTO recipe_ingredients (ingredient_id, recipe_id) VALUES (?, ?)",
+                               ((WORDS.index(name) + 1, number)
+                                for number, names in ingredients.items() for name in names))
+    connection.close()
+
+
+def percentile(values: List[float], share: float) -> float:
+    """
+    Returns nearest-rank percentile.
+    Args:
+        values: Sorted values.
+        share: Percentile from 0 to 1.
+
+    Returns:
+        Percentile value.
+    """
+
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    """
+    Sends requests of a scenario from concurrent workers.
+    Args:
+        client: httpx.AsyncClient instance.
+        scenario: Scenario.
+        requests: Number of requests.
+        concurrency: Number of concurrent workers.
+
+    Returns:
+        Throughput, latency percentiles in milliseconds and number of unexpected responses.
+    """
+
+    numbers = iter(range(requests))
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for number in numbers:
+            method, url, kwargs = scenario.request(number)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            await response.aread()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != scenario.expected:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"requests": requests, "errors": errors, "rps": round(requests / elapsed, 1),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3)}
+
+
+def scenarios(recipes: int, categories: int, rng: random.Random, cursor: str) -> List[Scenario]:
+    """
+    Builds scenarios of every endpoint. Mutating scenarios work on their own recipes and categories,
+    so they are run in order.
+    Args:
+        recipes: Number of seeded recipes.
+        categories: Number of seeded categories.
+        rng: Random generator.
+        cursor: Cursor of the second page of all recipes.
+
+    Returns:
+        List of scenarios.
+    """
+
+    recipe = {"title": "Benchmark", "cooking_time": 30, "category": 1, "ingredients": "beetroot, cabbage",
+              "description": "Benchmark recipe"}
+    created = recipes + 1
+
+    def recipe_id(number: int) -> int:
+        # Popular recipes are requested more often.
+        return min(recipes, int(rng.paretovariate(1.0)))
+
+    return [
+        Scenario("get_recipe", lambda number: ("GET", f"/recipes/{recipe_id(number)}", {})),
+        Scenario("get_recipes_batch", lambda number: ("GET", "/recipes/batch",
+                                                      {"params": {"ids": [recipe_id(number) for _ in range(20)]}})),
+        Scenario("list_recipes", lambda number: ("GET", "/recipes/", {})),
+        Scenario("list_recipes_next_page", lambda number: ("GET", "/recipes/", {"params": {"cursor": cursor}})),
+        Scenario("list_recipes_filtered", lambda number: ("GET", "/recipes/", {"params": {
+            "sort": "quickest", "cooking_time_min": 30, "views_min": 1,
+            "category": rng.sample(range(1, categories + 1), min(3, categories))}})),
+        Scenario("list_recipes_newest", lambda number: ("GET", "/recipes/",
+                                                        {"params": {"sort": "newest", "cooking_time_max": 60}})),
+        Scenario("list_category", lambda number: ("GET", f"/categories/{rng.randint(1, categories)}", {})),
+        Scenario("search", lambda number: ("GET", "/recipes/search",
+                                           {"params": {"q": " ".join(rng.sample(WORDS, 2))}})),
+        Scenario("recipes_by_ingredients", lambda number: ("GET", "/recipes/by-ingredients",
+                                                           {"params": {"have": ", ".join(rng.sample(WORDS, 4))}})),
+        Scenario("top", lambda number: ("GET", "/recipes/top", {"params": {"n": 10}})),
+        Scenario("top_category", lambda number: ("GET", "/recipes/top",
+                                                 {"params": {"n": 10, "category": rng.randint(1, categories)}})),
+        Scenario("list_categories", lambda number: ("GET", "/categories/", {})),
+        Scenario("list_categories_with_stats", lambda number: ("GET", "/categories/",
+                                                               {"params": {"with_stats": True}})),
+        Scenario("metrics", lambda number: ("GET", "/metrics", {})),
+        Scenario("create_recipe", lambda number: ("POST", "/recipes/", {"json": recipe}), 201),
+        Scenario("update_recipe", lambda number: ("PATCH", f"/recipes/{created + number}",
+                                                  {"json": {"cooking_time": number % 100 + 1}})),
+        Scenario("delete_recipe", lambda number: ("DELETE", f"/recipes/{created + number}", {})),
+        Scenario("bulk_import", lambda number: ("POST", "/recipes/bulk", {"json": [recipe] * 100}), share=0.1),
+        Scenario("create_category", lambda number: ("POST", "/categories/", {"json": {"title": f"Bench {number}"}}),
+                 201),
+        Scenario("update_category", lambda number: ("PATCH", f"/categories/{categories + 1 + number}",
+                                                    {"json": {"title": f"Renamed {number}"}})),
+        Scenario("delete_category", lambda number: ("DELETE", f"/categories/{categories + 1 + number}", {})),
+        Scenario("export", lambda number: ("GET", "/recipes/export", {}), share=0.005),
+        Scenario("cache_stats", lambda number: ("GET", "/diagnostics/cache", {})),
+        Scenario("settings", lambda number: ("GET", "/diagnostics/settings", {})),
+        Scenario("check_leaderboard", lambda number: ("GET", "/diagnostics/leaderboard", {}), share=0.005),
+    ]
+
+
+async def run_scenarios(client, args: argparse.Namespace, rng: random.Random, names=None, suffix: str = "") -> dict:
+    """
+    Runs scenarios against the application.
+    Args:
+        client: httpx.AsyncClient instance.
+        args: Command line arguments.
+        rng: Random generator.
+        names: Names of scenarios to run or None for all scenarios.
+        suffix: Suffix of scenario names in results.
+
+    Returns:
+        Mapping of scenario name to its results.
+    """
+
+    cursor = (await client.get("/recipes/")).headers["X-Next-Cursor"]
+    results = {}
+    for scenario in scenarios(args.recipes, args.categories, rng, cursor):
+        if args.only and scenario.name not in args.only or names is not None and scenario.name not in names:
+            continue
+        requests = max(1, int(args.requests * scenario.share))
+        name = scenario.name + suffix
+        results[name] = await run_scenario(client, scenario, requests, args.concurrency)
+        print(f"{name:<32} {json.dumps(results[name])}", file=sys.stderr)
+    return results
+
+
+async def serve(workers: int, port: int) -> subprocess.Popen:
+    """
+    Starts the server with run.py and waits until it answers.
+    Args:
+        workers: Number of worker processes.
+        port: Port to bind.
+
+    Returns:
+        Server process.
+    """
+
+    import httpx
+
+    server = subprocess.Popen([sys.executable, "run.py", "--workers", str(workers), "--port", str(port)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        for _ in range(300):
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                if (await client.get("/categories/")).status_code == 200:
+                    return server
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server didn't start in 30 seconds")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def benchmark(args: argparse.Namespace, path: str) -> dict:
+    """
+    Seeds the database, starts the application and runs every scenario in process, or read scenarios against
+    run.py with every number of workers from --workers.
+    Args:
+        args: Command line arguments.
+        path: SQLite database file.
+
+    Returns:
+        Benchmark report.
+    """
+
+    # The application reads settings on import.
+    import httpx
+    import main
+    import migrations
+    from db import engine
+
+    rng = random.Random(args.seed)
+    async with engine.begin() as connection:
+        await connection.run_sync(migrations.migrate)
+    started = time.perf_counter()
+    seed(path, args.recipes, args.categories, rng)
+    seeded = time.perf_counter() - started
+
+    results = {}
+    if args.workers:
+        await engine.dispose()
+        for workers in args.workers:
+            port = free_port()
+            server = await serve(workers, port)
+            try:
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+                    results.update(await run_scenarios(client, args, rng, READ_SCENARIOS, f"@{workers}"))
+            finally:
+                server.send_signal(signal.SIGINT)
+                server.wait()
+    else:
+        await main.startup()
+        try:
+            async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+                results = await run_scenarios(client, args, rng)
+        finally:
+            await main.shutdown()
+    return {"config": {"recipes": args.recipes, "categories": args.categories, "requests": args.requests,
+                       "concurrency": args.concurrency, "seed": args.seed, "workers": args.workers},
+            "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                            "platform": platform.platform(), "cpus": os.cpu_count()},
+            "seed_seconds": round(seeded, 2),
+            "results": results}
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Finds scenarios which became slower than in the baseline.
+    Args:
+        report: Current benchmark report.
+        baseline: Saved benchmark report.
+        threshold: Allowed relative degradation, e.g. 0.2 for 20%.
+
+    Returns:
+        Descriptions of regressions.
+    """
+
+    regressions = []
+    if report["config"] != baseline["config"]:
+        regressions.append(f"config differs from baseline: {baseline['config']}")
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+        if result["rps"] < before["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {before['rps']} -> {result['rps']}")
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if result[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{name}: {metric} {before[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CookBook API benchmark")
+    parser.add_argument("--recipes", type=int, default=10000, help="number of seeded recipes")
+    parser.add_argument("--categories", type=int, default=20, help="number of seeded categories")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--only", nargs="*", help="names of scenarios to run")
+    parser.add_argument("--workers", type=int, nargs="*",
+                        help="run read scenarios over HTTP against run.py with every number of workers")
+    parser.add_argument("--output", help="file to save the report to")
+    parser.add_argument("--baseline", help="saved report to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative degradation")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        os.environ["COOKBOOK_DATABASE_URL"] = f"sqlite+aiosqlite:///{path}"
+        report = asyncio.run(benchmark(args, path))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import json
+import schemas
+from pydantic import validate_model
+from settings import settings
+from crud_cats import existing_ids
+from crud_recipes import create_many
+from write_queue import rollback
+from typing import Any, AsyncIterator, List, Dict, Set
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BULK_MAX_BATCH_SIZE = 10000
+
+
+class InvalidRow:
+    """
+    Row of NDJSON body which is not valid JSON.
+    """
+
+    def __init__(self, detail: str):
+        self.detail = detail
+
+
+async def json_rows(items: list) -> AsyncIterator[Any]:
+    """
+    Iterates over rows of parsed JSON array body.
+    Args:
+        items: Parsed body.
+
+    Returns:
+        Async iterator of rows.
+    """
+
+    for item in items:
+        yield item
+
+
+async def ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Parses streamed NDJSON body line by line.
+    Args:
+        chunks: Body chunks.
+
+    Returns:
+        Async iterator of parsed rows, InvalidRow for lines which are not valid JSON.
+    """
+
+    tail = b""
+    async for chunk in chunks:
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield parse_line(line)
+    if tail.strip():
+        yield parse_line(tail)
+
+
+def parse_line(line: bytes) -> Any:
+    """
+    Parses one NDJSON line.
+    Args:
+        line: Line of the body.
+
+    Returns:
+        Parsed row or InvalidRow.
+    """
+
+    try:
+        return json.loads(line)
+    except ValueError as exc:
+        return InvalidRow(f"Invalid JSON: {exc}")
+
+
+async def import_recipes(rows: AsyncIterator[Any], session: AsyncSession,
+                         batch_size: int = settings.bulk_batch_size) -> schemas.BulkResult:
+    """
+    Validates rows with RecipeIn schema and creates recipes in batches, one transaction per batch.
+    Args:
+        rows: Async iterator of raw recipe data.
+        session: AsyncSession instance.
+        batch_size: Number of rows inserted in one transaction.
+
+    Returns:
+        Import report with IDs of created recipes in order of rows and errors of rejected rows.
+    """
+
+    ids: List[int | None] = []
+    errors: List[schemas.BulkError] = []
+    known_categories: Set[int] = set()
+
+    async def insert(batch: Dict[int, dict]) -> None:
+        missing = {recipe["category"] for recipe in batch.values()} - known_categories
+        known_categories.update(await existing_ids(missing, session))
+        valid = {}
+        for row, recipe in batch.items():
+            if recipe["category"] in known_categories:
+                valid[row] = recipe
+            else:
+                errors.append(schemas.BulkError(row=row, detail="Category with specified ID does not exist"))
+        try:
+            created = await create_many(list(valid.values()), session)
+        except SQLAlchemyError as exc:
+            await rollback(session)
+            errors.extend(schemas.BulkError(row=row, detail=f"Batch insert failed: {exc.__class__.__name__}")
+                          for row in valid)
+        else:
+            for row, recipe_id in zip(valid, created):
+                ids[row] = recipe_id
+
+    batch: Dict[int, dict] = {}
+    async for raw in rows:
+        row = len(ids)
+        ids.append(None)
+        if isinstance(raw, InvalidRow):
+            errors.append(schemas.BulkError(row=row, detail=raw.detail))
+            continue
+        if not isinstance(raw, dict):
+            errors.append(schemas.BulkError(row=row, detail="Row should be a JSON object"))
+            continue
+        # validate_model returns plain values, which saves building and dumping a RecipeIn per row.
+        values, _, error = validate_model(schemas.RecipeIn, raw)
+        if error is not None:
+            errors.append(schemas.BulkError(row=row, detail=error.errors()))
+            continue
+        batch[row] = values
+        if len(batch) >= batch_size:
+            await insert(batch)
+            batch = {}
+    if batch:
+        await insert(batch)
+    errors.sort(key=lambda error: error.row)
+    return schemas.BulkResult(created=sum(recipe_id is not None for recipe_id in ids), ids=ids, errors=errors)
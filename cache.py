@@ -0,0 +1,166 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Set, Tuple, Callable
+from settings import settings
+from view_counter import view_counter
+
+
+class RecipeCache:
+    """
+    Bounded LRU cache of serialized recipes with time to live.
+
+    Entries are indexed by category as well, so renaming or deleting a category drops every recipe
+    of the category. The generation number changes on every invalidation: a value read from the
+    database is stored only if no invalidation happened while it was being read.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_size: Maximum number of cached recipes.
+            ttl: Seconds after which a cached recipe expires.
+            clock: Time source.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[int, Tuple[float, int | None, dict]] = OrderedDict()
+        self._by_category: Dict[int, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache statistics.
+        """
+
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations,
+                "invalidations": self.invalidations}
+
+    def get(self, recipe_id: int) -> dict | None:
+        """
+        Returns cached recipe.
+        Args:
+            recipe_id: Recipe ID.
+
+        Returns:
+            Serialized recipe or None if recipe is not cached or expired.
+        """
+
+        entry = self._entries.get(recipe_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= self.clock():
+            self._remove(recipe_id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(recipe_id)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, recipe_id: int, category_id: int | None, payload: dict, generation: int) -> None:
+        """
+        Stores serialized recipe.
+        Args:
+            recipe_id: Recipe ID.
+            category_id: Recipe category ID.
+            payload: Serialized recipe.
+            generation: Cache generation taken before the recipe was read from the database.
+
+        Returns:
+            None.
+        """
+
+        if generation != self.generation or self.max_size <= 0:
+            return
+        self._remove(recipe_id)
+        self._entries[recipe_id] = (self.clock() + self.ttl, category_id, payload)
+        if category_id is not None:
+            self._by_category.setdefault(category_id, set()).add(recipe_id)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, recipe_id: int) -> None:
+        """
+        Drops cached recipe.
+        Args:
+            recipe_id: Recipe ID.
+
+        Returns:
+            None.
+        """
+
+        self.generation += 1
+        if self._remove(recipe_id):
+            self.invalidations += 1
+
+    def invalidate_category(self, category_id: int) -> None:
+        """
+        Drops every cached recipe of the category.
+        Args:
+            category_id: Category ID.
+
+        Returns:
+            None.
+        """
+
+        self.generation += 1
+        for recipe_id in list(self._by_category.get(category_id, ())):
+            self._remove(recipe_id)
+            self.invalidations += 1
+
+    def add_views(self, batch: Dict[int, int]) -> None:
+        """
+        Adds flushed views to cached recipes.
+        Args:
+            batch: Mapping of recipe ID to number of flushed views.
+
+        Returns:
+            None.
+        """
+
+        self.generation += 1
+        for recipe_id, count in batch.items():
+            entry = self._entries.get(recipe_id)
+            if entry is not None:
+                entry[2]["views"] += count
+
+    def clear(self) -> None:
+        """
+        Drops all cached recipes.
+        Returns:
+            None.
+        """
+
+        self.generation += 1
+        self._entries.clear()
+        self._by_category.clear()
+
+    def _remove(self, recipe_id: int) -> bool:
+        entry = self._entries.pop(recipe_id, None)
+        if entry is None:
+            return False
+        category_id = entry[1]
+        if category_id is not None:
+            recipes = self._by_category[category_id]
+            recipes.discard(recipe_id)
+            if not recipes:
+                del self._by_category[category_id]
+        return True
+
+
+recipe_cache = RecipeCache(settings.recipe_cache_size, settings.recipe_cache_ttl)
+view_counter.on_flush(recipe_cache.add_views)
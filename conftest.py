@@ -0,0 +1,61 @@
+import os
+import shutil
+import asyncio
+import pytest
+import tempfile
+
+# Endpoints exceeding their declared query budgets fail the tests.
+os.environ.setdefault("COOKBOOK_ENFORCE_QUERY_BUDGETS", "true")
+# The application is tested on a database of its own migrated on startup, never on ./db.db.
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="cookbook-tests-")
+os.environ["COOKBOOK_DATABASE_URL"] = f"sqlite+aiosqlite:///{TEST_DIRECTORY}/test.db"
+
+from db import Base, create_engine
+from settings import Settings
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_DIRECTORY, ignore_errors=True)
+
+
+@pytest.fixture()
+def seed_rows():
+    """
+    Rows added to the database of session_factory, override it in a test module to seed its own rows.
+    """
+
+    return []
+
+
+@pytest.fixture()
+def session_factory(tmp_path, seed_rows):
+    """
+    Session factory of a fresh database in the temporary directory of the test.
+    """
+
+    engine = create_engine(Settings(database_url=f"sqlite+aiosqlite:///{tmp_path}/test.db"))
+
+    async def init():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with sessionmaker(engine, class_=AsyncSession)() as session:
+            session.add_all(seed_rows)
+            await session.commit()
+
+    asyncio.run(init())
+    yield sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture()
+def category(test_app, request):
+    """
+    Category created for the test through the API of the test module client, deleted with its recipes afterwards.
+    """
+
+    response = test_app.post("/categories/", json={"title": request.node.name[:50]})
+    assert response.status_code == 201
+    yield response.json()
+    test_app.delete(f"/categories/{response.json()['id']}")
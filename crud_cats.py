@@ -1,5 +1,11 @@
-from typing import List
-from sqlalchemy import select
+import pagination
+from typing import Any, List, Tuple, Set, Iterable
+from sqlalchemy import select, update, text
+from sqlalchemy.exc import IntegrityError
+from cache import recipe_cache
+from leaderboard import leaderboard
+from view_counter import view_counter
+from write_queue import after_commit, commit, rollback
 from models import RecipeCategory, Recipes
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -33,42 +39,116 @@ async def get_all_cats(session: AsyncSession) -> List[RecipeCategory]:
     return cats.scalars().all()
 
 
-async def get_all_by_cat(category: int, session: AsyncSession) -> List[Recipes]:
+async def get_all_cats_with_stats(session: AsyncSession) -> List[dict]:
     """
-    Returns all recipes in required category.
+    Returns all existing categories with aggregates of their recipes maintained by the database, so the
+    query reads categories only.
+    Args:
+        session: AsyncSession instance.
+
+    Returns:
+        List of dicts serializable by CategoryWithStats schema.
+    """
+
+    cats = await session.execute(select(RecipeCategory.id, RecipeCategory.title, RecipeCategory.recipe_count,
+                                        RecipeCategory.total_views, RecipeCategory.total_cooking_time))
+    return [{"id": cat.id, "title": cat.title,
+             "stats": {"recipes": cat.recipe_count, "views": cat.total_views,
+                       "avg_cooking_time": cat.total_cooking_time / cat.recipe_count if cat.recipe_count else None}}
+            for cat in cats]
+
+
+async def existing_ids(category_ids: Iterable[int], session: AsyncSession) -> Set[int]:
+    """
+    Returns which of provided category IDs exist.
+    Args:
+        category_ids: Category IDs.
+        session: AsyncSession instance.
+
+    Returns:
+        Set of existing category IDs.
+    """
+
+    category_ids = set(category_ids)
+    if not category_ids:
+        return set()
+    cats = await session.execute(select(RecipeCategory.id).where(RecipeCategory.id.in_(category_ids)))
+    return set(cats.scalars().all())
+
+
+async def get_all_by_cat(category: int, session: AsyncSession, limit: int | None = None,
+                         cursor: Tuple[int, int, int] | None = None) -> List[Recipes]:
+    """
+    Returns recipes in required category ordered by popularity.
     Args:
         category: Category ID.
         session: AsyncSession instance.
+        limit: Maximum number of recipes or None for all recipes.
+        cursor: (views, cooking_time, id) of the last recipe of the previous page.
 
     Returns:
         List of Recipe objects.
     """
 
-    recipes = await session.execute(select(Recipes.id, Recipes.title, RecipeCategory.title.label("category"),
-                                           Recipes.cooking_time, Recipes.views).join(RecipeCategory)
-                                    .where(Recipes.category == category)
-                                    .order_by(Recipes.views.desc(), Recipes.cooking_time))
-    return recipes.all()
+    query = (select(Recipes.id, Recipes.title, RecipeCategory.title.label("category"),
+                    Recipes.cooking_time, Recipes.views).join(RecipeCategory)
+             .where(Recipes.category == category)
+             .order_by(Recipes.views.desc(), Recipes.cooking_time, Recipes.id.desc()))
+    return await pagination.fetch(query, cursor, limit, session)
+
+
+class UnknownCategory(Exception):
+    """
+    Category to create or move recipes in does not exist.
+    """
 
 
-async def delete_cat(category_id: int, session: AsyncSession) -> RecipeCategory | None:
+async def delete_cat(category_id: int, session: AsyncSession,
+                     move_to: int | None = None) -> Tuple[Any | None, int]:
     """
-    Delete category by ID.
+    Delete category by ID with one statement. Recipes of the category are deleted by the database
+    or moved to another category beforehand.
     Args:
         category_id: Category ID.
         session: AsyncSession instance.
+        move_to: ID of category which receives recipes of deleted category, None to delete them.
 
     Returns:
-        Deleted category or None if category with provided ID not found.
+        Deleted category or None if category with provided ID not found, and number of deleted or moved recipes.
+
+    Raises:
+        UnknownCategory: Category to move recipes to does not exist or is the deleted category.
     """
 
-    category = await get_(category_id, session)
-    if category:
-        await session.delete(category)
-        await session.commit()
-        return category
+    if move_to is not None:
+        if move_to == category_id or await get_(move_to, session) is None:
+            raise UnknownCategory()
+        result = await session.execute(update(Recipes).where(Recipes.category == category_id)
+                                       .values(category=move_to).execution_options(synchronize_session=False))
+        affected = result.rowcount
     else:
-        return None
+        # IDs are read from the category index, they are needed to drop pending views of deleted recipes.
+        deleted = await session.execute(select(Recipes.id).where(Recipes.category == category_id))
+        deleted = deleted.scalars().all()
+        affected = len(deleted)
+    result = await session.execute(text("DELETE FROM recipe_cat WHERE id = :category_id RETURNING id, title"),
+                                   {"category_id": category_id})
+    category = result.one_or_none()
+    if category is None:
+        await rollback(session)
+        return None, 0
+    after_commit(session, lambda: recipe_cache.invalidate_category(category_id))
+    if move_to is None:
+        after_commit(session, lambda: view_counter.discard(deleted))
+    after_commit(session, lambda: leaderboard.remove_category(category_id, move_to))
+    await commit(session)
+    return category, affected
+
+
+class DuplicateCategory(Exception):
+    """
+    Category with the same title in any case already exists.
+    """
 
 
 async def create_cat(title: str, session: AsyncSession) -> RecipeCategory | None:
@@ -82,14 +162,17 @@ async def create_cat(title: str, session: AsyncSession) -> RecipeCategory | None
         RecipeCategory object or None if category with provided title already exists.
     """
 
-    exists = await session.execute(select(RecipeCategory).where(RecipeCategory.title.ilike(title)))
-    if exists.scalar():
+    category = RecipeCategory(title=title)
+    session.add(category)
+    try:
+        await session.flush()
+    except IntegrityError:
+        # Only the unique index of titles can be violated.
+        await rollback(session)
         return None
-    else:
-        category = RecipeCategory(title=title)
-        session.add(category)
-        await session.commit()
-        return category
+    after_commit(session, lambda: leaderboard.set_category(category.id, category.title))
+    await commit(session)
+    return category
 
 
 async def update_cat(title: str, category_id: int, session: AsyncSession) -> RecipeCategory | None:
@@ -101,13 +184,21 @@ async def update_cat(title: str, category_id: int, session: AsyncSession) -> Rec
         session: AsyncSession instance.
 
     Returns:
-        RecipeCategory object or None if category with provided ID not found.
+        Updated category or None if category with provided ID not found.
+
+    Raises:
+        DuplicateCategory: Another category with provided title already exists.
     """
 
-    category = await get_(category_id, session)
+    try:
+        result = await session.execute(text("UPDATE recipe_cat SET title = :title WHERE id = :category_id "
+                                            "RETURNING id, title"), {"title": title, "category_id": category_id})
+        category = result.one_or_none()
+    except IntegrityError:
+        await rollback(session)
+        raise DuplicateCategory()
     if category:
-        category.title = title
-        await session.commit()
-        return category
-    else:
-        return None
+        after_commit(session, lambda: recipe_cache.invalidate_category(category_id))
+        after_commit(session, lambda: leaderboard.set_category(category_id, category.title))
+    await commit(session)
+    return category
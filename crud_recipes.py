@@ -1,34 +1,298 @@
+import re
 import schemas
-from typing import List
-from sqlalchemy import update
-from sqlalchemy import select, case
-from models import Recipes, RecipeCategory
-from fastapi.encoders import jsonable_encoder
+import pagination
+from typing import List, Tuple, Dict, Any, AsyncIterator
+from sqlalchemy import insert
+from sqlalchemy import select, text, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql import Select, ColumnElement, operators
+from sqlalchemy.sql.expression import UnaryExpression
+from cache import recipe_cache
+from leaderboard import leaderboard
+from view_counter import view_counter
+from write_queue import after_commit, commit, rollback
+from crud_cats import UnknownCategory
+from models import Recipes, RecipeCategory, RECIPES_TSVECTOR
 from sqlalchemy.ext.asyncio import AsyncSession
 
+# Popularity part of the search rank: views / (views + SEARCH_VIEWS_HALF) grows from 0 to 1 and is
+# weighted by SEARCH_VIEWS_BOOST against the text rank, which is negative and lower for better matches.
+SEARCH_VIEWS_BOOST = 1.0
+SEARCH_VIEWS_HALF = 100
 
-async def get_all(session: AsyncSession) -> List[Recipes]:
+# Ingredients are separated by commas, semicolons or new lines. Quantities, units following them and notes
+# in parentheses are not a part of ingredient name.
+INGREDIENT_SEPARATORS = re.compile(r"[,;\n]+")
+INGREDIENT_NOTES = re.compile(r"\([^)]*\)|\d+(?:[.,/]\d+)?\s*(?:kg|g|mg|l|ml|tbsp|tsp|cups?|pcs)?\b")
+INGREDIENT_MAX_LENGTH = 100
+
+# Recipes with any of :names ingredients with numbers of matched and all their ingredients, ranked by coverage.
+BY_INGREDIENTS = text("""
+    SELECT * FROM (
+        SELECT recipes.id, recipes.title, recipe_cat.title AS category, recipes.cooking_time, recipes.views,
+            matched.ingredients AS ingredients_matched,
+            (SELECT count(*) FROM recipe_ingredients WHERE recipe_ingredients.recipe_id = recipes.id)
+                AS ingredients_total
+        FROM (
+            SELECT recipe_ingredients.recipe_id, count(*) AS ingredients
+            FROM ingredients
+            JOIN recipe_ingredients ON recipe_ingredients.ingredient_id = ingredients.id
+            WHERE ingredients.name IN :names
+            GROUP BY recipe_ingredients.recipe_id
+        ) AS matched
+        JOIN recipes ON recipes.id = matched.recipe_id
+        LEFT OUTER JOIN recipe_cat ON recipe_cat.id = recipes.category
+    ) AS ranked
+    ORDER BY CAST(ingredients_matched AS REAL) / ingredients_total DESC, ingredients_matched DESC,
+        views DESC, id DESC
+    LIMIT :limit OFFSET :offset
+""").bindparams(bindparam("names", expanding=True))
+
+
+def unindexed(column: InstrumentedAttribute) -> ColumnElement:
+    """
+    Returns column wrapped in unary plus, which keeps the value but stops SQLite from choosing an index
+    for a condition on it.
+    Args:
+        column: Model column.
+
+    Returns:
+        Column expression.
+    """
+
+    return UnaryExpression(column, operator=operators.custom_op("+"), type_=column.type)
+
+
+def select_all(sort: str = "popular", cooking_time_min: int | None = None, cooking_time_max: int | None = None,
+               views_min: int | None = None,
+               categories: List[int] | None = None) -> Tuple[Select, List[ColumnElement] | None]:
+    """
+    Builds query of recipes with category name matching the filters, ordered by the sort order.
+
+    Every sort order has an index over all recipes and one over a category. Only a filter on the leading
+    column of the sort key may choose the index, others are checked while the index is read in order,
+    so pages are neither read from a full table scan nor sorted. Several categories are merged from
+    their partitions of the category index. The newest recipes of all categories are read from the table
+    in primary key order, so every filter is checked on the rows read and a selective filter reads many
+    rows per page: an index on (cooking_time, id) would return ranges out of ID order, which need a sort.
+    Args:
+        sort: Name of the sort order from pagination.SORTS.
+        cooking_time_min: Minimum cooking time or None.
+        cooking_time_max: Maximum cooking time or None.
+        views_min: Minimum number of views or None.
+        categories: Category IDs or None for all categories.
+
+    Returns:
+        Tuple of query and conditions of category partitions or None.
+    """
+
+    key = pagination.SORTS[sort]
+    leading = key[0][0]
+    query = (select(Recipes.id.label("id"), Recipes.title, RecipeCategory.title.label("category"),
+                    Recipes.cooking_time, Recipes.views).outerjoin(RecipeCategory)
+             .order_by(*pagination.order(key)))
+    cooking_time = Recipes.cooking_time if leading is Recipes.cooking_time else unindexed(Recipes.cooking_time)
+    views = Recipes.views if leading is Recipes.views else unindexed(Recipes.views)
+    if cooking_time_min is not None:
+        query = query.where(cooking_time >= cooking_time_min)
+    if cooking_time_max is not None:
+        query = query.where(cooking_time <= cooking_time_max)
+    if views_min is not None:
+        query = query.where(views >= views_min)
+    if not categories:
+        return query, None
+    categories = list(dict.fromkeys(categories))
+    if len(categories) == 1:
+        return query.where(Recipes.category == categories[0]), None
+    return query, [Recipes.category == category for category in categories]
+
+
+async def get_all(session: AsyncSession, limit: int | None = None, cursor: Tuple[int, ...] | None = None,
+                  sort: str = "popular", cooking_time_min: int | None = None, cooking_time_max: int | None = None,
+                  views_min: int | None = None, categories: List[int] | None = None) -> List[Recipes]:
     """
-    Returns all existing recipes with category name.
+    Returns existing recipes with category name matching the filters, ordered by popularity or another
+    sort order.
     Args:
         session: AsyncSession instance.
+        limit: Maximum number of recipes or None for all recipes.
+        cursor: Sort key of the last recipe of the previous page, e.g. (views, cooking_time, id).
+        sort: Name of the sort order from pagination.SORTS.
+        cooking_time_min: Minimum cooking time or None.
+        cooking_time_max: Maximum cooking time or None.
+        views_min: Minimum number of views or None.
+        categories: Category IDs or None for all categories.
 
     Returns:
         List of Recipe objects.
     """
 
-    recipes = await session.execute(select(Recipes.id, Recipes.title,
-                                           (case([
-                                               (RecipeCategory.title is not None, RecipeCategory.title)
-                                           ],
-                                               else_=Recipes.category))
-                                           .label(
-                                               "category"),
-                                           Recipes.cooking_time, Recipes.views).outerjoin(RecipeCategory)
-                                    .order_by(Recipes.views.desc(), Recipes.cooking_time))
+    query, partitions = select_all(sort, cooking_time_min, cooking_time_max, views_min, categories)
+    return await pagination.fetch(query, cursor, limit, session, pagination.SORTS[sort], partitions)
+
+
+def foreign_key_violated(error: IntegrityError) -> bool:
+    """
+    Checks whether an integrity error is a violation of a foreign key, e.g. of recipe category.
+    Args:
+        error: IntegrityError raised by the driver.
+
+    Returns:
+        True for foreign key violations, False for other constraints.
+    """
+
+    # SQLSTATE of PostgreSQL, SQLite only reports the message.
+    return (getattr(error.orig, "sqlstate", None) == "23503"
+            or "FOREIGN KEY constraint failed" in str(error.orig))
+
+
+def search_words(query: str) -> List[str]:
+    """
+    Splits user input into words, dropping any full-text query syntax.
+    Args:
+        query: Search string.
+
+    Returns:
+        List of words.
+    """
+
+    return re.findall(r"\w+", query)
+
+
+def ingredient_names(ingredients: str) -> List[str]:
+    """
+    Parses free-form list of ingredients separated by commas, semicolons or new lines into normalized names:
+    lower case words without quantities, units and notes in parentheses.
+    Args:
+        ingredients: Ingredients of a recipe or of a query.
+
+    Returns:
+        List of unique names in order of appearance.
+    """
+
+    names = []
+    for ingredient in INGREDIENT_SEPARATORS.split(ingredients.lower()):
+        name = " ".join(re.findall(r"[^\W\d_]+", INGREDIENT_NOTES.sub(" ", ingredient)))
+        if name:
+            names.append(name[:INGREDIENT_MAX_LENGTH])
+    return list(dict.fromkeys(names))
+
+
+async def index_ingredients(recipes: List[Tuple[int, str]], session: AsyncSession, replace: bool = False) -> None:
+    """
+    Adds ingredients of recipes to the ingredient index, new names are added to the ingredient dictionary.
+    Args:
+        recipes: Pairs of recipe ID and its ingredients.
+        session: AsyncSession instance.
+        replace: Remove ingredients the recipes had before.
+
+    Returns:
+        None.
+    """
+
+    if replace:
+        await session.execute(text("DELETE FROM recipe_ingredients WHERE recipe_id = :recipe_id"),
+                              [{"recipe_id": recipe_id} for recipe_id, _ in recipes])
+    links = [{"recipe_id": recipe_id, "name": name}
+             for recipe_id, ingredients in recipes for name in ingredient_names(ingredients)]
+    if not links:
+        return
+    await session.execute(text("INSERT INTO ingredients (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                          [{"name": name} for name in dict.fromkeys(link["name"] for link in links)])
+    await session.execute(text("INSERT INTO recipe_ingredients (ingredient_id, recipe_id) "
+                               "SELECT id, :recipe_id FROM ingredients WHERE name = :name"), links)
+
+
+async def by_ingredients(names: List[str], session: AsyncSession, limit: int | None = None,
+                         offset: int = 0) -> List[Recipes]:
+    """
+    Returns recipes with any of the ingredients ranked by the share of their ingredients which are
+    available, then by the number of available ingredients and views. Recipes are found by ranges of
+    the ingredient index, only recipes with a matching ingredient are read.
+    Args:
+        names: Normalized names built by ingredient_names.
+        session: AsyncSession instance.
+        limit: Maximum number of recipes or None for all recipes.
+        offset: Number of skipped recipes.
+
+    Returns:
+        List of Recipe objects with number of matched and all ingredients.
+    """
+
+    if limit is None and session.bind.dialect.name != "postgresql":
+        limit = -1
+    recipes = await session.execute(BY_INGREDIENTS, {"names": names, "limit": limit, "offset": offset})
     return recipes.all()
 
 
+async def search(words: List[str], session: AsyncSession, category: int | None = None, limit: int | None = None,
+                 offset: int = 0) -> List[Recipes]:
+    """
+    Returns recipes which ingredients or description contain all words, the last one as a prefix, ranked
+    by full-text relevance combined with views.
+    Args:
+        words: Words built by search_words.
+        session: AsyncSession instance.
+        category: Category ID to search in or None for all categories.
+        limit: Maximum number of recipes or None for all recipes.
+        offset: Number of skipped recipes.
+
+    Returns:
+        List of Recipe objects.
+    """
+
+    in_category = "AND recipes.category = :category" if category is not None else ""
+    popularity = "CAST(:boost AS REAL) * recipes.views / (recipes.views + :half)"
+    if session.bind.dialect.name == "postgresql":
+        query = " & ".join(words) + ":*"
+        statement = f"""
+            SELECT recipes.id, recipes.title, recipe_cat.title AS category, recipes.cooking_time, recipes.views
+            FROM recipes
+            LEFT OUTER JOIN recipe_cat ON recipe_cat.id = recipes.category
+            WHERE {RECIPES_TSVECTOR} @@ to_tsquery('simple', :query) {in_category}
+            ORDER BY -ts_rank({RECIPES_TSVECTOR}, to_tsquery('simple', :query)) - {popularity}, recipes.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+    else:
+        query = " ".join(f'"{word}"' for word in words) + "*"
+        statement = f"""
+            SELECT recipes.id, recipes.title, recipe_cat.title AS category, recipes.cooking_time, recipes.views
+            FROM recipes_fts
+            JOIN recipes ON recipes.id = recipes_fts.rowid
+            LEFT OUTER JOIN recipe_cat ON recipe_cat.id = recipes.category
+            WHERE recipes_fts MATCH :query {in_category}
+            ORDER BY bm25(recipes_fts) - {popularity}, recipes.id DESC
+            LIMIT :limit OFFSET :offset
+        """
+        limit = -1 if limit is None else limit
+    recipes = await session.execute(text(statement), {"query": query, "category": category, "limit": limit,
+                                                       "offset": offset, "boost": SEARCH_VIEWS_BOOST,
+                                                       "half": SEARCH_VIEWS_HALF})
+    return recipes.all()
+
+
+async def stream_all(session: AsyncSession, batch_size: int = 1000) -> AsyncIterator[List[Recipes]]:
+    """
+    Streams all recipes with category name from a server-side cursor, ordered by ID.
+    Args:
+        session: AsyncSession instance.
+        batch_size: Number of recipes fetched at once.
+
+    Returns:
+        Async iterator of recipe batches.
+    """
+
+    recipes = await session.stream(select(Recipes.id, Recipes.title, RecipeCategory.title.label("category"),
+                                          Recipes.cooking_time, Recipes.ingredients, Recipes.description,
+                                          Recipes.views)
+                                   .outerjoin(RecipeCategory)
+                                   .order_by(Recipes.id)
+                                   .execution_options(yield_per=batch_size))
+    async for partition in recipes.partitions(batch_size):
+        yield partition
+
+
 async def get_(recipe_id: int, session: AsyncSession) -> Recipes:
     """
     Returns recipe by ID.
@@ -44,6 +308,17 @@ async def get_(recipe_id: int, session: AsyncSession) -> Recipes:
     return recipe.scalar()
 
 
+def select_with_cat() -> Select:
+    """
+    Returns query of recipes with category name, version and category ID.
+    """
+
+    return (select(Recipes.id, Recipes.title, RecipeCategory.title.label("category"), Recipes.cooking_time,
+                   Recipes.ingredients, Recipes.description, Recipes.views, Recipes.version,
+                   Recipes.category.label("category_id"))
+            .outerjoin(RecipeCategory))
+
+
 async def get_with_cat(recipe_id: int, session: AsyncSession, ) -> Recipes:
     """
         Returns recipe by ID with category name.
@@ -55,19 +330,75 @@ async def get_with_cat(recipe_id: int, session: AsyncSession, ) -> Recipes:
         Recipe object.
     """
 
-    recipe = await session.execute(select(Recipes.id, Recipes.title,
-                                          (case([
-                                              (RecipeCategory.title is not None, RecipeCategory.title)
-                                          ],
-                                              else_=Recipes.category))
-                                          .label(
-                                              "category"),
-                                          Recipes.cooking_time, Recipes.ingredients, Recipes.description, Recipes.views)
-                                   .outerjoin(RecipeCategory)
-                                   .where(Recipes.id == recipe_id))
+    recipe = await session.execute(select_with_cat().where(Recipes.id == recipe_id))
     return recipe.one_or_none()
 
 
+def serialize(recipe: Any) -> dict:
+    """
+    Serializes recipe row with category name for the recipe cache.
+    Args:
+        recipe: Recipe row with version.
+
+    Returns:
+        Serialized RecipeOut with recipe version.
+    """
+
+    return dict(schemas.RecipeOut.from_orm(recipe).dict(), version=recipe.version)
+
+
+async def get_cached(recipe_id: int, session: AsyncSession) -> dict | None:
+    """
+    Returns serialized recipe by ID with category name, reading through the recipe cache.
+    Views not flushed to the database yet are added to the stored value.
+    Args:
+        recipe_id: Recipe ID.
+        session: AsyncSession instance.
+
+    Returns:
+        Serialized RecipeOut with recipe version or None if recipe with provided ID not found.
+    """
+
+    payload = recipe_cache.get(recipe_id)
+    if payload is None:
+        generation = recipe_cache.generation
+        recipe = await get_with_cat(recipe_id, session)
+        if recipe is None:
+            return None
+        payload = serialize(recipe)
+        recipe_cache.put(recipe_id, recipe.category_id, payload, generation)
+    return dict(payload, views=payload["views"] + view_counter.pending_for(recipe_id))
+
+
+async def get_many_cached(recipe_ids: List[int], session: AsyncSession) -> Dict[int, dict]:
+    """
+    Returns serialized recipes by IDs with category name, reading through the recipe cache. Recipes which
+    are not cached are read with one query. Views not flushed to the database yet are added.
+    Args:
+        recipe_ids: Recipe IDs.
+        session: AsyncSession instance.
+
+    Returns:
+        Mapping of ID of found recipe to serialized RecipeOut with recipe version.
+    """
+
+    recipes = {}
+    missing = []
+    for recipe_id in recipe_ids:
+        payload = recipe_cache.get(recipe_id)
+        if payload is None:
+            missing.append(recipe_id)
+        else:
+            recipes[recipe_id] = payload
+    if missing:
+        generation = recipe_cache.generation
+        for recipe in await session.execute(select_with_cat().where(Recipes.id.in_(missing))):
+            payload = recipes[recipe.id] = serialize(recipe)
+            recipe_cache.put(recipe.id, recipe.category_id, payload, generation)
+    return {recipe_id: dict(payload, views=payload["views"] + view_counter.pending_for(recipe_id))
+            for recipe_id, payload in recipes.items()}
+
+
 async def delete_(recipe_id: int, session: AsyncSession) -> Recipes | None:
     """
     Delete recipe by provided ID.
@@ -82,47 +413,140 @@ async def delete_(recipe_id: int, session: AsyncSession) -> Recipes | None:
     recipe = await get_(recipe_id, session)
     if recipe:
         await session.delete(recipe)
-        await session.commit()
+        after_commit(session, lambda: recipe_cache.invalidate(recipe_id))
+        after_commit(session, lambda: view_counter.discard([recipe_id]))
+        after_commit(session, lambda: leaderboard.remove(recipe_id))
+        await commit(session)
         return recipe
     else:
         return None
 
 
-async def update_(recipe: schemas.RecipeUpdate, recipe_id: int, session: AsyncSession) -> Recipes | None:
+class VersionConflict(Exception):
     """
-    Updates recipe data.
+    Recipe was changed since the version the update is based on.
+    """
+
+
+async def update_(recipe: schemas.RecipeUpdate, recipe_id: int, session: AsyncSession,
+                  versions: List[int] | None = None) -> Any | None:
+    """
+    Updates provided fields of recipe in one statement and returns the updated recipe with category name.
+    Changed ingredients are reindexed in the same transaction.
     Args:
-        recipe: Data to update.
+        recipe: Data to update, only explicitly set fields are written.
         recipe_id: Recipe ID.
         session: AsyncSession instance.
+        versions: Versions of recipe the update is allowed for, None to update any version.
 
     Returns:
-        Recipe object or None if recipe with provided ID not found.
+        Updated recipe row or None if recipe with provided ID not found.
+
+    Raises:
+        VersionConflict: Recipe exists, but its version is not one of provided versions.
+        UnknownCategory: Category to move recipe to does not exist.
     """
 
-    new_data = recipe.dict(exclude_unset=True)
-    current_recipe = await get_(recipe_id, session)
-    if current_recipe:
-        recipe_model = schemas.RecipeUpdate(**current_recipe.__dict__)
-        new_recipe = recipe_model.copy(update=new_data)
-        await session.execute(update(Recipes).where(Recipes.id == recipe_id).values(jsonable_encoder(new_recipe)))
-        await session.commit()
-        return await get_(recipe_id, session)
+    if versions is not None and not versions:
+        if await get_(recipe_id, session) is None:
+            return None
+        raise VersionConflict()
+    values = recipe.dict(exclude_unset=True)
+    # Column names come from RecipeUpdate fields, values are bound.
+    assignments = [f"{column} = :{column}" for column in values]
+    if assignments:
+        assignments.append("version = version + 1")
     else:
+        assignments.append("version = version")
+    condition = "id = :recipe_id"
+    if versions is not None:
+        condition += f" AND version IN ({', '.join(f':version_{index}' for index in range(len(versions)))})"
+        values.update((f"version_{index}", version) for index, version in enumerate(versions))
+    try:
+        result = await session.execute(text(
+            f"UPDATE recipes SET {', '.join(assignments)} WHERE {condition} "
+            "RETURNING id, title, cooking_time, ingredients, description, views, version, category AS category_id, "
+            "(SELECT recipe_cat.title FROM recipe_cat WHERE recipe_cat.id = recipes.category) AS category"
+        ), dict(values, recipe_id=recipe_id))
+    except IntegrityError as error:
+        await rollback(session)
+        if foreign_key_violated(error):
+            raise UnknownCategory()
+        raise
+    updated = result.one_or_none()
+    if updated is None:
+        await rollback(session)
+        if versions is not None and await get_(recipe_id, session) is not None:
+            raise VersionConflict()
         return None
+    if "ingredients" in values:
+        await index_ingredients([(recipe_id, updated.ingredients)], session, replace=True)
+
+    def refresh():
+        recipe_cache.invalidate(recipe_id)
+        recipe_cache.put(recipe_id, updated.category_id, serialize(updated), recipe_cache.generation)
+        leaderboard.put(recipe_id, updated.title, updated.category_id, updated.cooking_time, updated.views)
+
+    after_commit(session, refresh)
+    await commit(session)
+    return updated
 
 
 async def create(recipe: Recipes, session: AsyncSession) -> Recipes:
     """
-    Creates new recipe.
+    Creates new recipe and adds its ingredients to the ingredient index.
     Args:
         recipe: Data of new recipe in recipe object.
         session: AsyncSession instance.
 
     Returns:
         Recipe object.
+
+    Raises:
+        UnknownCategory: Category of the recipe does not exist.
     """
 
     session.add(recipe)
-    await session.commit()
+    try:
+        await session.flush()
+    except IntegrityError as error:
+        await rollback(session)
+        if foreign_key_violated(error):
+            raise UnknownCategory()
+        raise
+    await index_ingredients([(recipe.id, recipe.ingredients)], session)
+    after_commit(session, lambda: leaderboard.put(recipe.id, recipe.title, recipe.category, recipe.cooking_time,
+                                                  recipe.views or 0))
+    await commit(session)
     return recipe
+
+
+async def create_many(recipes: List[Dict[str, Any]], session: AsyncSession) -> List[int]:
+    """
+    Creates recipes with one executemany INSERT (multi-row INSERT ... RETURNING in PostgreSQL)
+    and indexes their ingredients in one transaction.
+    Args:
+        recipes: Data of new recipes serialized by RecipeIn schema.
+        session: AsyncSession instance.
+
+    Returns:
+        IDs of created recipes in order of provided data.
+    """
+
+    if not recipes:
+        return []
+    values = [dict(recipe, views=0) for recipe in recipes]
+    if session.bind.dialect.name == "postgresql":
+        created = await session.execute(insert(Recipes.__table__).values(values).returning(Recipes.id))
+        ids = created.scalars().all()
+    else:
+        await session.execute(insert(Recipes.__table__), values)
+        # Rows inserted by one statement under the write lock get consecutive rowids.
+        last_id = (await session.execute(text("SELECT last_insert_rowid()"))).scalar()
+        ids = list(range(last_id - len(recipes) + 1, last_id + 1))
+    await index_ingredients([(recipe_id, recipe["ingredients"]) for recipe_id, recipe in zip(ids, values)], session)
+    for recipe_id, recipe in zip(ids, values):
+        after_commit(session, lambda recipe_id=recipe_id, recipe=recipe: leaderboard.put(
+            recipe_id, recipe["title"], recipe["category"], recipe["cooking_time"], 0))
+    await commit(session)
+    return ids
@@ -1,13 +1,113 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
+from settings import settings, Settings
+from metrics import TimedQueuePool
 
-DATABASE_URL = "sqlite+aiosqlite:///./db.db?pragma_foreign_keys=ON"
+DATABASE_URL = settings.database_url
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Pragmas which make sense for a read-only SQLite connection.
+READ_PRAGMAS = ("busy_timeout", "cache_size", "mmap_size", "temp_store")
+
+
+def apply_pragmas(dbapi_connection, pragmas: dict) -> None:
+    """
+    Applies pragmas to a new SQLite connection.
+    Args:
+        dbapi_connection: DBAPI connection.
+        pragmas: Validated pragma values.
+
+    Returns:
+        None.
+    """
+
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def begin_immediate(connection) -> None:
+    """
+    Starts SQLite transaction taking the write lock at once. A deferred transaction which reads first
+    fails with "database is locked" when another process writes, instead of waiting for busy_timeout.
+    Args:
+        connection: Connection instance.
+
+    Returns:
+        None.
+    """
+
+    # Issued on the driver connection like the implicit BEGIN of the driver, so it is not counted as a statement.
+    cursor = connection.connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.close()
+
+
+async def read_pragmas(session: AsyncSession, names) -> dict:
+    """
+    Reads current values of SQLite pragmas.
+    Args:
+        session: AsyncSession instance.
+        names: Validated pragma names.
+
+    Returns:
+        Mapping of pragma name to its value.
+    """
+
+    return {name: (await session.execute(text(f"PRAGMA {name}"))).scalar() for name in names}
+
+
+def create_engine(config: Settings, read_only: bool = False) -> AsyncEngine:
+    """
+    Creates database engine from settings.
+    Args:
+        config: Settings instance.
+        read_only: Create engine for the read database.
+
+    Returns:
+        AsyncEngine instance.
+    """
+
+    url = config.read_url if read_only else config.database_url
+    options = {"echo": config.echo, "pool_recycle": config.pool_recycle}
+    if config.is_sqlite and make_url(url).database in (None, "", ":memory:"):
+        options["poolclass"] = StaticPool
+    else:
+        # SQLite file databases get a connection pool as well, so pragmas are not applied on every checkout.
+        options.update(poolclass=TimedQueuePool if config.metrics else AsyncAdaptedQueuePool,
+                       pool_logging_name="read" if read_only else "write", max_overflow=config.max_overflow,
+                       pool_size=config.read_pool_size if read_only else config.pool_size,
+                       pool_timeout=config.pool_timeout)
+    new_engine = create_async_engine(url, **options)
+    if make_url(url).get_backend_name() == "sqlite":
+        pragmas = config.sqlite_pragmas
+        if read_only:
+            pragmas = {name: value for name, value in pragmas.items() if name in READ_PRAGMAS}
+            pragmas["query_only"] = "ON"
+        event.listen(new_engine.sync_engine, "connect",
+                     lambda dbapi_connection, record: apply_pragmas(dbapi_connection, pragmas))
+        if not read_only:
+            # The driver doesn't begin transactions itself, they are started by begin_immediate.
+            event.listen(new_engine.sync_engine, "connect",
+                         lambda dbapi_connection, record: setattr(dbapi_connection, "isolation_level", None))
+            event.listen(new_engine.sync_engine, "begin", begin_immediate)
+    return new_engine
+
+
+engine = create_engine(settings)
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
 )
 
-Base = declarative_base()
+# Reads go to a separate pool of read-only connections (or a replica), so they don't queue behind writes.
+# A single in-memory database can't be shared between pools, then reads use the main engine.
+read_engine = create_engine(settings, read_only=True) if settings.read_url != settings.database_url else engine
+async_read_session = sessionmaker(
+    read_engine, expire_on_commit=False, class_=AsyncSession
+)
 
+Base = declarative_base()
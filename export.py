@@ -0,0 +1,41 @@
+import io
+import csv
+import json
+from typing import AsyncIterator
+from db import async_read_session
+from crud_recipes import stream_all
+
+EXPORT_FIELDS = ("id", "title", "category", "cooking_time", "ingredients", "description", "views")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def export_recipes(fmt: str) -> AsyncIterator[bytes]:
+    """
+    Serializes all recipes batch by batch, so memory use does not depend on the number of recipes.
+    Uses its own session, which lives as long as the response is streamed.
+    Args:
+        fmt: Export format, "ndjson" or "csv".
+
+    Returns:
+        Async iterator of encoded chunks.
+    """
+
+    async with async_read_session() as session:
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            async for recipes in stream_all(session):
+                writer.writerows(recipes)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue().encode()
+        else:
+            async for recipes in stream_all(session):
+                yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, recipe)), ensure_ascii=False) + "\n"
+                              for recipe in recipes).encode()
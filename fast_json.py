@@ -0,0 +1,85 @@
+import json
+from typing import Any, Iterable, Mapping
+from operator import attrgetter
+from fastapi import Response
+from pydantic import BaseModel
+import schemas
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class RowEncoder:
+    """
+    Precompiled encoder of result rows into the JSON produced by the response model, without building
+    a model instance per row.
+
+    Only fields of the model are written, in model order. Values of str fields are converted with str()
+    as pydantic does; other values are expected to be already valid, which holds for rows read with the
+    queries the model is used for.
+    """
+
+    def __init__(self, model: type[BaseModel]):
+        """
+        Args:
+            model: Response model with orm_mode.
+        """
+
+        self.names = tuple(model.__fields__)
+        self.get = attrgetter(*self.names)
+        self.str_positions = tuple(position for position, field in enumerate(model.__fields__.values())
+                                   if field.type_ is str)
+
+    def to_list(self, rows: Iterable[Any]) -> list:
+        """
+        Converts rows into a list of dicts.
+        Args:
+            rows: Result rows.
+
+        Returns:
+            List of dicts ready for JSON encoding.
+        """
+
+        names, get, str_positions = self.names, self.get, self.str_positions
+        items = []
+        for row in rows:
+            values = list(get(row))
+            for position in str_positions:
+                value = values[position]
+                if value is not None and type(value) is not str:
+                    values[position] = str(value)
+            items.append(dict(zip(names, values)))
+        return items
+
+    def encode(self, rows: Iterable[Any]) -> bytes:
+        """
+        Encodes rows into JSON array, byte for byte equal to the output of JSONResponse.
+        Args:
+            rows: Result rows.
+
+        Returns:
+            Encoded JSON.
+        """
+
+        items = self.to_list(rows)
+        if orjson is not None:
+            return orjson.dumps(items)
+        return json.dumps(items, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def response(self, rows: Iterable[Any], headers: Mapping[str, str] | None = None) -> Response:
+        """
+        Builds JSON response from rows.
+        Args:
+            rows: Result rows.
+            headers: Response headers.
+
+        Returns:
+            Response object.
+        """
+
+        return Response(self.encode(rows), media_type="application/json", headers=headers)
+
+
+recipe_list_encoder = RowEncoder(schemas.RecipeOutList)
@@ -0,0 +1,270 @@
+import time
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Recipes, RecipeCategory
+from settings import settings
+from view_counter import view_counter
+
+# Sort key of a recipe in popularity order: the most viewed first, then the fastest to cook, then the newest.
+Key = Tuple[int, int, int]
+
+
+def popularity_key(recipe_id: int, cooking_time: int, views: int) -> Key:
+    """
+    Returns sort key of recipe, ascending keys are in popularity order.
+    Args:
+        recipe_id: Recipe ID.
+        cooking_time: Cooking time.
+        views: Number of views.
+
+    Returns:
+        Popularity key.
+    """
+
+    return -views, cooking_time, -recipe_id
+
+
+class Leaderboard:
+    """
+    In-memory popularity ranking of all recipes and of recipes in every category.
+
+    Rankings are sorted lists of popularity keys, built from the database on first use and kept up
+    to date by recipe and category mutations and by flushed views, so the top of a ranking is read
+    without a query. Changes made before the first load are already in the database and are skipped.
+    Changes made by other processes are only seen after max_age seconds, when the rankings are built again.
+    """
+
+    def __init__(self, max_age: float | None = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_age: Seconds after which rankings are built again, never if None.
+            clock: Time source.
+        """
+
+        self.max_age = max_age
+        self.clock = clock
+        self.loaded = False
+        self._loaded_at = 0.0
+        self._changes = 0
+        self._recipes: Dict[int, Tuple[Key, str, int | None]] = {}
+        self._ranking: List[Key] = []
+        self._by_category: Dict[int, List[Key]] = {}
+        self._categories: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._recipes)
+
+    @property
+    def fresh(self) -> bool:
+        """
+        Rankings are loaded and not older than max_age.
+        """
+
+        return self.loaded and (self.max_age is None or self.clock() - self._loaded_at < self.max_age)
+
+    async def load(self, session: AsyncSession) -> None:
+        """
+        Builds rankings from the database. Reads again if rankings were changed while reading.
+        Args:
+            session: AsyncSession instance.
+
+        Returns:
+            None.
+        """
+
+        loaded_at = self.clock()
+        while True:
+            changes = self._changes
+            categories = await session.execute(select(RecipeCategory.id, RecipeCategory.title))
+            recipes = await session.execute(select(Recipes.id, Recipes.title, Recipes.category,
+                                                   Recipes.cooking_time, Recipes.views))
+            if changes == self._changes:
+                break
+            # Start a new transaction, the previous one doesn't see the changes.
+            await session.rollback()
+        self._categories = dict(categories.all())
+        self._recipes = {}
+        self._by_category = {category_id: [] for category_id in self._categories}
+        for recipe_id, title, category_id, cooking_time, views in recipes:
+            key = popularity_key(recipe_id, cooking_time, views or 0)
+            self._recipes[recipe_id] = (key, title, category_id)
+            if category_id is not None:
+                self._by_category.setdefault(category_id, []).append(key)
+        self._ranking = sorted(entry[0] for entry in self._recipes.values())
+        for ranking in self._by_category.values():
+            ranking.sort()
+        self.loaded = True
+        self._loaded_at = loaded_at
+
+    def top(self, n: int, category_id: int | None = None, pending: Dict[int, int] | None = None) -> List[dict] | None:
+        """
+        Returns the most popular recipes.
+        Args:
+            n: Number of recipes.
+            category_id: Category ID or None for all recipes.
+            pending: Mapping of recipe ID to number of views which are not flushed yet, added to the rankings.
+
+        Returns:
+            Serialized RecipeOutList objects or None if category does not exist.
+        """
+
+        if category_id is None:
+            ranking = self._ranking
+        else:
+            ranking = self._by_category.get(category_id)
+            if ranking is None:
+                return None
+        keys = ranking[:n]
+        if pending:
+            # Pending views only move recipes up, the top is among the current one and the recipes viewed.
+            candidates = {-key[2]: key for key in keys}
+            for recipe_id in pending:
+                recipe = self._recipes.get(recipe_id)
+                if recipe is not None and (category_id is None or recipe[2] == category_id):
+                    candidates[recipe_id] = recipe[0]
+            keys = sorted((key[0] - pending.get(recipe_id, 0), key[1], key[2])
+                          for recipe_id, key in candidates.items())[:n]
+        top = []
+        for key in keys:
+            recipe_id = -key[2]
+            title, category_id = self._recipes[recipe_id][1:]
+            top.append({"title": title, "cooking_time": key[1], "category": self._categories.get(category_id),
+                        "views": -key[0], "id": recipe_id})
+        return top
+
+    def put(self, recipe_id: int, title: str, category_id: int | None, cooking_time: int, views: int) -> None:
+        """
+        Adds created recipe or replaces updated recipe.
+        Args:
+            recipe_id: Recipe ID.
+            title: Recipe title.
+            category_id: Category ID.
+            cooking_time: Cooking time.
+            views: Number of views stored in the database.
+
+        Returns:
+            None.
+        """
+
+        self._changes += 1
+        if not self.loaded:
+            return
+        self._discard(recipe_id)
+        key = popularity_key(recipe_id, cooking_time, views)
+        self._recipes[recipe_id] = (key, title, category_id)
+        insort(self._ranking, key)
+        if category_id is not None:
+            insort(self._by_category.setdefault(category_id, []), key)
+
+    def remove(self, recipe_id: int) -> None:
+        """
+        Removes deleted recipe.
+        Args:
+            recipe_id: Recipe ID.
+
+        Returns:
+            None.
+        """
+
+        self._changes += 1
+        if self.loaded:
+            self._discard(recipe_id)
+
+    def add_views(self, batch: Dict[int, int]) -> None:
+        """
+        Moves recipes up by flushed views.
+        Args:
+            batch: Mapping of recipe ID to number of flushed views.
+
+        Returns:
+            None.
+        """
+
+        self._changes += 1
+        if not self.loaded:
+            return
+        for recipe_id, count in batch.items():
+            entry = self._recipes.get(recipe_id)
+            if entry is not None:
+                key, title, category_id = entry
+                self.put(recipe_id, title, category_id, key[1], count - key[0])
+
+    def set_category(self, category_id: int, title: str) -> None:
+        """
+        Adds created category or renames existing one.
+        Args:
+            category_id: Category ID.
+            title: Category title.
+
+        Returns:
+            None.
+        """
+
+        self._changes += 1
+        if self.loaded:
+            self._categories[category_id] = title
+            self._by_category.setdefault(category_id, [])
+
+    def remove_category(self, category_id: int, move_to: int | None = None) -> None:
+        """
+        Removes deleted category with its recipes or moves the recipes to another category.
+        Args:
+            category_id: Category ID.
+            move_to: ID of category which received the recipes, None if they were deleted.
+
+        Returns:
+            None.
+        """
+
+        self._changes += 1
+        if not self.loaded:
+            return
+        self._categories.pop(category_id, None)
+        ranking = self._by_category.pop(category_id, [])
+        if move_to is not None:
+            for key in ranking:
+                recipe_id = -key[2]
+                self._recipes[recipe_id] = (key, self._recipes[recipe_id][1], move_to)
+            target = self._by_category.setdefault(move_to, [])
+            target.extend(ranking)
+            target.sort()
+        elif ranking:
+            for key in ranking:
+                del self._recipes[-key[2]]
+            removed = set(ranking)
+            self._ranking = [key for key in self._ranking if key not in removed]
+
+    async def check(self, session: AsyncSession) -> dict:
+        """
+        Compares rankings with rankings recomputed from the database.
+        Args:
+            session: AsyncSession instance.
+
+        Returns:
+            Number of recipes, IDs of recipes which differ and whether rankings and category titles match.
+        """
+
+        expected = Leaderboard()
+        await expected.load(session)
+        mismatched = sorted(recipe_id for recipe_id in self._recipes.keys() | expected._recipes.keys()
+                            if self._recipes.get(recipe_id) != expected._recipes.get(recipe_id))
+        rankings = self._ranking == expected._ranking and self._by_category == expected._by_category
+        categories = self._categories == expected._categories
+        return {"consistent": not mismatched and rankings and categories, "recipes": len(expected),
+                "mismatched": mismatched, "rankings": rankings, "categories": categories}
+
+    def _discard(self, recipe_id: int) -> None:
+        entry = self._recipes.pop(recipe_id, None)
+        if entry is None:
+            return
+        key, _, category_id = entry
+        del self._ranking[bisect_left(self._ranking, key)]
+        ranking = self._by_category.get(category_id)
+        if ranking:
+            del ranking[bisect_left(ranking, key)]
+
+
+leaderboard = Leaderboard(settings.leaderboard_ttl)
+view_counter.on_flush(leaderboard.add_views)
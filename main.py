@@ -1,13 +1,31 @@
-import models
+import logging
+import metrics
+import query_log
 import schemas
+import migrations
+import bulk_import
+import export
 import uvicorn
-from typing import List
-from db import engine, async_session
+from typing import List, Tuple, Union
+from pagination import page_params, sorted_page_params, split_page, offset_params, split_offset_page, MAX_PAGE_SIZE
+from pagination import SORTS
+from db import engine, read_engine, async_session, async_read_session, read_pragmas
+from settings import settings
+from view_counter import view_counter
 from models import RecipeCategory, Recipes
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi import FastAPI, HTTPException, Path, Body, Depends
-from crud_recipes import get_with_cat, get_all, create, delete_, update_
-from crud_cats import get_all_cats, get_all_by_cat, delete_cat, create_cat, update_cat
+from fastapi import FastAPI, HTTPException, Path, Body, Depends, Response, Query, Request, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from cache import recipe_cache
+from leaderboard import leaderboard
+from write_queue import write_queue
+from versions import collection_versions, none_match, RECIPES, CATEGORIES
+from fast_json import recipe_list_encoder
+from crud_recipes import get_cached, get_many_cached, get_all, create, delete_, update_, search, search_words
+from crud_recipes import VersionConflict, ingredient_names, by_ingredients
+from crud_cats import get_all_cats, get_all_cats_with_stats, get_all_by_cat, delete_cat, create_cat, update_cat
+from crud_cats import DuplicateCategory, UnknownCategory
+from query_log import query_budget
 
 tags_metadata = [
     {
@@ -18,6 +36,10 @@ tags_metadata = [
         "name": "Categories",
         "description": "Operations with categories.",
     },
+    {
+        "name": "Diagnostics",
+        "description": "Service state.",
+    },
 ]
 
 description = """
@@ -28,28 +50,65 @@ CookBook API manages recipes divided by category and ordered by popularity(views
 You will be able to:
 
 * View recipe by ID.
-* View all recipes.
-* View recipes by category.
-* Update recipe by ID.
+* View many recipes by IDs at once.
+* View the most popular recipes.
+* Search recipes by ingredients and description.
+* Find recipes which can be cooked with available ingredients.
+* View all recipes page by page.
+* Filter recipes by cooking time, views and categories, sort them by popularity, cooking time or novelty.
+* View recipes by category page by page.
+* Update recipe by ID, optionally only if it was not changed since the version in If-Match header.
 * Delete recipe by ID.
 * Create new recipe.
+* Import many recipes from JSON array or NDJSON.
+* Export all recipes to NDJSON or CSV.
 
 ## Categories
 
 You will be able to:
 
-* View all categories.
+* View all categories, optionally with number of recipes, their views and average cooking time.
 * Update category by ID.
-* Delete category by ID.
+* Delete category by ID with its recipes or moving them to another category.
 * Create new category.
+
+## Diagnostics
+
+You will be able to:
+
+* View recipe cache statistics.
+* Check the popularity leaderboard against the database.
+* Read request, SQL and connection pool metrics in Prometheus format.
+* View database settings.
 """
 
 app = FastAPI(title="CookBook", openapi_tags=tags_metadata, description=description)
+if settings.metrics:
+    app.add_middleware(metrics.MetricsMiddleware)
+if query_log.enabled():
+    # Added last to wrap the metrics middleware, which reads the statements it collects.
+    app.add_middleware(query_log.QueryCountMiddleware)
+    query_log.instrument(engine)
+    if read_engine is not engine:
+        query_log.instrument(read_engine)
+
+logger = logging.getLogger(__name__)
+
 
+async def get_read_session() -> AsyncSession:
+    """
+    Getter of session bound to the read-only engine.
+    Returns:
+        Asyncsession instance.
+    """
 
-async def get_session() -> AsyncSession:
+    async with async_read_session() as session:
+        yield session
+
+
+async def get_write_session() -> AsyncSession:
     """
-    Session getter.
+    Getter of session for mutations.
     Returns:
         Asyncsession instance.
     """
@@ -58,16 +117,54 @@ async def get_session() -> AsyncSession:
         yield session
 
 
+def recipe_etag(version: int) -> str:
+    """
+    Returns entity tag of recipe data. Views are not a part of it.
+    Args:
+        version: Recipe version.
+
+    Returns:
+        Quoted entity tag.
+    """
+
+    return f'"{version}"'
+
+
+def if_match_versions(if_match: str | None) -> List[int] | None:
+    """
+    Parses If-Match header into recipe versions.
+    Args:
+        if_match: Header value.
+
+    Returns:
+        List of versions, empty if no tag can match, or None if any version matches.
+    """
+
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        # Weak tags never match in If-Match.
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.append(int(tag[1:-1]))
+    return versions
+
+
 @app.on_event("startup")
 async def startup():
     """
-    DB init.
+    Schema version check, outdated schema is migrated when auto_migrate setting is on.
     Returns:
         None.
     """
 
+    logger.info("Settings: %s", settings.report())
     async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(migrations.check, settings.auto_migrate)
+    if settings.write_queue:
+        write_queue.start()
+    view_counter.start()
 
 
 @app.on_event("shutdown")
@@ -78,70 +175,246 @@ async def shutdown():
         None.
     """
 
+    await view_counter.stop()
+    await write_queue.stop()
     await engine.dispose()
+    await read_engine.dispose()
 
 
 # RECIPES ENDPOINTS
 
 
+@app.get('/recipes/search', response_model=List[schemas.RecipeOutList], tags=["Recipes"])
+@query_budget(1)
+async def search_recipes(response: Response, q: str = Query(..., min_length=1, max_length=200),
+                         category: int | None = Query(None, gt=0),
+                         page: Tuple[int, int] = Depends(offset_params),
+                         session: AsyncSession = Depends(get_read_session)) -> List[Recipes]:
+    """
+    Endpoint which returns a page of recipes which ingredients or description contain all words of the query,
+    the best matches and the most popular recipes first.
+    Args:
+        response: Response object, receives X-Next-Cursor header when more recipes exist.
+        q: Search string.
+        category: Category ID to search in.
+        page: Page size and offset.
+        session: AsyncSession instance.
+
+    Returns:
+        List of recipe objects.
+    """
+
+    words = search_words(q)
+    if not words:
+        raise HTTPException(status_code=400, detail="Search query should contain at least one word")
+    limit, offset = page
+    recipes, next_cursor = split_offset_page(await search(words, session, category, limit + 1, offset), limit, offset)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return recipes
+
+
+@app.get('/recipes/by-ingredients', response_model=List[schemas.RecipeByIngredients], tags=["Recipes"])
+@query_budget(1)
+async def get_recipes_by_ingredients(response: Response, have: str = Query(..., min_length=1, max_length=1000),
+                                     page: Tuple[int, int] = Depends(offset_params),
+                                     session: AsyncSession = Depends(get_read_session)) -> List[Recipes]:
+    """
+    Endpoint which returns a page of recipes which can be cooked with available ingredients, recipes which
+    need the least of other ingredients first.
+    Args:
+        response: Response object, receives X-Next-Cursor header when more recipes exist.
+        have: Available ingredients separated by commas.
+        page: Page size and offset.
+        session: AsyncSession instance.
+
+    Returns:
+        List of recipe objects with number of matched and all ingredients.
+    """
+
+    names = ingredient_names(have)
+    if not names:
+        raise HTTPException(status_code=400, detail="Ingredients should contain at least one word")
+    limit, offset = page
+    recipes, next_cursor = split_offset_page(await by_ingredients(names, session, limit + 1, offset), limit, offset)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return recipes
+
+
+@app.get('/recipes/export', response_class=StreamingResponse, tags=["Recipes"],
+         responses={200: {"content": {media_type: {} for media_type in export.MEDIA_TYPES.values()}}})
+@query_budget(1)
+async def export_recipes(fmt: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$")) -> StreamingResponse:
+    """
+    Endpoint which streams all recipes with category names. Recipe views are not counted.
+    Args:
+        fmt: Export format, "ndjson" or "csv".
+
+    Returns:
+        StreamingResponse object.
+    """
+
+    return StreamingResponse(export.export_recipes(fmt), media_type=export.MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f"attachment; filename=recipes.{fmt}"})
+
+
+@app.get('/recipes/top', response_model=List[schemas.RecipeOutList], tags=["Recipes"])
+@query_budget(2)
+async def get_top_recipes(n: int = Query(10, gt=0, le=MAX_PAGE_SIZE), category: int | None = Query(None, gt=0),
+                          session: AsyncSession = Depends(get_read_session)) -> List[dict]:
+    """
+    Endpoint which returns the most popular recipes from the in-memory leaderboard. The database is read
+    only to build the leaderboard, on first use and then every leaderboard_ttl seconds if set. Views which
+    are not flushed yet are counted, as by the endpoint of a single recipe.
+    Args:
+        n: Number of recipes.
+        category: Category ID, all recipes if not provided.
+        session: AsyncSession instance.
+
+    Returns:
+        List of serialized recipes.
+    """
+
+    if not leaderboard.fresh:
+        await leaderboard.load(session)
+    recipes = leaderboard.top(n, category, view_counter.pending_views())
+    if recipes is None:
+        raise HTTPException(status_code=404, detail="Category with specified ID does not exist")
+    return recipes
+
+
+@app.get('/recipes/batch', response_model=schemas.RecipeBatch, tags=["Recipes"])
+@query_budget(1)
+async def get_recipes_batch(ids: List[int] = Query(..., min_items=1, max_items=MAX_PAGE_SIZE),
+                            count_views: bool = Query(False),
+                            session: AsyncSession = Depends(get_read_session)) -> dict:
+    """
+    Endpoint which returns recipes by IDs in requested order with one query.
+    Args:
+        ids: Recipe IDs, repeated ids parameter.
+        count_views: Count a view of every found recipe.
+        session: AsyncSession instance.
+
+    Returns:
+        Found recipes and IDs of recipes which do not exist.
+    """
+
+    ids = list(dict.fromkeys(ids))
+    found = await get_many_cached(ids, session)
+    if count_views:
+        for recipe_id in found:
+            view_counter.add(recipe_id)
+    return {"recipes": [found[recipe_id] for recipe_id in ids if recipe_id in found],
+            "missing": [recipe_id for recipe_id in ids if recipe_id not in found]}
+
+
 @app.get('/recipes/{recipe_id}', response_model=schemas.RecipeOut, tags=["Recipes"])
-async def get_recipe(recipe_id: int = Path(..., gt=0), session: AsyncSession = Depends(get_session)) -> Recipes:
+@query_budget(1)
+async def get_recipe(response: Response, recipe_id: int = Path(..., gt=0),
+                     session: AsyncSession = Depends(get_read_session)) -> dict:
     """
     Endpoint which returns recipe by provided ID.
     Args:
+        response: Response object, receives ETag header of recipe version.
         recipe_id: Recipe ID.
         session: AsyncSession instance.
 
     Returns:
-        Recipe object.
+        Serialized recipe.
     """
 
-    recipe = await get_with_cat(recipe_id, session)
+    recipe = await get_cached(recipe_id, session)
     if recipe:
-        updated_views = schemas.RecipeUpdate(id=recipe_id, views=recipe.views + 1)
-        await update_recipe(updated_views, recipe_id, session)
+        view_counter.add(recipe_id)
+        response.headers["ETag"] = recipe_etag(recipe["version"])
         return recipe
     else:
         raise HTTPException(status_code=404, detail="Recipe with specified ID does not exist")
 
 
 @app.get('/recipes/', response_model=List[schemas.RecipeOutList], tags=["Recipes"])
-async def get_recipes(session: AsyncSession = Depends(get_session)) -> List[Recipes]:
+@query_budget(4)
+async def get_recipes(response: Response,
+                      page: Tuple[str, int, Tuple[int, ...] | None] = Depends(sorted_page_params),
+                      cooking_time_min: int | None = Query(None, ge=0),
+                      cooking_time_max: int | None = Query(None, ge=0),
+                      views_min: int | None = Query(None, ge=0),
+                      category: List[int] | None = Query(None, max_items=MAX_PAGE_SIZE),
+                      if_none_match: str | None = Header(None),
+                      session: AsyncSession = Depends(get_read_session)) -> List[Recipes]:
     """
-    Endpoint which returns all existing recipes.
+    Endpoint which returns a page of existing recipes matching the filters.
     Args:
+        response: Response object, receives X-Next-Cursor header when more recipes exist and ETag header.
+        page: Sort order, page size and cursor of the previous page.
+        cooking_time_min: Minimum cooking time.
+        cooking_time_max: Maximum cooking time.
+        views_min: Minimum number of views.
+        category: Category IDs, repeated category parameter.
+        if_none_match: ETag of recipes the client has.
         session: AsyncSession instance.
 
     Returns:
-        List of recipe objects.
+        List of recipe objects, encoded response when fast_json setting is on or empty response with
+        304 status code when recipes were not changed.
     """
 
-    recipes = await get_all(session)
+    etag = await collection_versions.etag(session, RECIPES)
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    sort, limit, cursor = page
+    recipes = await get_all(session, limit + 1, cursor, sort, cooking_time_min, cooking_time_max, views_min, category)
+    recipes, next_cursor = split_page(recipes, limit, SORTS[sort])
+    headers = {"ETag": etag}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if settings.fast_json:
+        return recipe_list_encoder.response(recipes, headers)
+    response.headers.update(headers)
     return recipes
 
 
 @app.get('/categories/{category_id}', response_model=List[schemas.RecipeOutList], tags=["Recipes"])
-async def get_recipe_by_category(category_id: int = Path(..., gt=0),
-                                 session: AsyncSession = Depends(get_session)) -> List[Recipes]:
+@query_budget(4)
+async def get_recipe_by_category(response: Response, category_id: int = Path(..., gt=0),
+                                 page: Tuple[int, Tuple[int, ...] | None] = Depends(page_params),
+                                 if_none_match: str | None = Header(None),
+                                 session: AsyncSession = Depends(get_read_session)) -> List[Recipes]:
     """
-    Endpoint which returns all existing recipes in provided category.
+    Endpoint which returns a page of existing recipes in provided category.
     Args:
+        response: Response object, receives X-Next-Cursor header when more recipes exist and ETag header.
         category_id: Category ID.
+        page: Page size and cursor of the previous page.
+        if_none_match: ETag of recipes the client has.
         session: AsyncSession instance.
 
     Returns:
-        List of recipe objects.
+        List of recipe objects, encoded response when fast_json setting is on or empty response with
+        304 status code when recipes were not changed.
     """
 
-    recipes = await get_all_by_cat(category_id, session)
-    if recipes:
+    etag = await collection_versions.etag(session, RECIPES)
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    limit, cursor = page
+    recipes, next_cursor = split_page(await get_all_by_cat(category_id, session, limit + 1, cursor), limit)
+    if recipes or cursor:
+        headers = {"ETag": etag}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if settings.fast_json:
+            return recipe_list_encoder.response(recipes, headers)
+        response.headers.update(headers)
         return recipes
     else:
         raise HTTPException(status_code=404, detail="There are no recipes in specified category")
 
 
 @app.post('/recipes/', status_code=201, response_model=schemas.RecipeOut, tags=["Recipes"])
-async def add_recipe(recipe: schemas.RecipeIn, session: AsyncSession = Depends(get_session)) -> Recipes:
+@query_budget(3)
+async def add_recipe(recipe: schemas.RecipeIn, session: AsyncSession = Depends(get_write_session)) -> Recipes:
     """
     Endpoint which creates a new recipe using provided data.
     Args:
@@ -153,12 +426,49 @@ async def add_recipe(recipe: schemas.RecipeIn, session: AsyncSession = Depends(g
     """
 
     new_recipe = Recipes(**recipe.dict())
-    recipe = await create(new_recipe, session)
+    try:
+        recipe = await write_queue.run(lambda session: create(new_recipe, session), session)
+    except UnknownCategory:
+        raise HTTPException(status_code=400, detail="Category with specified ID does not exist")
     return recipe
 
 
+@app.post('/recipes/bulk', response_model=schemas.BulkResult, tags=["Recipes"],
+          openapi_extra={"requestBody": {"required": True, "content": {
+              "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/RecipeIn"}}},
+              "application/x-ndjson": {"schema": {"type": "string"}},
+          }}})
+async def add_recipes(request: Request,
+                      batch_size: int = Query(settings.bulk_batch_size, gt=0, le=bulk_import.BULK_MAX_BATCH_SIZE),
+                      session: AsyncSession = Depends(get_write_session)) -> schemas.BulkResult:
+    """
+    Endpoint which creates many recipes from JSON array or streamed NDJSON body.
+    Args:
+        request: Request object.
+        batch_size: Number of recipes inserted in one transaction.
+        session: AsyncSession instance.
+
+    Returns:
+        Import report with IDs of created recipes and errors of rejected rows.
+    """
+
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        rows = bulk_import.ndjson_rows(request.stream())
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Request body should be a JSON array or NDJSON")
+        rows = bulk_import.json_rows(data)
+    return await bulk_import.import_recipes(rows, session, batch_size)
+
+
 @app.delete('/recipes/{recipe_id}', response_model=schemas.RecipeOut, tags=["Recipes"])
-async def delete_recipe(recipe_id: int = Path(..., gt=0), session: AsyncSession = Depends(get_session)) -> Recipes:
+@query_budget(2)
+async def delete_recipe(recipe_id: int = Path(..., gt=0),
+                        session: AsyncSession = Depends(get_write_session)) -> Recipes:
     """
     Endpoint which delete recipe by provided ID.
     Args:
@@ -169,29 +479,41 @@ async def delete_recipe(recipe_id: int = Path(..., gt=0), session: AsyncSession
         Recipe object.
     """
 
-    deleted_recipe = await delete_(recipe_id, session)
+    deleted_recipe = await write_queue.run(lambda session: delete_(recipe_id, session), session)
     if deleted_recipe:
         return deleted_recipe
     else:
         raise HTTPException(status_code=404, detail="Recipe with specified ID does not exist")
 
 
-@app.patch('/recipes/{recipe_id}', response_model=schemas.RecipeOut, tags=["Recipes"])
-async def update_recipe(recipe: schemas.RecipeUpdate, recipe_id: int = Path(..., gt=0),
-                        session: AsyncSession = Depends(get_session)) -> Recipes:
+@app.patch('/recipes/{recipe_id}', response_model=schemas.RecipeOut, tags=["Recipes"],
+           responses={412: {"description": "Recipe was changed since the version in If-Match header"}})
+@query_budget(4)
+async def update_recipe(response: Response, recipe: schemas.RecipeUpdate, recipe_id: int = Path(..., gt=0),
+                        if_match: str | None = Header(None),
+                        session: AsyncSession = Depends(get_write_session)) -> Recipes:
     """
     Endpoint which updated recipe with provided data by provided ID.
     Args:
+        response: Response object, receives ETag header of the new recipe version.
         recipe: Data to be updated serialized by RecipeUpdate schema.
         recipe_id: Recipe ID.
+        if_match: ETag of recipe version the update is based on.
         session: AsyncSession instance.
 
     Returns:
         Recipe object.
     """
 
-    updated_recipe = await update_(recipe, recipe_id, session)
+    try:
+        versions = if_match_versions(if_match)
+        updated_recipe = await write_queue.run(lambda session: update_(recipe, recipe_id, session, versions), session)
+    except VersionConflict:
+        raise HTTPException(status_code=412, detail="Recipe was changed by another request")
+    except UnknownCategory:
+        raise HTTPException(status_code=400, detail="Category with specified ID does not exist")
     if updated_recipe:
+        response.headers["ETag"] = recipe_etag(updated_recipe.version)
         return updated_recipe
     else:
         raise HTTPException(status_code=404, detail="Recipe with specified ID does not exist")
@@ -200,36 +522,56 @@ async def update_recipe(recipe: schemas.RecipeUpdate, recipe_id: int = Path(...,
 # CATEGORIES ENDPOINTS
 
 
-@app.get('/categories/', response_model=List[schemas.BaseCategory], tags=["Categories"])
-async def get_categories(session: AsyncSession = Depends(get_session)) -> List[RecipeCategory]:
+@app.get('/categories/', response_model=List[Union[schemas.CategoryWithStats, schemas.BaseCategory]],
+         tags=["Categories"])
+@query_budget(2)
+async def get_categories(response: Response, with_stats: bool = Query(False),
+                         if_none_match: str | None = Header(None),
+                         session: AsyncSession = Depends(get_read_session)) -> List[RecipeCategory]:
     """
     Endpoint which returns all existing categories.
     Args:
+        response: Response object, receives ETag header.
+        with_stats: Add number of recipes, their total views and average cooking time to every category.
+        if_none_match: ETag of categories the client has.
         session: AsyncSession instance.
 
     Returns:
-        List of recipeCategory objects.
+        List of recipeCategory objects or empty response with 304 status code when categories were not changed.
     """
 
-    recipes = await get_all_cats(session)
+    # Aggregates change with recipes and their views.
+    etag = await collection_versions.etag(session, *((CATEGORIES, RECIPES) if with_stats else (CATEGORIES,)))
+    if none_match(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    recipes = await (get_all_cats_with_stats(session) if with_stats else get_all_cats(session))
+    response.headers["ETag"] = etag
     return recipes
 
 
 @app.delete('/categories/{category_id}', response_model=schemas.BaseCategory, tags=["Categories"])
-async def delete_category(category_id: int = Path(..., gt=0),
-                          session: AsyncSession = Depends(get_session)) -> RecipeCategory:
+@query_budget(3)
+async def delete_category(response: Response, category_id: int = Path(..., gt=0),
+                          move_to: int | None = Query(None, gt=0),
+                          session: AsyncSession = Depends(get_write_session)) -> RecipeCategory:
     """
-    Endpoint which delete category by provided ID.
+    Endpoint which delete category by provided ID with its recipes or moves the recipes to another category.
     Args:
+        response: Response object, receives X-Affected-Recipes header with number of deleted or moved recipes.
         category_id: Category ID.
+        move_to: ID of category to move recipes to instead of deleting them.
         session: AsyncSession instance.
 
     Returns:
         RecipeCategory object.
     """
 
-    category = await delete_cat(category_id, session)
+    try:
+        category, affected = await write_queue.run(lambda session: delete_cat(category_id, session, move_to), session)
+    except UnknownCategory:
+        raise HTTPException(status_code=400, detail="Recipes can't be moved to specified category")
     if category:
+        response.headers["X-Affected-Recipes"] = str(affected)
         return category
     else:
         raise HTTPException(status_code=404, detail="Category with specified ID does not exist")
@@ -237,8 +579,9 @@ async def delete_category(category_id: int = Path(..., gt=0),
 
 @app.post('/categories/', status_code=201, response_model=schemas.BaseCategory, tags=["Categories"],
           operation_id="CreateCategory")
+@query_budget(1)
 async def create_category(title: str = Body(..., min_length=3, max_length=50, embed=True),
-                          session: AsyncSession = Depends(get_session)) -> RecipeCategory:
+                          session: AsyncSession = Depends(get_write_session)) -> RecipeCategory:
     """
     Endpoint which creates new category by provided title.
     Args:
@@ -249,7 +592,7 @@ async def create_category(title: str = Body(..., min_length=3, max_length=50, em
         RecipeCategory object.
     """
 
-    category = await create_cat(title, session)
+    category = await write_queue.run(lambda session: create_cat(title, session), session)
     if category:
         return category
     else:
@@ -258,9 +601,10 @@ async def create_category(title: str = Body(..., min_length=3, max_length=50, em
 
 @app.patch('/categories/{category_id}', response_model=schemas.BaseCategory, tags=["Categories"],
            operation_id="UpdateCategory")
+@query_budget(1)
 async def update_category(category_id: int = Path(..., gt=0),
                           title: str = Body(..., min_length=3, max_length=50, embed=True),
-                          session: AsyncSession = Depends(get_session)) -> RecipeCategory:
+                          session: AsyncSession = Depends(get_write_session)) -> RecipeCategory:
     """
     Endpoint which updates the category title.
     Args:
@@ -272,12 +616,82 @@ async def update_category(category_id: int = Path(..., gt=0),
         RecipeCategory object.
     """
 
-    category = await update_cat(title, category_id, session)
+    try:
+        category = await write_queue.run(lambda session: update_cat(title, category_id, session), session)
+    except DuplicateCategory:
+        raise HTTPException(status_code=400, detail="Category with specified name already exists")
     if category:
         return category
     else:
         raise HTTPException(status_code=404, detail="Category with specified ID does not exist")
 
 
+# DIAGNOSTICS ENDPOINTS
+
+
+@app.get('/diagnostics/cache', tags=["Diagnostics"])
+@query_budget(0)
+async def get_cache_stats() -> dict:
+    """
+    Endpoint which returns recipe cache statistics.
+    Returns:
+        Cache statistics.
+    """
+
+    return recipe_cache.stats
+
+
+@app.get('/diagnostics/leaderboard', tags=["Diagnostics"])
+@query_budget(2)
+async def check_leaderboard(session: AsyncSession = Depends(get_read_session)) -> dict:
+    """
+    Endpoint which compares the in-memory leaderboard with the leaderboard recomputed from the database.
+    Args:
+        session: AsyncSession instance.
+
+    Returns:
+        Consistency report.
+    """
+
+    if not leaderboard.fresh:
+        await leaderboard.load(session)
+    return await leaderboard.check(session)
+
+
+@query_budget(0)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Endpoint which returns request, SQL and connection pool metrics.
+    Returns:
+        Metrics in Prometheus text format.
+    """
+
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+if settings.metrics:
+    app.add_api_route('/metrics', get_metrics, response_class=PlainTextResponse, tags=["Diagnostics"])
+
+
+@app.get('/diagnostics/settings', tags=["Diagnostics"])
+async def get_settings(session: AsyncSession = Depends(get_write_session)) -> dict:
+    """
+    Endpoint which returns effective settings with the database password hidden and, for SQLite,
+    pragma values of pooled write and read connections.
+    Args:
+        session: AsyncSession instance.
+
+    Returns:
+        Settings report.
+    """
+
+    report = settings.report()
+    if settings.is_sqlite:
+        report["sqlite_pragmas_applied"] = await read_pragmas(session, settings.sqlite_pragmas)
+        async with async_read_session() as read_session:
+            report["sqlite_read_pragmas_applied"] = await read_pragmas(read_session, settings.sqlite_pragmas)
+    return report
+
+
 if __name__ == "__main__":
     uvicorn.run(app)
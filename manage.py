@@ -0,0 +1,125 @@
+import sys
+import asyncio
+import logging
+import argparse
+import migrations
+import crud_recipes
+from sqlalchemy import select
+from db import engine, async_session
+from models import Recipes, recount_category_stats
+
+
+async def migrate(args: argparse.Namespace) -> int:
+    """
+    Creates or upgrades database schema.
+    Args:
+        args: Command line arguments.
+
+    Returns:
+        Exit code.
+    """
+
+    async with engine.begin() as connection:
+        before = await connection.run_sync(migrations.get_version)
+        after = await connection.run_sync(migrations.migrate)
+    if before == after:
+        print(f"Schema version {after} is up to date")
+    else:
+        print(f"Schema version {before} -> {after}")
+    return 0
+
+
+async def status(args: argparse.Namespace) -> int:
+    """
+    Prints schema version of the database and of the application.
+    Args:
+        args: Command line arguments.
+
+    Returns:
+        Exit code, 1 if the database needs migration.
+    """
+
+    async with engine.connect() as connection:
+        version = await connection.run_sync(migrations.get_version)
+    print(f"Database schema version {version}, application schema version {migrations.SCHEMA_VERSION}")
+    return 0 if version == migrations.SCHEMA_VERSION else 1
+
+
+async def repair_stats(args: argparse.Namespace) -> int:
+    """
+    Recomputes aggregates of categories from their recipes.
+    Args:
+        args: Command line arguments.
+
+    Returns:
+        Exit code.
+    """
+
+    async with engine.begin() as connection:
+        corrected = await connection.run_sync(recount_category_stats)
+    print(f"Recounted category stats, {corrected} categories corrected")
+    return 0
+
+
+async def index_ingredients(args: argparse.Namespace) -> int:
+    """
+    Rebuilds ingredient index of existing recipes in batches ordered by ID, one transaction per batch,
+    so the application keeps serving writes meanwhile.
+    Args:
+        args: Command line arguments.
+
+    Returns:
+        Exit code.
+    """
+
+    indexed, last_id = 0, 0
+    while True:
+        async with async_session() as session:
+            recipes = (await session.execute(select(Recipes.id, Recipes.ingredients).where(Recipes.id > last_id)
+                                             .order_by(Recipes.id).limit(args.batch_size))).all()
+            if not recipes:
+                break
+            await crud_recipes.index_ingredients([tuple(recipe) for recipe in recipes], session, replace=True)
+            await session.commit()
+        indexed += len(recipes)
+        last_id = recipes[-1].id
+        print(f"Indexed ingredients of {indexed} recipes")
+    return 0
+
+
+COMMANDS = {
+    "migrate": (migrate, "create or upgrade database schema"),
+    "status": (status, "compare database schema version with the application"),
+    "repair-stats": (repair_stats, "recompute recipe counts, views and cooking time of categories"),
+    "index-ingredients": (index_ingredients, "index ingredients of existing recipes"),
+}
+
+# Options of commands.
+ARGUMENTS = {
+    "index-ingredients": [("--batch-size", {"type": int, "default": 1000,
+                                            "help": "number of recipes indexed in one transaction"})],
+}
+
+
+async def run(args: argparse.Namespace) -> int:
+    try:
+        return await COMMANDS[args.command][0](args)
+    finally:
+        await engine.dispose()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CookBook management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (_, description) in COMMANDS.items():
+        command = commands.add_parser(name, help=description)
+        for flag, options in ARGUMENTS.get(name, ()):
+            command.add_argument(flag, **options)
+    args = parser.parse_args()
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger(migrations.__name__).setLevel(logging.INFO)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from query_log import request_queries
+
+# Starlette adds the charset to text responses.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metric:
+    """
+    Base of metrics with labels, rendered in Prometheus text format.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        """
+        Args:
+            name: Metric name.
+            description: Metric help text.
+            labels: Label names.
+        """
+
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def format_labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        """
+        Formats label set of a sample.
+        Args:
+            values: Label values.
+            extra: Additional formatted label.
+
+        Returns:
+            Label set in braces or empty string.
+        """
+
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        """
+        Returns:
+            Sample lines of the metric.
+        """
+
+        return [f"{self.name}{self.format_labels(labels)} {value}" for labels, value in sorted(self.values.items())]
+
+    def render(self) -> str:
+        """
+        Returns:
+            Metric with its help and type lines.
+        """
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value.
+    """
+
+    kind = "counter"
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        """
+        Increases the counter.
+        Args:
+            labels: Label values.
+            amount: Increment.
+
+        Returns:
+            None.
+        """
+
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Value which goes up and down, changed by the code or read from a function when rendered.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        """
+        Args:
+            name: Metric name.
+            description: Metric help text.
+            labels: Label names.
+        """
+
+        super().__init__(name, description, labels)
+        self.functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], labels: Tuple[str, ...] = ()) -> None:
+        """
+        Makes the gauge report value returned by a function at render time.
+        Args:
+            function: Function returning current value.
+            labels: Label values.
+
+        Returns:
+            None.
+        """
+
+        self.functions[labels] = function
+
+    def samples(self) -> List[str]:
+        """
+        Returns:
+            Sample lines of the metric with values of functions read now.
+        """
+
+        for labels, function in self.functions.items():
+            self.values[labels] = function()
+        return super().samples()
+
+    def add(self, amount: float, labels: Tuple[str, ...] = ()) -> None:
+        """
+        Changes the gauge.
+        Args:
+            amount: Positive or negative change.
+            labels: Label values.
+
+        Returns:
+            None.
+        """
+
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values over fixed buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        Args:
+            name: Metric name.
+            description: Metric help text.
+            labels: Label names.
+            buckets: Upper bounds of buckets in ascending order.
+        """
+
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # Per label values: count of observations in every bucket plus +Inf, and their sum.
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        """
+        Records a value.
+        Args:
+            value: Observed value.
+            labels: Label values.
+
+        Returns:
+            None.
+        """
+
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def samples(self) -> List[str]:
+        """
+        Returns:
+            Cumulative bucket, sum and count lines of every label set.
+        """
+
+        lines = []
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket = self.format_labels(labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("cookbook_http_requests_total", "Number of HTTP requests.", ("method", "route", "status"))
+REQUEST_DURATION = Histogram("cookbook_http_request_duration_seconds", "HTTP request duration.",
+                             ("method", "route"))
+IN_FLIGHT = Gauge("cookbook_http_requests_in_flight", "Number of HTTP requests being processed.")
+IN_FLIGHT.add(0)
+REQUEST_STATEMENTS = Histogram("cookbook_db_statements_per_request", "Number of SQL statements per HTTP request.",
+                               ("method", "route"), STATEMENT_BUCKETS)
+REQUEST_QUERY_DURATION = Histogram("cookbook_db_query_duration_seconds_per_request",
+                                   "Total time of SQL statements per HTTP request.", ("method", "route"))
+VIEWS_PENDING = Gauge("cookbook_views_pending", "Number of recipe views not flushed to the database yet.")
+POOL_WAIT = Histogram("cookbook_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.",
+                      ("pool",))
+
+REGISTRY: List[Metric] = [REQUESTS, REQUEST_DURATION, IN_FLIGHT, REQUEST_STATEMENTS, REQUEST_QUERY_DURATION,
+                          VIEWS_PENDING, POOL_WAIT]
+
+
+def render() -> str:
+    """
+    Renders all metrics.
+    Returns:
+        Metrics in Prometheus text format.
+    """
+
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware which counts HTTP requests, their duration and SQL statements made while serving them.
+    Routes are labeled with their path template, requests which match no route are labeled "unmatched".
+    Statements are collected by query_log.QueryCountMiddleware, which must wrap this middleware.
+    """
+
+    def __init__(self, app):
+        """
+        Args:
+            app: ASGI application.
+        """
+
+        self.app = app
+        self.routes: Dict[object, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.add(1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.add(-1)
+            labels = (scope["method"], self.route(scope))
+            REQUESTS.inc(labels + (str(status),))
+            REQUEST_DURATION.observe(elapsed, labels)
+            queries = request_queries.get()
+            if queries is not None:
+                REQUEST_STATEMENTS.observe(queries.count, labels)
+                REQUEST_QUERY_DURATION.observe(queries.duration, labels)
+
+    def route(self, scope) -> str:
+        """
+        Returns path template of the route which served the request.
+        Args:
+            scope: ASGI connection scope after routing.
+
+        Returns:
+            Path template.
+        """
+
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self.routes.get(endpoint)
+        if route is None:
+            self.routes = {getattr(route, "endpoint", None): route.path for route in scope["app"].routes}
+            route = self.routes.get(endpoint, "unmatched")
+        return route
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Connection pool which measures how long checkouts wait for a free connection.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started, (getattr(self, "logging_name", None) or "default",))
@@ -0,0 +1,256 @@
+import re
+import logging
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from models import Base, Recipes, Ingredient, RecipeIngredient, CollectionVersion
+from models import create_search_index, create_category_stats, recount_category_stats, create_collection_versions
+
+logger = logging.getLogger(__name__)
+
+
+def get_version(connection: Connection) -> int:
+    """
+    Returns schema version stored in the database: PRAGMA user_version in SQLite, schema_version table
+    in other databases.
+    Args:
+        connection: Connection instance.
+
+    Returns:
+        Schema version, 0 for databases created before versioning.
+    """
+
+    if connection.dialect.name == "sqlite":
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+    connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    return connection.exec_driver_sql("SELECT max(version) FROM schema_version").scalar() or 0
+
+
+def set_version(connection: Connection, version: int) -> None:
+    """
+    Stores schema version in the database.
+    Args:
+        connection: Connection instance.
+        version: Schema version.
+
+    Returns:
+        None.
+    """
+
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+    else:
+        connection.exec_driver_sql("DELETE FROM schema_version")
+        connection.exec_driver_sql(f"INSERT INTO schema_version (version) VALUES ({int(version)})")
+
+
+def add_search_index(connection: Connection) -> None:
+    """
+    Creates full-text index of recipes.
+    """
+
+    create_search_index(connection)
+
+
+def redesign_recipes_indexes(connection: Connection) -> None:
+    """
+    Replaces single column indexes of recipes with indexes matching the popularity order of recipe lists.
+    """
+
+    for column in ("id", "title", "cooking_time", "ingredients", "description", "views"):
+        connection.exec_driver_sql(f"DROP INDEX IF EXISTS ix_recipes_{column}")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_recipes_popularity "
+                               "ON recipes (views DESC, cooking_time, id DESC)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_recipes_category_popularity "
+                               "ON recipes (category, views DESC, cooking_time, id DESC)")
+
+
+def add_recipes_version(connection: Connection) -> None:
+    """
+    Adds row version column to recipes.
+    """
+
+    if "version" not in {column["name"] for column in inspect(connection).get_columns("recipes")}:
+        connection.exec_driver_sql("ALTER TABLE recipes ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+def unique_category_titles(connection: Connection) -> None:
+    """
+    Renames categories which titles differ only in case from an older category and makes titles unique.
+    """
+
+    duplicates = connection.exec_driver_sql(
+        "SELECT id, title FROM recipe_cat AS duplicate WHERE EXISTS (SELECT 1 FROM recipe_cat "
+        "WHERE lower(recipe_cat.title) = lower(duplicate.title) AND recipe_cat.id < duplicate.id)"
+    ).all()
+    for category_id, title in duplicates:
+        logger.warning("Renaming duplicate category %s %r to %r", category_id, title, f"{title} ({category_id})")
+        connection.exec_driver_sql(f"UPDATE recipe_cat SET title = title || ' (' || id || ')' "
+                                   f"WHERE id = {int(category_id)}")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_recipe_cat_title")
+    connection.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_recipe_cat_title_lower "
+                               "ON recipe_cat (lower(title))")
+
+
+def cascade_category_delete(connection: Connection) -> None:
+    """
+    Makes the database delete recipes of a deleted category. SQLite can't alter a foreign key, so the recipes
+    table is rebuilt with its indexes and triggers.
+    """
+
+    foreign_key = next(key for key in inspect(connection).get_foreign_keys("recipes")
+                       if key["referred_table"] == "recipe_cat")
+    if (foreign_key["options"].get("ondelete") or "").upper() == "CASCADE":
+        return
+    orphans = connection.exec_driver_sql(
+        "UPDATE recipes SET category = NULL WHERE category NOT IN (SELECT id FROM recipe_cat)"
+    ).rowcount
+    if orphans:
+        logger.warning("Removed missing category from %s recipes", orphans)
+    if connection.dialect.name != "sqlite":
+        connection.exec_driver_sql(f'ALTER TABLE recipes DROP CONSTRAINT "{foreign_key["name"]}"')
+        connection.exec_driver_sql("ALTER TABLE recipes ADD FOREIGN KEY (category) REFERENCES recipe_cat (id) "
+                                   "ON DELETE CASCADE")
+        return
+    table = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'recipes'")
+    table = re.sub(r'^CREATE TABLE\s+"?recipes"?', "CREATE TABLE recipes_new", table.scalar())
+    table = re.sub(r'(REFERENCES\s+"?recipe_cat"?\s*\(\s*"?id"?\s*\))', r"\1 ON DELETE CASCADE", table)
+    dependent = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+                                           "AND tbl_name = 'recipes' AND sql IS NOT NULL").scalars().all()
+    connection.exec_driver_sql(table)
+    connection.exec_driver_sql("INSERT INTO recipes_new SELECT * FROM recipes")
+    connection.exec_driver_sql("DROP TABLE recipes")
+    connection.exec_driver_sql("ALTER TABLE recipes_new RENAME TO recipes")
+    for statement in dependent:
+        connection.exec_driver_sql(statement)
+
+
+def add_recipes_sort_indexes(connection: Connection) -> None:
+    """
+    Adds indexes matching the quickest and the newest orders of recipe lists.
+    """
+
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_recipes_quickest "
+                               "ON recipes (cooking_time, views DESC, id DESC)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_recipes_category_quickest "
+                               "ON recipes (category, cooking_time, views DESC, id DESC)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_recipes_category_newest ON recipes (category, id DESC)")
+
+
+def add_category_stats(connection: Connection) -> None:
+    """
+    Adds aggregates of recipes to categories with triggers maintaining them and computes their values.
+    """
+
+    existing = {column["name"] for column in inspect(connection).get_columns("recipe_cat")}
+    for column in ("recipe_count", "total_views", "total_cooking_time"):
+        if column not in existing:
+            connection.exec_driver_sql(f"ALTER TABLE recipe_cat ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+    create_category_stats(connection)
+    recount_category_stats(connection)
+
+
+def add_ingredient_index(connection: Connection) -> None:
+    """
+    Adds ingredient dictionary and ingredient index of recipes, existing recipes are indexed by
+    python manage.py index-ingredients.
+    """
+
+    Ingredient.__table__.create(connection, checkfirst=True)
+    RecipeIngredient.__table__.create(connection, checkfirst=True)
+
+
+def add_collection_versions(connection: Connection) -> None:
+    """
+    Adds change counters of collections stored in the database with triggers bumping them.
+    """
+
+    CollectionVersion.__table__.create(connection, checkfirst=True)
+    create_collection_versions(connection)
+
+
+# Ordered schema changes. Every step is applied once, in the same transaction as the version bump.
+# Steps should stay idempotent: tables of a new database are already created by models.
+MIGRATIONS: List[Tuple[int, Callable[[Connection], None]]] = [
+    (1, add_search_index),
+    (2, redesign_recipes_indexes),
+    (3, add_recipes_version),
+    (4, unique_category_titles),
+    (5, cascade_category_delete),
+    (6, add_recipes_sort_indexes),
+    (7, add_category_stats),
+    (8, add_ingredient_index),
+    (9, add_collection_versions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class SchemaMismatch(RuntimeError):
+    """
+    Database schema version differs from the version of the application.
+    """
+
+
+def upgrade(connection: Connection) -> int:
+    """
+    Applies migrations newer than the schema version stored in the database.
+    Args:
+        connection: Connection instance inside a transaction.
+
+    Returns:
+        Schema version after upgrade.
+    """
+
+    version = get_version(connection)
+    for number, migration in MIGRATIONS:
+        if number > version:
+            logger.info("Applying migration %s: %s", number, migration.__name__)
+            migration(connection)
+            set_version(connection, number)
+            version = number
+    return version
+
+
+def migrate(connection: Connection) -> int:
+    """
+    Brings database schema to SCHEMA_VERSION: a new database is created from models and stamped with the version,
+    an existing one is upgraded.
+    Args:
+        connection: Connection instance inside a transaction.
+
+    Returns:
+        Schema version after migration.
+    """
+
+    version = get_version(connection)
+    if version == 0 and not inspect(connection).has_table(Recipes.__tablename__):
+        logger.info("Creating schema version %s", SCHEMA_VERSION)
+        Base.metadata.create_all(connection)
+        set_version(connection, SCHEMA_VERSION)
+        return SCHEMA_VERSION
+    return upgrade(connection)
+
+
+def check(connection: Connection, auto_migrate: bool = False) -> int:
+    """
+    Compares schema version stored in the database with SCHEMA_VERSION, the only query made when they match.
+    Args:
+        connection: Connection instance inside a transaction.
+        auto_migrate: Migrate outdated schema instead of failing.
+
+    Returns:
+        Schema version.
+
+    Raises:
+        SchemaMismatch: Schema is newer than the application, or outdated and auto_migrate is off.
+    """
+
+    version = get_version(connection)
+    if version == SCHEMA_VERSION:
+        return version
+    if version > SCHEMA_VERSION:
+        raise SchemaMismatch(f"Database schema version {version} is newer than supported {SCHEMA_VERSION}")
+    if not auto_migrate:
+        raise SchemaMismatch(f"Database schema version {version} is outdated, run: python manage.py migrate")
+    return migrate(connection)
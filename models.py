@@ -1,6 +1,7 @@
 from db import Base
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, String, Integer, Text, ForeignKey
+from sqlalchemy.engine import Connection
+from sqlalchemy import Column, String, Integer, Float, Boolean, Text, ForeignKey, Index, event, func, false
 
 
 class RecipeCategory(Base):
@@ -10,8 +11,18 @@ class RecipeCategory(Base):
 
     __tablename__ = "recipe_cat"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    title = Column(String, index=True, nullable=False)
-    recipes = relationship("Recipes", cascade="all", backref="recipe_cat")
+    title = Column(String, nullable=False)
+    # Aggregates of recipes in the category, kept up to date by database triggers (see CATEGORY_STATS).
+    recipe_count = Column(Integer, nullable=False, default=0, server_default="0")
+    total_views = Column(Integer, nullable=False, default=0, server_default="0")
+    total_cooking_time = Column(Integer, nullable=False, default=0, server_default="0")
+    # Recipes are deleted by the database (ON DELETE CASCADE), they are not loaded to be deleted one by one.
+    recipes = relationship("Recipes", cascade="all", passive_deletes=True, backref="recipe_cat")
+
+    # Titles are unique regardless of case, the database rejects duplicates created concurrently as well.
+    __table_args__ = (
+        Index("ix_recipe_cat_title_lower", func.lower(title), unique=True),
+    )
 
 
 class Recipes(Base):
@@ -20,11 +31,285 @@ class Recipes(Base):
     """
 
     __tablename__ = "recipes"
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    title = Column(String, index=True, nullable=False)
-    category = Column(Integer, ForeignKey("recipe_cat.id"))
-    cooking_time = Column(Integer, index=True, nullable=False)
-    ingredients = Column(Text, index=True, nullable=False)
-    description = Column(Text, index=True, nullable=False)
-    views = Column(Integer, index=True, default=0)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    title = Column(String, nullable=False)
+    category = Column(Integer, ForeignKey("recipe_cat.id", ondelete="CASCADE"))
+    cooking_time = Column(Integer, nullable=False)
+    ingredients = Column(Text, nullable=False)
+    description = Column(Text, nullable=False)
+    views = Column(Integer, default=0)
+    # Incremented by every update of recipe data (not views), used for optimistic concurrency.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # Indexes match the sort orders of recipe lists over all recipes and in a category, so pages are read
+    # in index order without sorting. The newest recipes of all categories are read by primary key.
+    __table_args__ = (
+        Index("ix_recipes_popularity", views.desc(), cooking_time, id.desc()),
+        Index("ix_recipes_category_popularity", category, views.desc(), cooking_time, id.desc()),
+        Index("ix_recipes_quickest", cooking_time, views.desc(), id.desc()),
+        Index("ix_recipes_category_quickest", category, cooking_time, views.desc(), id.desc()),
+        Index("ix_recipes_category_newest", category, id.desc()),
+    )
+
+
+class Ingredient(Base):
+    """
+    Model describing normalized ingredient name, the dictionary of the ingredient index.
+    """
+
+    __tablename__ = "ingredients"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False, unique=True)
+
+
+class RecipeIngredient(Base):
+    """
+    Model describing ingredient of a recipe. The primary key starts with the ingredient, so the table is
+    an inverted index: recipes with an ingredient are one range of it.
+    """
+
+    __tablename__ = "recipe_ingredients"
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"), primary_key=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id", ondelete="CASCADE"), primary_key=True)
+
+    # Ingredients of a recipe are replaced on update and deleted with it.
+    __table_args__ = (
+        Index("ix_recipe_ingredients_recipe", recipe_id),
+        {"sqlite_with_rowid": False},
+    )
+
+
+class CollectionVersion(Base):
+    """
+    Model describing change counter of a collection, entity tags of list endpoints are built from counters.
+    """
+
+    __tablename__ = "collection_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Views counter only: time of the last bump and whether views were flushed since then (see versions.py).
+    changed_at = Column(Float, nullable=False, default=0, server_default="0")
+    pending = Column(Boolean, nullable=False, default=False, server_default=false())
+
+
+# Full-text document of a recipe for PostgreSQL, the search query should use exactly this expression
+# to be served by its GIN index.
+RECIPES_TSVECTOR = "to_tsvector('simple', recipes.ingredients || ' ' || recipes.description)"
+
+# Full-text index over recipe ingredients and description. The FTS5 table stores no text itself
+# (external content), triggers keep it in sync with the recipes table.
+RECIPES_FTS = [
+    """CREATE VIRTUAL TABLE recipes_fts USING fts5(
+        ingredients, description, content='recipes', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER recipes_fts_insert AFTER INSERT ON recipes BEGIN
+        INSERT INTO recipes_fts(rowid, ingredients, description) VALUES (new.id, new.ingredients, new.description);
+    END""",
+    """CREATE TRIGGER recipes_fts_delete AFTER DELETE ON recipes BEGIN
+        INSERT INTO recipes_fts(recipes_fts, rowid, ingredients, description)
+        VALUES ('delete', old.id, old.ingredients, old.description);
+    END""",
+    """CREATE TRIGGER recipes_fts_update AFTER UPDATE OF ingredients, description ON recipes BEGIN
+        INSERT INTO recipes_fts(recipes_fts, rowid, ingredients, description)
+        VALUES ('delete', old.id, old.ingredients, old.description);
+        INSERT INTO recipes_fts(rowid, ingredients, description) VALUES (new.id, new.ingredients, new.description);
+    END""",
+]
+
+
+# Triggers which keep aggregates of recipe_cat in the same transaction as changes of recipes: creation,
+# deletion, including cascade deletion of a category, move to another category and flushed views.
+CATEGORY_STATS = [
+    """CREATE TRIGGER recipes_stats_insert AFTER INSERT ON recipes BEGIN
+        UPDATE recipe_cat SET recipe_count = recipe_count + 1, total_views = total_views + coalesce(new.views, 0),
+            total_cooking_time = total_cooking_time + new.cooking_time
+        WHERE id = new.category;
+    END""",
+    """CREATE TRIGGER recipes_stats_delete AFTER DELETE ON recipes BEGIN
+        UPDATE recipe_cat SET recipe_count = recipe_count - 1, total_views = total_views - coalesce(old.views, 0),
+            total_cooking_time = total_cooking_time - old.cooking_time
+        WHERE id = old.category;
+    END""",
+    """CREATE TRIGGER recipes_stats_update AFTER UPDATE OF views, cooking_time ON recipes
+    WHEN old.category IS new.category BEGIN
+        UPDATE recipe_cat SET total_views = total_views + coalesce(new.views, 0) - coalesce(old.views, 0),
+            total_cooking_time = total_cooking_time + new.cooking_time - old.cooking_time
+        WHERE id = new.category;
+    END""",
+    """CREATE TRIGGER recipes_stats_move AFTER UPDATE OF category, views, cooking_time ON recipes
+    WHEN old.category IS NOT new.category BEGIN
+        UPDATE recipe_cat SET recipe_count = recipe_count - 1, total_views = total_views - coalesce(old.views, 0),
+            total_cooking_time = total_cooking_time - old.cooking_time
+        WHERE id = old.category;
+        UPDATE recipe_cat SET recipe_count = recipe_count + 1, total_views = total_views + coalesce(new.views, 0),
+            total_cooking_time = total_cooking_time + new.cooking_time
+        WHERE id = new.category;
+    END""",
+]
+
+# The same triggers for PostgreSQL.
+CATEGORY_STATS_POSTGRESQL = [
+    """CREATE OR REPLACE FUNCTION recipes_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE recipe_cat SET recipe_count = recipe_count - 1,
+                total_views = total_views - coalesce(OLD.views, 0),
+                total_cooking_time = total_cooking_time - OLD.cooking_time
+            WHERE id = OLD.category;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'INSERT') THEN
+            UPDATE recipe_cat SET recipe_count = recipe_count + 1,
+                total_views = total_views + coalesce(NEW.views, 0),
+                total_cooking_time = total_cooking_time + NEW.cooking_time
+            WHERE id = NEW.category;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS recipes_stats ON recipes",
+    """CREATE TRIGGER recipes_stats AFTER INSERT OR DELETE OR UPDATE OF category, views, cooking_time ON recipes
+    FOR EACH ROW EXECUTE FUNCTION recipes_stats()""",
+]
+
+# Recomputes aggregates of categories which differ from their recipes.
+RECOUNT_CATEGORY_STATS = """
+    UPDATE recipe_cat SET recipe_count = actual.recipe_count, total_views = actual.total_views,
+        total_cooking_time = actual.total_cooking_time
+    FROM (
+        SELECT recipe_cat.id, count(recipes.id) AS recipe_count, coalesce(sum(recipes.views), 0) AS total_views,
+            coalesce(sum(recipes.cooking_time), 0) AS total_cooking_time
+        FROM recipe_cat LEFT OUTER JOIN recipes ON recipes.category = recipe_cat.id
+        GROUP BY recipe_cat.id
+    ) AS actual
+    WHERE actual.id = recipe_cat.id AND (recipe_cat.recipe_count <> actual.recipe_count
+        OR recipe_cat.total_views <> actual.total_views OR recipe_cat.total_cooking_time <> actual.total_cooking_time)
+"""
+
+
+def create_category_stats(connection: Connection) -> None:
+    """
+    Creates triggers maintaining aggregates of categories if they do not exist yet.
+    Args:
+        connection: Connection instance.
+
+    Returns:
+        None.
+    """
+
+    if connection.dialect.name == "postgresql":
+        for statement in CATEGORY_STATS_POSTGRESQL:
+            connection.exec_driver_sql(statement)
+        return
+    for statement in CATEGORY_STATS:
+        connection.exec_driver_sql(statement.replace("CREATE TRIGGER", "CREATE TRIGGER IF NOT EXISTS", 1))
+
+
+def recount_category_stats(connection: Connection) -> int:
+    """
+    Recomputes aggregates of categories from their recipes.
+    Args:
+        connection: Connection instance inside a transaction.
+
+    Returns:
+        Number of corrected categories.
+    """
+
+    return connection.exec_driver_sql(RECOUNT_CATEGORY_STATS).rowcount
+
+
+# Triggers which bump change counters of collections in the same transaction as changes of recipes and
+# categories. Recipe lists show category titles, so renaming or deleting a category changes them as well.
+# Views are not counted here: their counter is bumped by flushes of the view counter at most once per interval.
+COLLECTION_VERSIONS = [
+    """CREATE TRIGGER recipes_version_insert AFTER INSERT ON recipes BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name = 'recipes';
+    END""",
+    """CREATE TRIGGER recipes_version_delete AFTER DELETE ON recipes BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name = 'recipes';
+    END""",
+    """CREATE TRIGGER recipes_version_update AFTER UPDATE OF title, category, cooking_time, ingredients, description
+    ON recipes BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name = 'recipes';
+    END""",
+    """CREATE TRIGGER recipe_cat_version_insert AFTER INSERT ON recipe_cat BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name = 'categories';
+    END""",
+    """CREATE TRIGGER recipe_cat_version_delete AFTER DELETE ON recipe_cat BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name IN ('categories', 'recipes');
+    END""",
+    """CREATE TRIGGER recipe_cat_version_update AFTER UPDATE OF title ON recipe_cat BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name IN ('categories', 'recipes');
+    END""",
+]
+
+# The same triggers for PostgreSQL, once per statement.
+COLLECTION_VERSIONS_POSTGRESQL = [
+    """CREATE OR REPLACE FUNCTION bump_collection_versions() RETURNS trigger AS $$
+    BEGIN
+        UPDATE collection_versions SET version = version + 1 WHERE name = ANY(TG_ARGV);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS recipes_version ON recipes",
+    """CREATE TRIGGER recipes_version
+    AFTER INSERT OR DELETE OR UPDATE OF title, category, cooking_time, ingredients, description ON recipes
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_collection_versions('recipes')""",
+    "DROP TRIGGER IF EXISTS recipe_cat_version_insert ON recipe_cat",
+    """CREATE TRIGGER recipe_cat_version_insert AFTER INSERT ON recipe_cat
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_collection_versions('categories')""",
+    "DROP TRIGGER IF EXISTS recipe_cat_version ON recipe_cat",
+    """CREATE TRIGGER recipe_cat_version AFTER DELETE OR UPDATE OF title ON recipe_cat
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_collection_versions('categories', 'recipes')""",
+]
+
+
+def create_collection_versions(connection: Connection) -> None:
+    """
+    Adds counters of collections and triggers bumping them if they do not exist yet.
+    Args:
+        connection: Connection instance.
+
+    Returns:
+        None.
+    """
+
+    connection.exec_driver_sql("INSERT INTO collection_versions (name) VALUES ('recipes'), ('categories'), ('views') "
+                               "ON CONFLICT (name) DO NOTHING")
+    if connection.dialect.name == "postgresql":
+        for statement in COLLECTION_VERSIONS_POSTGRESQL:
+            connection.exec_driver_sql(statement)
+        return
+    for statement in COLLECTION_VERSIONS:
+        connection.exec_driver_sql(statement.replace("CREATE TRIGGER", "CREATE TRIGGER IF NOT EXISTS", 1))
+
+
+def create_search_index(connection: Connection) -> None:
+    """
+    Creates the full-text index of recipes and fills it with existing recipes if it does not exist yet.
+    Args:
+        connection: Connection instance.
+
+    Returns:
+        None.
+    """
+
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_recipes_search ON recipes "
+                                   f"USING gin (({RECIPES_TSVECTOR}))")
+        return
+    exists = connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recipes_fts'")
+    if exists.scalar() is None:
+        for statement in RECIPES_FTS:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO recipes_fts(recipes_fts) VALUES ('rebuild')")
+
+
+@event.listens_for(Base.metadata, "after_create")
+def after_create(target, connection: Connection, **kw) -> None:
+    """
+    Creates objects which can't be described by SQLAlchemy models.
+    """
 
+    create_search_index(connection)
+    create_category_stats(connection)
+    create_collection_versions(connection)
@@ -0,0 +1,248 @@
+import json
+import base64
+import binascii
+from typing import Dict, List, Tuple, Any
+from fastapi import HTTPException, Query
+from sqlalchemy import union_all
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql import Select, ColumnElement
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Recipes
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+SortKey = Tuple[Tuple[InstrumentedAttribute, bool], ...]
+
+# Recipes popularity order: most viewed first, then the quickest, then the newest.
+POPULARITY: SortKey = ((Recipes.views, True), (Recipes.cooking_time, False), (Recipes.id, True))
+# The quickest first, then the most viewed, then the newest.
+QUICKEST: SortKey = ((Recipes.cooking_time, False), (Recipes.views, True), (Recipes.id, True))
+NEWEST: SortKey = ((Recipes.id, True),)
+
+# Sort orders of recipe lists accepted from clients.
+SORTS: Dict[str, SortKey] = {"popular": POPULARITY, "quickest": QUICKEST, "newest": NEWEST}
+
+
+def encode_cursor(key: Tuple[int, ...]) -> str:
+    """
+    Packs the sort key of the last row of a page into an opaque cursor.
+    Args:
+        key: Values of the sort key columns.
+
+    Returns:
+        URL-safe cursor string.
+    """
+
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int = 3) -> Tuple[int, ...]:
+    """
+    Unpacks the cursor built by encode_cursor.
+    Args:
+        cursor: Cursor string.
+        size: Expected number of sort key columns.
+
+    Returns:
+        Values of the sort key columns.
+
+    Raises:
+        ValueError: Cursor is malformed.
+    """
+
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError("Malformed cursor") from exc
+    if not isinstance(key, list) or len(key) != size or not all(type(value) is int for value in key):
+        raise ValueError("Malformed cursor")
+    return tuple(key)
+
+
+def page_params(limit: int = Query(PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                cursor: str | None = Query(None)) -> Tuple[int, Tuple[int, ...] | None]:
+    """
+    Dependency which reads pagination query parameters.
+    Args:
+        limit: Maximum number of rows in a page.
+        cursor: Cursor returned with the previous page.
+
+    Returns:
+        Tuple of page size and decoded cursor.
+    """
+
+    if cursor is None:
+        return limit, None
+    try:
+        return limit, decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def sorted_page_params(sort: str = Query("popular", regex=f"^({'|'.join(SORTS)})$"),
+                       limit: int = Query(PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                       cursor: str | None = Query(None)) -> Tuple[str, int, Tuple[int, ...] | None]:
+    """
+    Dependency which reads pagination query parameters of lists with a choice of sort order.
+    Args:
+        sort: Name of the sort order from SORTS.
+        limit: Maximum number of rows in a page.
+        cursor: Cursor returned with the previous page of the same sort order.
+
+    Returns:
+        Tuple of sort order name, page size and decoded cursor.
+    """
+
+    if cursor is None:
+        return sort, limit, None
+    try:
+        return sort, limit, decode_cursor(cursor, size=len(SORTS[sort]))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def offset_params(limit: int = Query(PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                  cursor: str | None = Query(None)) -> Tuple[int, int]:
+    """
+    Dependency which reads pagination query parameters of lists without a stable sort key, e.g. ranked
+    search results, where the cursor keeps the offset.
+    Args:
+        limit: Maximum number of rows in a page.
+        cursor: Cursor returned with the previous page.
+
+    Returns:
+        Tuple of page size and offset.
+    """
+
+    if cursor is None:
+        return limit, 0
+    try:
+        return limit, decode_cursor(cursor, size=1)[0]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def order(key: SortKey) -> List[ColumnElement]:
+    """
+    Returns ORDER BY clause of a sort key.
+    Args:
+        key: Sort key columns with descending flags.
+
+    Returns:
+        List of ordering expressions.
+    """
+
+    return [column.desc() if descending else column for column, descending in key]
+
+
+def merge(query: Select, partitions: List[ColumnElement], key: SortKey) -> Select:
+    """
+    Combines the query over partitions of an index, e.g. several categories, so every partition is read
+    in index order and the database merges them instead of sorting all matching rows.
+    Args:
+        query: Query ordered by the sort key.
+        partitions: Conditions selecting one partition each.
+        key: Sort key columns with descending flags.
+
+    Returns:
+        Compound query ordered by the sort key.
+    """
+
+    compound = union_all(*(query.order_by(None).where(partition) for partition in partitions))
+    columns = compound.selected_columns
+    return compound.order_by(*(columns[column.key].desc() if descending else columns[column.key]
+                               for column, descending in key))
+
+
+def after(query: Select, cursor: Tuple[int, ...] | None, key: SortKey = POPULARITY,
+          partitions: List[ColumnElement] | None = None) -> List[Select]:
+    """
+    Splits a query ordered by the sort key into queries returning rows after the cursor.
+
+    Every branch fixes a prefix of the key and compares the next column, so each of them is an index
+    range instead of a filter over all the previous pages.
+    Args:
+        query: Query ordered by the sort key.
+        cursor: Decoded cursor or None for the first page.
+        key: Sort key columns with descending flags.
+        partitions: Conditions of index partitions merged by every branch or None.
+
+    Returns:
+        List of queries which should be read in order.
+    """
+
+    branches = [[]]
+    if cursor is not None:
+        branches = []
+        for position in reversed(range(len(key))):
+            conditions = [column == value for (column, _), value in zip(key[:position], cursor)]
+            column, descending = key[position]
+            conditions.append(column < cursor[position] if descending else column > cursor[position])
+            branches.append(conditions)
+    if partitions:
+        return [merge(query.where(*conditions), partitions, key) for conditions in branches]
+    return [query.where(*conditions) for conditions in branches]
+
+
+async def fetch(query: Select, cursor: Tuple[int, ...] | None, limit: int | None, session: AsyncSession,
+                key: SortKey = POPULARITY, partitions: List[ColumnElement] | None = None) -> List[Any]:
+    """
+    Reads rows of an ordered query after the cursor.
+    Args:
+        query: Query ordered by the sort key.
+        cursor: Decoded cursor or None for the first page.
+        limit: Maximum number of rows or None for all rows.
+        session: AsyncSession instance.
+        key: Sort key columns with descending flags.
+        partitions: Conditions of index partitions merged by the query or None.
+
+    Returns:
+        List of rows.
+    """
+
+    rows = []
+    for branch in after(query, cursor, key, partitions):
+        if limit is not None:
+            branch = branch.limit(limit - len(rows))
+        result = await session.execute(branch)
+        rows.extend(result.all())
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
+
+
+def split_page(rows: List[Any], limit: int, key: SortKey = POPULARITY) -> Tuple[List[Any], str | None]:
+    """
+    Cuts the rows fetched with limit + 1 to a page and builds the next cursor.
+    Args:
+        rows: Rows fetched with one extra row.
+        limit: Page size.
+        key: Sort key columns with descending flags.
+
+    Returns:
+        Tuple of page rows and next cursor or None for the last page.
+    """
+
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(tuple(getattr(last, column.key) for column, _ in key))
+
+
+def split_offset_page(rows: List[Any], limit: int, offset: int) -> Tuple[List[Any], str | None]:
+    """
+    Cuts the rows fetched with limit + 1 to a page and builds the next offset cursor.
+    Args:
+        rows: Rows fetched with one extra row.
+        limit: Page size.
+        offset: Offset of the page.
+
+    Returns:
+        Tuple of page rows and next cursor or None for the last page.
+    """
+
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor((offset + limit,))
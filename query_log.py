@@ -0,0 +1,170 @@
+import re
+import time
+import logging
+from contextvars import ContextVar
+from typing import Callable
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Statements which can be explained without being executed.
+EXPLAINABLE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+
+
+class RequestQueries:
+    """
+    SQL statements executed while serving a request.
+    """
+
+    __slots__ = ("count", "duration")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Statements of the current request, None outside requests.
+request_queries: ContextVar[RequestQueries | None] = ContextVar("request_queries", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Endpoint executed more SQL statements than its declared budget.
+    """
+
+
+def query_budget(statements: int) -> Callable:
+    """
+    Decorator which declares the maximum number of SQL statements of an endpoint.
+    Args:
+        statements: Maximum number of statements per request.
+
+    Returns:
+        Decorator returning the endpoint itself.
+    """
+
+    def declare(endpoint: Callable) -> Callable:
+        endpoint.query_budget = statements
+        return endpoint
+
+    return declare
+
+
+def enabled() -> bool:
+    """
+    Returns whether SQL statements are counted and timed, which is needed by metrics, slow query log
+    and enforced query budgets only.
+    """
+
+    return settings.metrics or settings.slow_query_threshold is not None or settings.enforce_query_budgets
+
+
+def explain(conn, statement: str, parameters) -> str:
+    """
+    Returns execution plan of a statement without executing it.
+    Args:
+        conn: Connection which executed the statement.
+        statement: SQL statement.
+        parameters: Statement parameters, the first set of executemany.
+
+    Returns:
+        Execution plan, one step per line.
+    """
+
+    if not EXPLAINABLE.match(statement):
+        return "not explainable"
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    except Exception as exc:
+        return f"unavailable: {exc}"
+    finally:
+        cursor.close()
+    if conn.dialect.name == "sqlite":
+        return "\n".join(row[3] for row in rows)
+    return "\n".join(row[0] for row in rows)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    """
+    Engine event handler which starts timing of a statement.
+    """
+
+    context._query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    """
+    Engine event handler which adds the statement to the current request and logs it if it is slow.
+    """
+
+    elapsed = time.perf_counter() - context._query_started
+    queries = request_queries.get()
+    if queries is not None:
+        queries.count += 1
+        queries.duration += elapsed
+    threshold = settings.slow_query_threshold
+    if threshold is not None and elapsed >= threshold:
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        logger.warning("Slow query %.1f ms: %s\nParameters: %r\nPlan:\n%s", elapsed * 1000, statement, parameters,
+                       explain(conn, statement, parameters))
+
+
+def instrument(engine: AsyncEngine) -> None:
+    """
+    Counts and times SQL statements executed by the engine and logs slow ones.
+    Args:
+        engine: AsyncEngine instance.
+
+    Returns:
+        None.
+    """
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+class QueryCountMiddleware:
+    """
+    ASGI middleware which collects SQL statements of every request, reports their number in X-SQL-Statements
+    response header and checks it against the query budget of the endpoint. Exceeded budgets are logged,
+    or raised when enforce_query_budgets setting is on, e.g. in tests.
+    """
+
+    def __init__(self, app):
+        """
+        Args:
+            app: ASGI application.
+        """
+
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        queries = RequestQueries()
+
+        async def send_count(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-sql-statements", str(queries.count).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        token = request_queries.set(queries)
+        try:
+            await self.app(scope, receive, send_count)
+        finally:
+            request_queries.reset(token)
+        budget = getattr(scope.get("endpoint"), "query_budget", None)
+        if budget is not None and queries.count > budget:
+            message = f"{scope['method']} {scope['path']} executed {queries.count} SQL statements, budget is {budget}"
+            if settings.enforce_query_budgets:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from socket import socket
+from typing import List
+import uvicorn
+from settings import settings
+
+logger = logging.getLogger("uvicorn.error")
+
+# Seconds a worker serves cached recipes and leaderboard which may miss changes of other workers.
+WORKER_STATE_TTL = 5
+
+# Workers are spawned like uvicorn workers, the sockets bound by the supervisor are pickled to them.
+spawn = multiprocessing.get_context("spawn")
+multiprocessing.allow_connection_pickling()
+
+
+def serve(config: uvicorn.Config, sockets: List[socket]) -> None:
+    """
+    Runs a server in a worker process.
+    Args:
+        config: Uvicorn config.
+        sockets: Sockets bound by the supervisor.
+
+    Returns:
+        None.
+    """
+
+    # Logging isn't inherited by spawned processes.
+    config.configure_logging()
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+class Supervisor:
+    """
+    Keeps the number of worker processes serving the shared socket, restarting workers which died,
+    and gives workers graceful_timeout seconds to finish requests on shutdown before killing them.
+    """
+
+    def __init__(self, config: uvicorn.Config, graceful_timeout: float):
+        """
+        Args:
+            config: Uvicorn config with the number of workers.
+            graceful_timeout: Seconds to wait for workers to stop.
+        """
+
+        self.config = config
+        self.graceful_timeout = graceful_timeout
+        self.sockets = [config.bind_socket()]
+        self.processes: List[multiprocessing.Process] = []
+        self.should_exit = False
+
+    def handle_signal(self, signum, frame) -> None:
+        """
+        Stops the supervisor on SIGINT and SIGTERM.
+        """
+
+        self.should_exit = True
+
+    def start_worker(self) -> multiprocessing.Process:
+        """
+        Starts a worker process serving the sockets.
+        Returns:
+            Started process.
+        """
+
+        process = spawn.Process(target=serve, args=(self.config, self.sockets))
+        process.start()
+        return process
+
+    def run(self) -> None:
+        logger.info("Started parent process [%s]", os.getpid())
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.handle_signal)
+        self.processes = [self.start_worker() for _ in range(self.config.workers)]
+        while not self.should_exit:
+            time.sleep(0.5)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self.should_exit:
+                    logger.warning("Worker process [%s] died with code %s, restarting", process.pid,
+                                   process.exitcode)
+                    self.processes[index] = self.start_worker()
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        # Workers stop accepting connections on SIGTERM and finish requests in progress.
+        for process in self.processes:
+            process.terminate()
+        deadline = time.monotonic() + self.graceful_timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker process [%s] didn't stop in %s seconds, killing", process.pid,
+                               self.graceful_timeout)
+                process.kill()
+                process.join()
+        for sock in self.sockets:
+            sock.close()
+        logger.info("Stopping parent process [%s]", os.getpid())
+
+
+async def migrate() -> int:
+    """
+    Creates or upgrades database schema once, before workers are started.
+    Returns:
+        Schema version.
+    """
+
+    import migrations
+    from db import engine
+
+    try:
+        async with engine.begin() as connection:
+            return await connection.run_sync(migrations.migrate)
+    finally:
+        await engine.dispose()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CookBook API server")
+    parser.add_argument("--host", default=settings.host, help="address to bind")
+    parser.add_argument("--port", type=int, default=settings.port, help="port to bind")
+    parser.add_argument("--workers", type=int, default=settings.workers, help="number of worker processes")
+    parser.add_argument("--graceful-timeout", type=float, default=settings.graceful_timeout,
+                        help="seconds to wait for requests in progress on shutdown")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("migrations").setLevel(logging.INFO)
+    asyncio.run(migrate())
+    # Workers inherit the environment: the schema is already migrated, and every worker process keeps one
+    # SQLite write connection, so writes of a worker queue in its pool rather than on the database lock.
+    os.environ["COOKBOOK_AUTO_MIGRATE"] = "false"
+    if settings.is_sqlite:
+        os.environ.setdefault("COOKBOOK_POOL_SIZE", "1")
+        os.environ.setdefault("COOKBOOK_MAX_OVERFLOW", "0")
+    if args.workers > 1:
+        # Cached recipes and the leaderboard of a worker miss changes made by other workers until they expire.
+        os.environ.setdefault("COOKBOOK_RECIPE_CACHE_TTL", str(WORKER_STATE_TTL))
+        os.environ.setdefault("COOKBOOK_LEADERBOARD_TTL", str(WORKER_STATE_TTL))
+
+    config = uvicorn.Config("main:app", host=args.host, port=args.port, workers=args.workers)
+    Supervisor(config, args.graceful_timeout).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field
+from typing import Any, List
+from pydantic import BaseModel, Field, validator
 
 
 class BaseRecipe(BaseModel):
@@ -27,6 +28,15 @@ class RecipeOutList(BaseModel):
         orm_mode = True
 
 
+class RecipeByIngredients(RecipeOutList):
+    """
+    Model for serialization the outgoing recipes list ranked by available ingredients.
+    """
+
+    ingredients_matched: int = Field(..., ge=0)
+    ingredients_total: int = Field(..., ge=0)
+
+
 class RecipeIn(BaseRecipe):
     """
     Model for serialization the input data when creating the new recipe.
@@ -51,6 +61,15 @@ class RecipeOut(BaseRecipe):
         orm_mode = True
 
 
+class RecipeBatch(BaseModel):
+    """
+    Model for serialization the recipes requested by IDs.
+    """
+
+    recipes: List[RecipeOut] = Field(...)
+    missing: List[int] = Field(...)
+
+
 class RecipeUpdate(BaseModel):
     """
     Model for serialization the input data when updating recipe.
@@ -62,6 +81,13 @@ class RecipeUpdate(BaseModel):
     ingredients: str | None = Field(min_length=3)
     description: str | None = Field(min_length=3)
 
+    @validator("title", "cooking_time", "ingredients", "description", pre=True)
+    def not_null(cls, value):
+        # Fields may be omitted, but these columns can't be set to null.
+        if value is None:
+            raise ValueError("may not be null")
+        return value
+
     class Config:
         orm_mode = True
 
@@ -76,3 +102,40 @@ class BaseCategory(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class CategoryStats(BaseModel):
+    """
+    Model for serialization aggregates of recipes in a category.
+    """
+
+    recipes: int = Field(..., ge=0)
+    views: int = Field(..., ge=0)
+    avg_cooking_time: float | None = Field(None, ge=0)
+
+
+class CategoryWithStats(BaseCategory):
+    """
+    Model for recipe category serialization with aggregates of its recipes.
+    """
+
+    stats: CategoryStats = Field(...)
+
+
+class BulkError(BaseModel):
+    """
+    Model for serialization the error of one row of bulk import.
+    """
+
+    row: int = Field(..., ge=0)
+    detail: Any = Field(...)
+
+
+class BulkResult(BaseModel):
+    """
+    Model for serialization the bulk import report.
+    """
+
+    created: int = Field(..., ge=0)
+    ids: List[int | None] = Field(...)
+    errors: List[BulkError] = Field(...)
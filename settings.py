@@ -0,0 +1,130 @@
+import re
+from typing import Dict
+from sqlalchemy.engine import make_url
+from pydantic import BaseSettings, Field, validator
+
+SUPPORTED_DRIVERS = ("sqlite+aiosqlite", "postgresql+asyncpg")
+
+# Pragmas applied to every SQLite connection. WAL lets readers work while a write is in progress,
+# NORMAL synchronous is durable in WAL mode except for the last transactions on power loss.
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,
+    "cache_size": -20000,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+SQLITE_PRAGMAS = {
+    "journal_mode": {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"},
+    "synchronous": {"OFF", "NORMAL", "FULL", "EXTRA", "0", "1", "2", "3"},
+    "foreign_keys": {"ON", "OFF", "0", "1"},
+    "temp_store": {"DEFAULT", "FILE", "MEMORY", "0", "1", "2"},
+    "busy_timeout": int,
+    "cache_size": int,
+    "mmap_size": int,
+    "wal_autocheckpoint": int,
+    "journal_size_limit": int,
+}
+
+
+class Settings(BaseSettings):
+    """
+    Application settings read from COOKBOOK_* environment variables.
+    """
+
+    database_url: str = Field("sqlite+aiosqlite:///./db.db")
+    read_database_url: str | None = Field(None)
+    echo: bool = Field(False)
+    pool_size: int = Field(5, ge=1)
+    read_pool_size: int = Field(10, ge=1)
+    max_overflow: int = Field(10, ge=0)
+    pool_timeout: float = Field(30, gt=0)
+    pool_recycle: int = Field(3600, ge=-1)
+    sqlite_pragmas: Dict[str, str | int] = Field(DEFAULT_SQLITE_PRAGMAS)
+    views_flush_interval: float = Field(5, gt=0)
+    views_max_buffer: int = Field(1000, gt=0)
+    recipe_cache_size: int = Field(10000, ge=0)
+    recipe_cache_ttl: float = Field(300, gt=0)
+    leaderboard_ttl: float | None = Field(None, gt=0)
+    bulk_batch_size: int = Field(1000, gt=0, le=10000)
+    fast_json: bool = Field(False)
+    metrics: bool = Field(True)
+    slow_query_threshold: float | None = Field(None, ge=0)
+    enforce_query_budgets: bool = Field(False)
+    auto_migrate: bool = Field(True)
+    host: str = Field("127.0.0.1")
+    port: int = Field(8000, ge=0, le=65535)
+    workers: int = Field(1, ge=1)
+    graceful_timeout: float = Field(30, ge=0)
+    write_queue: bool = Field(False)
+    write_batch_size: int = Field(100, ge=1)
+    write_batch_wait: float = Field(0.001, ge=0)
+    views_etag_interval: float = Field(60, ge=0)
+
+    class Config:
+        env_prefix = "COOKBOOK_"
+
+    @validator("database_url", "read_database_url")
+    def check_database_url(cls, value: str | None) -> str | None:
+        if value is None:
+            return value
+        url = make_url(value)
+        if url.drivername not in SUPPORTED_DRIVERS:
+            raise ValueError(f"unsupported driver {url.drivername}, use one of: {', '.join(SUPPORTED_DRIVERS)}")
+        return value
+
+    @validator("sqlite_pragmas")
+    def check_sqlite_pragmas(cls, value: Dict[str, str | int]) -> Dict[str, str | int]:
+        pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+        for name, setting in value.items():
+            name = name.lower()
+            allowed = SQLITE_PRAGMAS.get(name)
+            if allowed is None:
+                raise ValueError(f"unsupported pragma {name}")
+            if allowed is int:
+                if not re.fullmatch(r"-?\d+", str(setting)):
+                    raise ValueError(f"pragma {name} should be an integer")
+                setting = int(setting)
+            else:
+                setting = str(setting).upper()
+                if setting not in allowed:
+                    raise ValueError(f"pragma {name} should be one of: {', '.join(sorted(allowed))}")
+            pragmas[name] = setting
+        return pragmas
+
+    @property
+    def is_sqlite(self) -> bool:
+        return make_url(self.database_url).get_backend_name() == "sqlite"
+
+    @property
+    def read_url(self) -> str:
+        """
+        URL of the database used for reads: read_database_url if set, otherwise the same SQLite file
+        opened in read-only mode or the main database.
+        """
+
+        if self.read_database_url is not None:
+            return self.read_database_url
+        url = make_url(self.database_url)
+        if not self.is_sqlite or url.database in (None, "", ":memory:") or url.database.startswith("file:"):
+            return self.database_url
+        return url.set(database=f"file:{url.database}",
+                       query=dict(url.query, mode="ro", uri="true")).render_as_string(hide_password=False)
+
+    def report(self) -> dict:
+        """
+        Settings with the database password hidden.
+        """
+
+        data = self.dict()
+        data["database_url"] = make_url(self.database_url).render_as_string(hide_password=True)
+        data["read_database_url"] = make_url(self.read_url).render_as_string(hide_password=True)
+        if not self.is_sqlite:
+            del data["sqlite_pragmas"]
+        return data
+
+
+settings = Settings()
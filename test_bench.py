@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+import bench
+import random
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_benchmark_runs_every_endpoint(tmp_path):
+    command = [sys.executable, "bench.py", "--recipes", "300", "--categories", "5", "--requests", "10",
+               "--concurrency", "4", "--output", str(tmp_path / "report.json")]
+    subprocess.run(command, check=True, capture_output=True, cwd=ROOT)
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["config"]["recipes"] == 300
+    assert len(report["results"]) == len(bench.scenarios(300, 5, random.Random(), "")) == 25
+    assert all(result["errors"] == 0 for result in report["results"].values())
+
+    result = subprocess.run(command[:-2] + ["--baseline", str(tmp_path / "report.json"), "--threshold", "1000"],
+                            capture_output=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+
+
+def test_compare_finds_regressions():
+    baseline = {"config": {"recipes": 10},
+                "results": {"list": {"errors": 0, "rps": 100, "p50_ms": 10, "p95_ms": 20, "p99_ms": 30},
+                            "top": {"errors": 0, "rps": 100, "p50_ms": 1, "p95_ms": 2, "p99_ms": 3}}}
+    report = {"config": {"recipes": 10},
+              "results": {"list": {"errors": 0, "rps": 70, "p50_ms": 11, "p95_ms": 30, "p99_ms": 30},
+                          "top": {"errors": 0, "rps": 110, "p50_ms": 1, "p95_ms": 2, "p99_ms": 3},
+                          "new": {"errors": 0, "rps": 1, "p50_ms": 1, "p95_ms": 1, "p99_ms": 1}}}
+
+    assert bench.compare(report, baseline, 0.2) == ["list: rps 100 -> 70", "list: p95_ms 20 -> 30"]
+    assert bench.compare(report, dict(baseline, config={"recipes": 20}), 1)[0].startswith("config differs")
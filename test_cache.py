@@ -0,0 +1,69 @@
+from cache import RecipeCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def payload(recipe_id, views=0):
+    return {"id": recipe_id, "title": "Title", "cooking_time": 5, "category": "Category",
+            "ingredients": "ingredients", "description": "description", "views": views}
+
+
+def test_lru_eviction():
+    cache = RecipeCache(max_size=2, ttl=60)
+    for recipe_id in (1, 2):
+        cache.put(recipe_id, 1, payload(recipe_id), cache.generation)
+    assert cache.get(1) is not None
+    cache.put(3, 1, payload(3), cache.generation)
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["hits"] == 3
+    assert cache.stats["misses"] == 1
+
+
+def test_ttl_expiration():
+    clock = FakeClock()
+    cache = RecipeCache(max_size=10, ttl=5, clock=clock)
+    cache.put(1, 1, payload(1), cache.generation)
+    clock.now = 4.9
+    assert cache.get(1) is not None
+    clock.now = 5
+    assert cache.get(1) is None
+    assert cache.stats["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_invalidate_category():
+    cache = RecipeCache(max_size=10, ttl=60)
+    cache.put(1, 1, payload(1), cache.generation)
+    cache.put(2, 1, payload(2), cache.generation)
+    cache.put(3, 2, payload(3), cache.generation)
+    cache.invalidate_category(1)
+
+    assert cache.get(1) is None
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
+    assert cache.stats["invalidations"] == 2
+
+
+def test_put_after_invalidation_is_ignored():
+    cache = RecipeCache(max_size=10, ttl=60)
+    generation = cache.generation
+    cache.invalidate(1)
+    cache.put(1, 1, payload(1), generation)
+    assert cache.get(1) is None
+
+
+def test_add_views():
+    cache = RecipeCache(max_size=10, ttl=60)
+    cache.put(1, 1, payload(1, views=2), cache.generation)
+    cache.add_views({1: 3, 2: 1})
+    assert cache.get(1)["views"] == 5
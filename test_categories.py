@@ -8,8 +8,8 @@ from starlette.testclient import TestClient
 
 @pytest.fixture(scope="module")
 def test_app():
-    client = TestClient(app)
-    yield client
+    with TestClient(app) as client:
+        yield client
 
 
 def test_create_category(test_app, monkeypatch):
@@ -79,6 +79,10 @@ def test_update_category(test_app, monkeypatch):
     assert response.status_code == 200
     assert response.json() == test_response_data
 
+    # Renaming is a single UPDATE not affected by the mocks, restore the title for the next tests.
+    response = test_app.patch("/categories/1/", content=json.dumps({"title": "Category"}))
+    assert response.status_code == 200
+
 
 def test_update_category_invalid_path(test_app, monkeypatch):
     async def mock_get(id, session):
@@ -140,4 +144,97 @@ def test_delete_category_invalid_id(test_app, monkeypatch):
 
     response = test_app.delete("/categories/100/")
     assert response.status_code == 404
-    assert response.json()["detail"] == "Category with specified ID does not exist"
\ No newline at end of file
+    assert response.json()["detail"] == "Category with specified ID does not exist"
+
+
+def test_category_titles_are_unique(test_app):
+    response = test_app.post("/categories/", content=json.dumps({"title": "Unique"}), )
+    assert response.status_code == 201
+    category_id = response.json()["id"]
+
+    response = test_app.post("/categories/", content=json.dumps({"title": "UNIQUE"}), )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Category with specified name already exists"
+    response = test_app.post("/categories/", content=json.dumps({"title": "Uniqu%"}), )
+    assert response.status_code == 201
+    other_id = response.json()["id"]
+
+    response = test_app.patch(f"/categories/{other_id}/", content=json.dumps({"title": "unique"}))
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Category with specified name already exists"
+    response = test_app.patch(f"/categories/{category_id}/", content=json.dumps({"title": "UnIqUe"}))
+    assert response.status_code == 200
+    assert response.json() == {"id": category_id, "title": "UnIqUe"}
+
+    test_app.delete(f"/categories/{category_id}/")
+    test_app.delete(f"/categories/{other_id}/")
+    response = test_app.post("/categories/", content=json.dumps({"title": "unique"}), )
+    assert response.status_code == 201
+    test_app.delete(f"/categories/{response.json()['id']}/")
+
+
+def test_delete_category_with_recipes(test_app):
+    source_id = test_app.post("/categories/", content=json.dumps({"title": "Source"}), ).json()["id"]
+    target_id = test_app.post("/categories/", content=json.dumps({"title": "Target"}), ).json()["id"]
+    recipe = {"title": "Cascaded", "cooking_time": 5, "category": source_id, "ingredients": "cascadeberries",
+              "description": "description"}
+    recipe_ids = [test_app.post("/recipes/", content=json.dumps(recipe), ).json()["id"] for _ in range(2)]
+    assert test_app.get(f"/recipes/{recipe_ids[0]}").json()["category"] == "Source"
+
+    response = test_app.delete(f"/categories/{source_id}/", params={"move_to": source_id})
+    assert response.status_code == 400
+    response = test_app.delete(f"/categories/{source_id}/", params={"move_to": 999})
+    assert response.status_code == 400
+
+    response = test_app.delete(f"/categories/{source_id}/", params={"move_to": target_id})
+    assert response.status_code == 200
+    assert response.json() == {"id": source_id, "title": "Source"}
+    assert response.headers["X-Affected-Recipes"] == "2"
+    assert test_app.get(f"/recipes/{recipe_ids[0]}").json()["category"] == "Target"
+
+    response = test_app.delete(f"/categories/{target_id}/")
+    assert response.status_code == 200
+    assert response.headers["X-Affected-Recipes"] == "2"
+    for recipe_id in recipe_ids:
+        assert test_app.get(f"/recipes/{recipe_id}").status_code == 404
+    assert test_app.get("/recipes/search", params={"q": "cascadeberries"}).json() == []
+
+
+def test_read_all_categories_not_modified(test_app):
+    etag = test_app.get("/categories/").headers["ETag"]
+    response = test_app.get("/categories/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    # Not a query-free response, one SELECT of collection_versions.
+    assert response.headers["X-SQL-Statements"] == "1"
+
+    created = test_app.post("/categories/", json={"title": "Not modified"})
+    assert test_app.get("/categories/", headers={"If-None-Match": etag}).status_code == 200
+    test_app.delete(f"/categories/{created.json()['id']}")
+
+
+def test_read_all_categories_with_stats(test_app):
+    source_id = test_app.post("/categories/", json={"title": "Stats source"}).json()["id"]
+    target_id = test_app.post("/categories/", json={"title": "Stats target"}).json()["id"]
+    recipe_ids = [test_app.post("/recipes/", json={"title": "Counted", "cooking_time": cooking_time,
+                                                   "category": source_id, "ingredients": "ingredients",
+                                                   "description": "description"}).json()["id"]
+                  for cooking_time in (10, 20, 40)]
+    test_app.patch(f"/recipes/{recipe_ids[2]}", json={"cooking_time": 30})
+    test_app.delete(f"/recipes/{recipe_ids[0]}")
+
+    response = test_app.get("/categories/", params={"with_stats": True})
+    assert response.status_code == 200
+    assert response.headers["X-SQL-Statements"] == "2"
+    stats = {category["id"]: category["stats"] for category in response.json()}
+    assert stats[source_id] == {"recipes": 2, "views": 0, "avg_cooking_time": 25}
+    assert stats[target_id] == {"recipes": 0, "views": 0, "avg_cooking_time": None}
+    assert "stats" not in test_app.get("/categories/").json()[0]
+
+    etag = response.headers["ETag"]
+    test_app.delete(f"/categories/{source_id}", params={"move_to": target_id})
+    response = test_app.get("/categories/", params={"with_stats": True}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    stats = {category["id"]: category["stats"] for category in response.json()}
+    assert source_id not in stats
+    assert stats[target_id] == {"recipes": 2, "views": 0, "avg_cooking_time": 25}
+    test_app.delete(f"/categories/{target_id}")
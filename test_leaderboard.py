@@ -0,0 +1,157 @@
+import os
+import sys
+import asyncio
+import pytest
+import textwrap
+import subprocess
+from sqlalchemy import update, delete
+from models import Recipes, RecipeCategory
+from leaderboard import Leaderboard
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Started in a new process, the leaderboard of this one may be already loaded by other tests.
+STARTUP_SCRIPT = textwrap.dedent("""
+    import main
+    from sqlalchemy import event
+    from starlette.testclient import TestClient
+
+    statements = []
+
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+
+    engines = (main.engine.sync_engine, main.read_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "after_cursor_execute", count)
+    with TestClient(main.app):
+        for engine in engines:
+            event.remove(engine, "after_cursor_execute", count)
+        # Only the schema version is checked, the leaderboard is loaded by the first request to it.
+        assert len(statements) == 1, statements
+        assert not main.leaderboard.loaded
+""")
+
+RECIPES = [(1, 1, 30, 5), (2, 1, 10, 5), (3, 2, 10, 5), (4, 2, 20, 9), (5, None, 10, 0)]
+
+
+@pytest.fixture()
+def seed_rows():
+    return [RecipeCategory(id=1, title="Soups"), RecipeCategory(id=2, title="Salads"),
+            RecipeCategory(id=3, title="Empty")] + [
+        Recipes(id=recipe_id, title=f"Title_{recipe_id}", category=category, cooking_time=cooking_time,
+                ingredients="ingredients", description="description", views=views)
+        for recipe_id, category, cooking_time, views in RECIPES]
+
+
+async def loaded(session_factory):
+    board = Leaderboard()
+    async with session_factory() as session:
+        await board.load(session)
+    return board
+
+
+async def check(board, session_factory):
+    async with session_factory() as session:
+        return await board.check(session)
+
+
+def test_top(session_factory):
+    board = asyncio.run(loaded(session_factory))
+
+    assert [recipe["id"] for recipe in board.top(10)] == [4, 3, 2, 1, 5]
+    assert board.top(1) == [{"title": "Title_4", "cooking_time": 20, "category": "Salads", "views": 9, "id": 4}]
+    assert [recipe["id"] for recipe in board.top(10, 1)] == [2, 1]
+    assert board.top(10, 3) == []
+    assert board.top(10, 4) is None
+
+    pending = {5: 5, 1: 1, 3: 10, 100: 1}
+    assert [recipe["id"] for recipe in board.top(3, pending=pending)] == [3, 4, 1]
+    assert board.top(1, 2, pending)[0] == {"title": "Title_3", "cooking_time": 10, "category": "Salads", "views": 15,
+                                          "id": 3}
+    assert [recipe["id"] for recipe in board.top(10, 1, pending)] == [1, 2]
+
+
+def test_incremental_updates(session_factory):
+    board = asyncio.run(loaded(session_factory))
+
+    async def mutate():
+        async with session_factory() as session:
+            await session.execute(update(Recipes).where(Recipes.id == 5).values(views=Recipes.views + 20))
+            await session.execute(update(Recipes).where(Recipes.id == 1).values(title="Renamed", category=2))
+            await session.execute(delete(Recipes).where(Recipes.id == 2))
+            session.add(Recipes(id=6, title="Title_6", category=1, cooking_time=1, ingredients="ingredients",
+                                description="description", views=0))
+            await session.execute(update(RecipeCategory).where(RecipeCategory.id == 2).values(title="Cold"))
+            await session.execute(update(Recipes).where(Recipes.category == 1).values(category=3))
+            await session.execute(delete(RecipeCategory).where(RecipeCategory.id == 1))
+            await session.commit()
+
+    asyncio.run(mutate())
+    board.add_views({5: 20, 100: 1})
+    board.put(1, "Renamed", 2, 30, 5)
+    board.remove(2)
+    board.put(6, "Title_6", 1, 1, 0)
+    board.set_category(2, "Cold")
+    board.remove_category(1, move_to=3)
+
+    assert asyncio.run(check(board, session_factory))["consistent"]
+    assert [recipe["id"] for recipe in board.top(10)] == [5, 4, 3, 1, 6]
+    assert [recipe["id"] for recipe in board.top(10, 2)] == [4, 3, 1]
+    assert board.top(10, 1) is None
+
+    async def delete_category():
+        async with session_factory() as session:
+            await session.execute(delete(Recipes).where(Recipes.category == 2))
+            await session.execute(delete(RecipeCategory).where(RecipeCategory.id == 2))
+            await session.commit()
+
+    asyncio.run(delete_category())
+    board.remove_category(2)
+    assert asyncio.run(check(board, session_factory))["consistent"]
+    assert [recipe["id"] for recipe in board.top(10)] == [5, 6]
+
+
+def test_check_finds_differences(session_factory):
+    board = asyncio.run(loaded(session_factory))
+    board.add_views({3: 10})
+
+    result = asyncio.run(check(board, session_factory))
+    assert not result["consistent"]
+    assert result["recipes"] == 5
+    assert result["mismatched"] == [3]
+    assert not result["rankings"]
+
+
+def test_reload_after_max_age(session_factory):
+    now = [0.0]
+    board = Leaderboard(max_age=10, clock=lambda: now[0])
+    assert not board.fresh
+
+    async def reload(views):
+        async with session_factory() as session:
+            # Views written by another process.
+            await session.execute(update(Recipes).where(Recipes.id == 5).values(views=views))
+            await session.commit()
+            await board.load(session)
+
+    asyncio.run(reload(0))
+    now[0] = 9.9
+    assert board.fresh
+    now[0] = 10
+    assert not board.fresh
+    asyncio.run(reload(100))
+    assert board.fresh
+    assert [recipe["id"] for recipe in board.top(2)] == [5, 4]
+
+
+def test_startup_does_not_load(tmp_path):
+    env = dict(os.environ, COOKBOOK_DATABASE_URL=f"sqlite+aiosqlite:///{tmp_path}/test.db", PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, "manage.py", "migrate"], env=env, capture_output=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
+
+    script = tmp_path / "startup.py"
+    script.write_text(STARTUP_SCRIPT)
+    result = subprocess.run([sys.executable, script], env=env, capture_output=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,65 @@
+import os
+import sys
+import sqlite3
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def manage(database, *command):
+    env = dict(os.environ, COOKBOOK_DATABASE_URL=f"sqlite+aiosqlite:///{database}")
+    return subprocess.run([sys.executable, "manage.py", *command], env=env, capture_output=True, text=True, cwd=ROOT)
+
+
+def test_migrate(tmp_path):
+    database = tmp_path / "manage.db"
+    result = manage(database, "status")
+    assert result.returncode == 1
+    assert result.stdout.startswith("Database schema version 0")
+
+    result = manage(database, "migrate")
+    assert result.returncode == 0, result.stderr
+    assert "Schema version 0 ->" in result.stdout
+
+    result = manage(database, "migrate")
+    assert result.returncode == 0, result.stderr
+    assert "up to date" in result.stdout
+    assert manage(database, "status").returncode == 0
+
+
+def test_repair_stats(tmp_path):
+    database = tmp_path / "manage.db"
+    assert manage(database, "migrate").returncode == 0
+    with sqlite3.connect(database) as connection:
+        connection.execute("INSERT INTO recipe_cat (id, title) VALUES (1, 'Soups'), (2, 'Salads')")
+        connection.execute("INSERT INTO recipes (title, category, cooking_time, ingredients, description, views) "
+                           "VALUES ('Borscht', 1, 90, 'beetroot', 'Soup', 3), ('Shchi', 1, 30, 'cabbage', 'Soup', 1)")
+        connection.execute("UPDATE recipe_cat SET recipe_count = 7, total_views = 0")
+
+    result = manage(database, "repair-stats")
+    assert result.returncode == 0, result.stderr
+    assert "2 categories corrected" in result.stdout
+    with sqlite3.connect(database) as connection:
+        stats = connection.execute("SELECT recipe_count, total_views, total_cooking_time FROM recipe_cat "
+                                   "ORDER BY id").fetchall()
+    assert stats == [(2, 4, 120), (0, 0, 0)]
+    assert "0 categories corrected" in manage(database, "repair-stats").stdout
+
+
+def test_index_ingredients(tmp_path):
+    database = tmp_path / "manage.db"
+    assert manage(database, "migrate").returncode == 0
+    with sqlite3.connect(database) as connection:
+        connection.execute("INSERT INTO recipe_cat (id, title) VALUES (1, 'Soups')")
+        connection.executemany("INSERT INTO recipes (title, category, cooking_time, ingredients, description) "
+                               "VALUES (?, 1, 30, ?, 'Soup')", [("Borscht", "beetroot, cabbage"),
+                                                                ("Shchi", "Cabbage, 2 potatoes"), ("Water", "...")])
+
+    result = manage(database, "index-ingredients", "--batch-size", "2")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ["Indexed ingredients of 2 recipes", "Indexed ingredients of 3 recipes"]
+    assert manage(database, "index-ingredients").returncode == 0
+    with sqlite3.connect(database) as connection:
+        index = connection.execute("SELECT recipe_id, name FROM recipe_ingredients "
+                                   "JOIN ingredients ON ingredients.id = ingredient_id ORDER BY recipe_id, name")
+        assert index.fetchall() == [(1, "beetroot"), (1, "cabbage"), (2, "cabbage"), (2, "potatoes")]
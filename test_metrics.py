@@ -0,0 +1,60 @@
+import os
+import sys
+import metrics
+import subprocess
+from main import app
+from view_counter import view_counter
+from starlette.testclient import TestClient
+
+
+def sample(text, line_start):
+    return next(float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(line_start))
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("route",), (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, ("/a",))
+
+    assert histogram.render().splitlines() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a",le="0.1"} 2',
+        'test_seconds_bucket{route="/a",le="1"} 3',
+        'test_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_seconds_sum{route="/a"} 3.65',
+        'test_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_metrics_endpoint():
+    with TestClient(app) as client:
+        client.get("/recipes/", params={"limit": 1})
+        client.get("/recipes/not-a-page/at/all")
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    text = response.text
+    assert sample(text, 'cookbook_http_requests_total{method="GET",route="/recipes/",status="200"}') >= 1
+    assert sample(text, 'cookbook_http_requests_total{method="GET",route="unmatched",status="404"}') >= 1
+    assert sample(text, 'cookbook_db_statements_per_request_count{method="GET",route="/recipes/"}') >= 1
+    assert sample(text, 'cookbook_db_statements_per_request_sum{method="GET",route="/recipes/"}') >= 1
+    assert sample(text, 'cookbook_db_query_duration_seconds_per_request_sum{method="GET",route="/recipes/"}') > 0
+    assert sample(text, 'cookbook_db_pool_checkout_wait_seconds_count{pool="read"}') >= 1
+    assert sample(text, "cookbook_http_requests_in_flight") == 1
+
+
+def test_views_pending_gauge(monkeypatch):
+    monkeypatch.setattr(view_counter, "_buffered", view_counter._buffered + 3)
+    assert sample(metrics.render(), "cookbook_views_pending") == view_counter.pending >= 3
+
+
+def test_metrics_disabled():
+    code = ("import main, metrics; "
+            "assert all(route.path != '/metrics' for route in main.app.routes); "
+            "assert all(middleware.cls is not metrics.MetricsMiddleware for middleware in main.app.user_middleware); "
+            "assert not isinstance(main.engine.pool, metrics.TimedQueuePool)")
+    env = dict(os.environ, COOKBOOK_METRICS="false")
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,168 @@
+import pytest
+import migrations
+from sqlalchemy import select, create_engine, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import sqlite
+from models import Recipes, RecipeCategory
+
+# Schema created by models before versioning was introduced.
+LEGACY_SCHEMA = [
+    "CREATE TABLE recipe_cat (id INTEGER NOT NULL, title VARCHAR NOT NULL, PRIMARY KEY (id))",
+    "CREATE INDEX ix_recipe_cat_id ON recipe_cat (id)",
+    "CREATE INDEX ix_recipe_cat_title ON recipe_cat (title)",
+    "CREATE TABLE recipes (id INTEGER NOT NULL, title VARCHAR NOT NULL, category INTEGER, "
+    "cooking_time INTEGER NOT NULL, ingredients TEXT NOT NULL, description TEXT NOT NULL, views INTEGER, "
+    "PRIMARY KEY (id), FOREIGN KEY(category) REFERENCES recipe_cat (id))",
+] + [f"CREATE INDEX ix_recipes_{column} ON recipes ({column})"
+     for column in ("id", "title", "cooking_time", "ingredients", "description", "views")]
+
+
+@pytest.fixture()
+def legacy_db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO recipe_cat VALUES (1, 'Soups')")
+        connection.exec_driver_sql("INSERT INTO recipes VALUES (1, 'Borscht', 1, 90, 'beetroot, cabbage', "
+                                   "'Classic soup', 3)")
+    yield engine
+    engine.dispose()
+
+
+def explain(connection, query):
+    sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    return " ".join(row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+
+
+def test_upgrade_legacy_db(legacy_db):
+    with legacy_db.begin() as connection:
+        assert migrations.get_version(connection) == 0
+        assert migrations.upgrade(connection) == migrations.SCHEMA_VERSION
+
+    with legacy_db.connect() as connection:
+        assert migrations.get_version(connection) == migrations.SCHEMA_VERSION
+        indexes = {row[0] for row in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'recipes' AND sql IS NOT NULL")}
+        assert indexes == {"ix_recipes_popularity", "ix_recipes_category_popularity", "ix_recipes_quickest",
+                           "ix_recipes_category_quickest", "ix_recipes_category_newest"}
+        found = connection.exec_driver_sql("SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH 'beetroot'")
+        assert found.scalars().all() == [1]
+        assert connection.exec_driver_sql("SELECT version FROM recipes WHERE id = 1").scalar() == 1
+
+
+def test_upgrade_is_applied_once(legacy_db):
+    with legacy_db.begin() as connection:
+        migrations.upgrade(connection)
+    with legacy_db.begin() as connection:
+        connection.exec_driver_sql("CREATE INDEX ix_recipes_views ON recipes (views)")
+        migrations.upgrade(connection)
+        assert connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'ix_recipes_views'").scalar()
+
+
+def test_popularity_order_uses_index(legacy_db):
+    with legacy_db.begin() as connection:
+        migrations.upgrade(connection)
+        query = (select(Recipes.id, Recipes.title, RecipeCategory.title.label("category"), Recipes.cooking_time,
+                        Recipes.views).outerjoin(RecipeCategory)
+                 .order_by(Recipes.views.desc(), Recipes.cooking_time, Recipes.id.desc()).limit(10))
+
+        plan = explain(connection, query)
+        assert "ix_recipes_popularity" in plan
+        assert "TEMP B-TREE" not in plan
+
+        plan = explain(connection, query.where(Recipes.category == 1))
+        assert "ix_recipes_category_popularity" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_unique_category_titles(legacy_db):
+    with legacy_db.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO recipe_cat VALUES (2, 'SOUPS'), (3, 'soups'), (4, 'Salads')")
+        migrations.upgrade(connection)
+        titles = connection.exec_driver_sql("SELECT id, title FROM recipe_cat ORDER BY id").all()
+        assert titles == [(1, "Soups"), (2, "SOUPS (2)"), (3, "soups (3)"), (4, "Salads")]
+        plan = explain(connection, select(RecipeCategory.id).where(func.lower(RecipeCategory.title) == "salads"))
+        assert "ix_recipe_cat_title_lower" in plan
+
+    with pytest.raises(IntegrityError), legacy_db.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO recipe_cat (title) VALUES ('SALADS')")
+
+
+def test_cascade_category_delete(legacy_db):
+    with legacy_db.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO recipes VALUES (2, 'Lost', 7, 10, 'salt', 'Orphan', 0)")
+        migrations.upgrade(connection)
+
+    with legacy_db.connect() as connection:
+        assert inspect(connection).get_foreign_keys("recipes")[0]["options"] == {"ondelete": "CASCADE"}
+        assert connection.exec_driver_sql("SELECT category FROM recipes WHERE id = 2").scalar() is None
+        objects = {row[0] for row in connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE tbl_name = 'recipes' AND sql IS NOT NULL")}
+        assert objects == {"recipes", "ix_recipes_popularity", "ix_recipes_category_popularity",
+                           "ix_recipes_quickest", "ix_recipes_category_quickest", "ix_recipes_category_newest",
+                           "recipes_fts_insert", "recipes_fts_delete", "recipes_fts_update", "recipes_stats_insert",
+                           "recipes_stats_delete", "recipes_stats_update", "recipes_stats_move",
+                           "recipes_version_insert", "recipes_version_delete", "recipes_version_update"}
+
+        connection.exec_driver_sql("PRAGMA foreign_keys = ON")
+        with connection.begin():
+            connection.exec_driver_sql("DELETE FROM recipe_cat WHERE id = 1")
+        assert connection.exec_driver_sql("SELECT id FROM recipes").scalars().all() == [2]
+        versions = connection.exec_driver_sql("SELECT name, version FROM collection_versions ORDER BY name").all()
+        assert versions == [("categories", 1), ("recipes", 2), ("views", 0)]
+        found = connection.exec_driver_sql("SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH 'beetroot'")
+        assert found.scalars().all() == []
+
+
+def schema(connection):
+    return sorted(connection.exec_driver_sql("SELECT type, name, tbl_name FROM sqlite_master WHERE sql IS NOT NULL"))
+
+
+def test_migrate_new_db(tmp_path, legacy_db):
+    engine = create_engine(f"sqlite:///{tmp_path}/new.db")
+    with engine.begin() as connection:
+        assert migrations.migrate(connection) == migrations.SCHEMA_VERSION
+    with legacy_db.begin() as connection:
+        migrations.migrate(connection)
+
+    with engine.connect() as connection, legacy_db.connect() as legacy:
+        assert migrations.get_version(connection) == migrations.SCHEMA_VERSION
+        assert schema(connection) == schema(legacy)
+    engine.dispose()
+
+
+def test_check(legacy_db):
+    with pytest.raises(migrations.SchemaMismatch, match="manage.py migrate"), legacy_db.begin() as connection:
+        migrations.check(connection)
+
+    with legacy_db.begin() as connection:
+        assert migrations.check(connection, auto_migrate=True) == migrations.SCHEMA_VERSION
+        assert migrations.check(connection) == migrations.SCHEMA_VERSION
+        migrations.set_version(connection, migrations.SCHEMA_VERSION + 1)
+    with pytest.raises(migrations.SchemaMismatch, match="newer"), legacy_db.begin() as connection:
+        migrations.check(connection, auto_migrate=True)
+
+
+def test_category_stats(legacy_db):
+    def stats(connection):
+        return connection.exec_driver_sql("SELECT id, recipe_count, total_views, total_cooking_time FROM recipe_cat "
+                                          "ORDER BY id").all()
+
+    with legacy_db.begin() as connection:
+        migrations.upgrade(connection)
+        assert stats(connection) == [(1, 1, 3, 90)]
+
+        connection.exec_driver_sql("INSERT INTO recipe_cat (id, title) VALUES (2, 'Salads')")
+        connection.exec_driver_sql("INSERT INTO recipes (id, title, category, cooking_time, ingredients, description, "
+                                   "views) VALUES (2, 'Olivier', 2, 40, 'potato', 'Salad', 0)")
+        connection.exec_driver_sql("UPDATE recipes SET views = views + 5 WHERE id IN (1, 2)")
+        connection.exec_driver_sql("UPDATE recipes SET title = 'Borsch' WHERE id = 1")
+        assert stats(connection) == [(1, 1, 8, 90), (2, 1, 5, 40)]
+
+        connection.exec_driver_sql("UPDATE recipes SET category = 2, cooking_time = 60 WHERE id = 1")
+        assert stats(connection) == [(1, 0, 0, 0), (2, 2, 13, 100)]
+
+        connection.exec_driver_sql("DELETE FROM recipes WHERE id = 2")
+        assert stats(connection) == [(1, 0, 0, 0), (2, 1, 8, 60)]
+        assert migrations.recount_category_stats(connection) == 0
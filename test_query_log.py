@@ -0,0 +1,64 @@
+import os
+import sys
+import pytest
+import logging
+import subprocess
+from main import app, get_categories
+from settings import settings
+from query_log import QueryBudgetExceeded
+from starlette.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def test_app():
+    with TestClient(app) as client:
+        yield client
+
+
+def test_statements_header(test_app):
+    response = test_app.get("/categories/")
+    assert response.status_code == 200
+    assert 0 < int(response.headers["X-SQL-Statements"]) <= get_categories.query_budget
+
+
+def test_query_budget_enforced(test_app, monkeypatch):
+    monkeypatch.setattr(get_categories, "query_budget", 0)
+    with pytest.raises(QueryBudgetExceeded, match=r"GET /categories/ executed \d+ SQL statements, budget is 0"):
+        test_app.get("/categories/")
+
+
+def test_query_budget_logged(test_app, monkeypatch, caplog):
+    monkeypatch.setattr(get_categories, "query_budget", 0)
+    monkeypatch.setattr(settings, "enforce_query_budgets", False)
+    with caplog.at_level(logging.WARNING, logger="query_log"):
+        response = test_app.get("/categories/")
+    assert response.status_code == 200
+    assert "budget is 0" in caplog.text
+
+
+def test_slow_query_log(test_app, monkeypatch, caplog, category):
+    test_app.post("/recipes/", json={"title": "Borscht", "cooking_time": 90, "category": category["id"],
+                                     "ingredients": "beetroot, cabbage", "description": "description"})
+    monkeypatch.setattr(settings, "slow_query_threshold", 0)
+    with caplog.at_level(logging.WARNING, logger="query_log"):
+        test_app.get("/recipes/search", params={"q": "beetroot"})
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow query")]
+    assert len(slow) == 1
+    assert "recipes_fts MATCH" in slow[0]
+    assert '"beetroot"*' in slow[0]
+    assert "Plan:\n" in slow[0] and "VIRTUAL TABLE INDEX" in slow[0]
+
+
+def test_statements_not_counted_when_unused():
+    code = ("import main, query_log; from sqlalchemy import event; "
+            "assert all(middleware.cls is not query_log.QueryCountMiddleware "
+            "for middleware in main.app.user_middleware); "
+            "assert not event.contains(main.engine.sync_engine, 'after_cursor_execute', "
+            "query_log.after_cursor_execute); "
+            "assert not event.contains(main.read_engine.sync_engine, 'before_cursor_execute', "
+            "query_log.before_cursor_execute)")
+    env = dict(os.environ, COOKBOOK_METRICS="false", COOKBOOK_ENFORCE_QUERY_BUDGETS="false")
+    env.pop("COOKBOOK_SLOW_QUERY_THRESHOLD", None)
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
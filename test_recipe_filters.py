@@ -0,0 +1,74 @@
+import pytest
+import itertools
+import migrations
+import pagination
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+from crud_recipes import select_all, BY_INGREDIENTS
+
+# Index read by every sort order over all recipes and in categories, None if the table is read by primary key.
+INDEXES = {
+    "popular": ("ix_recipes_popularity", "ix_recipes_category_popularity"),
+    "quickest": ("ix_recipes_quickest", "ix_recipes_category_quickest"),
+    "newest": (None, "ix_recipes_category_newest"),
+}
+FILTERS = [{}, {"cooking_time_min": 10, "cooking_time_max": 30}, {"views_min": 5},
+           {"cooking_time_max": 30, "views_min": 5}]
+CATEGORIES = [None, [1], [1, 2, 3]]
+
+
+@pytest.fixture(scope="module")
+def connection(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans')}/plans.db")
+    with engine.begin() as connection:
+        migrations.migrate(connection)
+    with engine.connect() as connection:
+        yield connection
+    engine.dispose()
+
+
+def explain(connection, query):
+    sql = str(query.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    return [row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+
+
+@pytest.mark.parametrize("sort, filters, categories", itertools.product(pagination.SORTS, FILTERS, CATEGORIES))
+def test_recipe_list_plans(connection, sort, filters, categories):
+    query, partitions = select_all(sort, categories=categories, **filters)
+    key = pagination.SORTS[sort]
+    index = INDEXES[sort][categories is not None]
+    for cursor in (None, (7,) * len(key)):
+        for branch in pagination.after(query, cursor, key, partitions):
+            plan = explain(connection, branch.limit(10))
+            reads = [step for step in plan if step.startswith(("SCAN recipes", "SEARCH recipes"))]
+            assert len(reads) == len(partitions or [None]), plan
+            assert not [step for step in plan if "TEMP B-TREE" in step], plan
+            for step in reads:
+                if index is None:
+                    # The newest recipes are read from the table backwards, filters are checked on every row.
+                    assert step == ("SCAN recipes" if cursor is None
+                                    else "SEARCH recipes USING INTEGER PRIMARY KEY (rowid<?)"), plan
+                    continue
+                if cursor is None:
+                    # Later branches fix every column but the last one, any index starting with them fits.
+                    assert f"INDEX {index}" in step, plan
+                assert "INDEX" in step, plan
+
+
+def test_leading_filter_is_index_range(connection):
+    query, _ = select_all("quickest", cooking_time_min=10, cooking_time_max=30)
+    assert "ix_recipes_quickest (cooking_time>? AND cooking_time<?)" in explain(connection, query)[0]
+
+    query, _ = select_all("popular", cooking_time_max=30, views_min=5, categories=[1])
+    assert "ix_recipes_category_popularity (category=? AND views>?)" in explain(connection, query)[0]
+
+
+def test_by_ingredients_plan(connection):
+    sql = str(BY_INGREDIENTS.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True,
+                                                                                "render_postcompile": True}))
+    plan = [row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, {"limit": 10, "offset": 0})]
+    # Recipes are found by ranges of the ingredient index, only the found ones are read and ranked.
+    assert "SEARCH ingredients USING COVERING INDEX sqlite_autoindex_ingredients_1 (name=?)" in plan
+    assert "SEARCH recipe_ingredients USING PRIMARY KEY (ingredient_id=?)" in plan
+    assert "SEARCH recipes USING INTEGER PRIMARY KEY (rowid=?)" in plan
+    assert [step for step in plan if step.startswith("SCAN")] == ["SCAN matched"], plan
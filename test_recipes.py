@@ -1,16 +1,22 @@
 import json
+import asyncio
 import pytest
+import schemas
 import crud_cats
 import crud_recipes
+import fast_json
 from main import app
-from models import Recipes
+from models import Recipes, RecipeCategory
+from settings import settings
+from view_counter import view_counter
+from sqlalchemy.exc import IntegrityError
 from starlette.testclient import TestClient
 
 
 @pytest.fixture(scope="module")
 def test_app():
-    client = TestClient(app)
-    yield client
+    with TestClient(app) as client:
+        yield client
 
 
 def test_create_recipe(test_app, monkeypatch):
@@ -124,7 +130,7 @@ def test_read_all_recipes_by_cat(test_app, monkeypatch):
 
 def test_update_recipe(test_app, monkeypatch):
     test_data = \
-        {"id": 1, "title": "New_title", "cooking_time": 5, "category": "1",
+        {"id": 1, "title": "New_title", "cooking_time": 5, "category": "Category",
          "ingredients": "ingredients", "description": "description", "views": 0}
 
     async def mock_get(id, session):
@@ -207,3 +213,384 @@ def test_delete_recipe_invalid_id(test_app, monkeypatch):
     response = test_app.delete("/recipes/100/")
     assert response.status_code == 404
     assert response.json()["detail"] == "Recipe with specified ID does not exist"
+
+
+def test_read_all_recipes_pages(test_app, category):
+    for title in ("Page_1", "Page_2", "Page_3"):
+        test_request_payload = \
+            {"title": title, "cooking_time": 7, "category": category["id"], "ingredients": "ingredients",
+             "description": "description"}
+        response = test_app.post("/recipes/", content=json.dumps(test_request_payload), )
+        assert response.status_code == 201
+
+    response = test_app.get("/recipes/", params={"limit": 1000})
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+    expected = response.json()
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, "cursor": cursor} if cursor else {"limit": 2}
+        response = test_app.get("/recipes/", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        pages.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == expected
+
+
+def test_read_all_recipes_invalid_cursor(test_app):
+    response = test_app.get("/recipes/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+    response = test_app.get("/recipes/", params={"limit": 0})
+    assert response.status_code == 422
+
+
+def test_read_recipe_cached(test_app, category):
+    test_request_payload = \
+        {"title": "Cached", "cooking_time": 5, "category": category["id"], "ingredients": "ingredients",
+         "description": "description"}
+    response = test_app.post("/recipes/", content=json.dumps(test_request_payload), )
+    recipe_id = response.json()["id"]
+    hits = test_app.get("/diagnostics/cache").json()["hits"]
+
+    assert test_app.get(f"/recipes/{recipe_id}").json()["views"] == 0
+    response = test_app.get(f"/recipes/{recipe_id}")
+    assert response.json()["views"] == 1
+    assert test_app.get("/diagnostics/cache").json()["hits"] == hits + 1
+
+    test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({"title": "New_cached"}))
+    response = test_app.get(f"/recipes/{recipe_id}")
+    assert response.json()["title"] == "New_cached"
+    assert response.json()["views"] == 2
+
+
+def test_search_recipes(test_app, category):
+    test_recipes = [
+        {"title": "Borscht", "cooking_time": 90, "category": category["id"],
+         "ingredients": "beetroot, cabbage, potatoes", "description": "Classic beetroot soup"},
+        {"title": "Salad", "cooking_time": 15, "category": category["id"], "ingredients": "beetroot, walnuts, garlic",
+         "description": "Cold appetizer"},
+        {"title": "Soup", "cooking_time": 30, "category": category["id"], "ingredients": "cabbage, carrots",
+         "description": "Vegetable soup"},
+    ]
+    ids = []
+    # Searches are limited to the category of the test, other tests may have recipes with the same words.
+    search = {"category": category["id"]}
+    for recipe in test_recipes:
+        ids.append(test_app.post("/recipes/", content=json.dumps(recipe), ).json()["id"])
+
+    response = test_app.get("/recipes/search", params={**search, "q": "beetroot"})
+    assert response.status_code == 200
+    assert [recipe["id"] for recipe in response.json()] == [ids[0], ids[1]]
+
+    response = test_app.get("/recipes/search", params={**search, "q": "Cabbage SOUP"})
+    assert sorted(recipe["id"] for recipe in response.json()) == [ids[0], ids[2]]
+
+    response = test_app.get("/recipes/search", params={**search, "q": "walnu"})
+    assert [recipe["id"] for recipe in response.json()] == [ids[1]]
+
+    response = test_app.get("/recipes/search", params={"q": "beetroot", "category": 999})
+    assert response.json() == []
+
+    test_app.patch(f"/recipes/{ids[1]}/", content=json.dumps({"ingredients": "apples, walnuts"}))
+    response = test_app.get("/recipes/search", params={**search, "q": "beetroot"})
+    assert [recipe["id"] for recipe in response.json()] == [ids[0]]
+
+    response = test_app.get("/recipes/search", params={**search, "q": "cabbage", "limit": 1})
+    cursor = response.headers["X-Next-Cursor"]
+    response = test_app.get("/recipes/search", params={**search, "q": "cabbage", "limit": 1, "cursor": cursor})
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+    test_app.delete(f"/recipes/{ids[2]}/")
+    response = test_app.get("/recipes/search", params={**search, "q": "carrots"})
+    assert response.json() == []
+
+    response = test_app.get("/recipes/search", params={**search, "q": "!!!"})
+    assert response.status_code == 400
+
+
+def test_bulk_create_recipes(test_app, category):
+    recipe = {"title": "Bulk", "cooking_time": 10, "category": category["id"], "ingredients": "ingredients",
+              "description": "description"}
+    rows = [recipe, dict(recipe, cooking_time=0), dict(recipe, category=999), dict(recipe, title="Bulk_2")]
+
+    response = test_app.post("/recipes/bulk", params={"batch_size": 2}, content=json.dumps(rows))
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert [error["row"] for error in result["errors"]] == [1, 2]
+    assert result["errors"][1]["detail"] == "Category with specified ID does not exist"
+    first, _, _, last = result["ids"]
+    assert test_app.get(f"/recipes/{first}").json()["title"] == "Bulk"
+    assert test_app.get(f"/recipes/{last}").json()["title"] == "Bulk_2"
+
+    body = "\n".join([json.dumps(recipe), "{not json", "", json.dumps(dict(recipe, title="Bulk_3"))])
+    response = test_app.post("/recipes/bulk", content=body, headers={"content-type": "application/x-ndjson"})
+    result = response.json()
+    assert result["created"] == 2
+    assert result["errors"][0]["row"] == 1
+    assert result["ids"][1] is None
+    assert test_app.get(f"/recipes/{result['ids'][2]}").json()["title"] == "Bulk_3"
+
+    response = test_app.post("/recipes/bulk", content=json.dumps(recipe))
+    assert response.status_code == 400
+
+
+def test_export_recipes(test_app, category):
+    recipe = {"title": "Exported", "cooking_time": 5, "category": category["id"], "ingredients": "ingredients",
+              "description": "description"}
+    recipe_id = test_app.post("/recipes/", json=recipe).json()["id"]
+    recipes = test_app.get("/recipes/", params={"limit": 1000}).json()
+    cached = test_app.get(f"/recipes/{recipe_id}").json()
+
+    response = test_app.get("/recipes/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [recipe["id"] for recipe in exported] == sorted(recipe["id"] for recipe in recipes)
+    assert next(recipe for recipe in exported if recipe["id"] == cached["id"])["ingredients"] == cached["ingredients"]
+
+    response = test_app.get("/recipes/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,title,category,cooking_time,ingredients,description,views"
+    assert len(lines) == len(recipes) + 1
+
+    assert test_app.get(f"/recipes/{cached['id']}").json()["views"] == cached["views"] + 1
+
+    response = test_app.get("/recipes/export", params={"format": "xml"})
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_read_all_recipes_fast_json(test_app, monkeypatch, category, use_orjson):
+    test_request_payload = \
+        {"title": "Борщ \"Южный\"", "cooking_time": 60, "category": category["id"],
+         "ingredients": "свёкла, капуста", "description": "description"}
+    for _ in range(3):
+        test_app.post("/recipes/", content=json.dumps(test_request_payload), )
+    if not use_orjson:
+        monkeypatch.setattr(fast_json, "orjson", None)
+
+    for url, params in (("/recipes/", {"limit": 1000}), ("/recipes/", {"limit": 2}),
+                        (f"/categories/{category['id']}", {"limit": 2})):
+        expected = test_app.get(url, params=params)
+        monkeypatch.setattr(settings, "fast_json", True)
+        response = test_app.get(url, params=params)
+        monkeypatch.setattr(settings, "fast_json", False)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == expected.headers["content-type"]
+        assert response.headers.get("X-Next-Cursor") == expected.headers.get("X-Next-Cursor")
+        assert response.content == expected.content
+
+
+def test_update_recipe_if_match(test_app, category):
+    test_request_payload = \
+        {"title": "Versioned", "cooking_time": 5, "category": category["id"], "ingredients": "ingredients",
+         "description": "description"}
+    recipe_id = test_app.post("/recipes/", content=json.dumps(test_request_payload), ).json()["id"]
+    response = test_app.get(f"/recipes/{recipe_id}")
+    etag = response.headers["ETag"]
+    assert etag == '"1"'
+
+    response = test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({"cooking_time": 10}),
+                              headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+    assert response.json() == {"id": recipe_id, "title": "Versioned", "cooking_time": 10,
+                               "category": category["title"], "ingredients": "ingredients",
+                               "description": "description", "views": 0}
+
+    response = test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({"title": "Stale"}),
+                              headers={"If-Match": etag})
+    assert response.status_code == 412
+    response = test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({"title": "Stale"}),
+                              headers={"If-Match": 'W/"2"'})
+    assert response.status_code == 412
+    response = test_app.patch("/recipes/100000/", content=json.dumps({"title": "Stale"}), headers={"If-Match": etag})
+    assert response.status_code == 404
+
+    response = test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({}), headers={"If-Match": '"1", "2"'})
+    assert response.headers["ETag"] == '"2"'
+    response = test_app.get(f"/recipes/{recipe_id}")
+    assert response.headers["ETag"] == '"2"'
+    assert response.json()["cooking_time"] == 10
+
+
+def test_recipe_unknown_category(test_app, category):
+    test_request_payload = \
+        {"title": "Orphan", "cooking_time": 5, "category": 999999, "ingredients": "ingredients",
+         "description": "description"}
+    response = test_app.post("/recipes/", json=test_request_payload)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Category with specified ID does not exist"}
+
+    recipe = test_app.post("/recipes/", json={**test_request_payload, "category": category["id"]}).json()
+    response = test_app.patch(f"/recipes/{recipe['id']}/", json={"title": "Moved", "category": 999999})
+    assert response.status_code == 400
+    response = test_app.get(f"/recipes/{recipe['id']}")
+    assert response.json()["title"] == "Orphan"
+    assert response.json()["category"] == category["title"]
+    assert response.headers["ETag"] == '"1"'
+
+
+def test_update_recipe_null_field(test_app, category):
+    recipe = test_app.post("/recipes/", json={"title": "Not null", "cooking_time": 5, "category": category["id"],
+                                              "ingredients": "ingredients", "description": "description"}).json()
+    for field in ("title", "cooking_time", "ingredients", "description"):
+        response = test_app.patch(f"/recipes/{recipe['id']}/", json={field: None})
+        assert response.status_code == 422, field
+    assert test_app.get(f"/recipes/{recipe['id']}").json()["title"] == "Not null"
+
+
+def test_update_recipe_other_integrity_errors(session_factory):
+    async def update():
+        async with session_factory() as session:
+            session.add(RecipeCategory(id=1, title="Category"))
+            session.add(Recipes(id=1, title="Title", category=1, cooking_time=5, ingredients="ingredients",
+                                description="description", views=0))
+            await session.commit()
+            # Bypasses validation of the schema, the database rejects null title.
+            await crud_recipes.update_(schemas.RecipeUpdate.construct(_fields_set={"title"}, title=None), 1, session)
+
+    with pytest.raises(IntegrityError, match="NOT NULL"):
+        asyncio.run(update())
+
+
+def test_top_recipes(test_app, category):
+    test_request_payload = \
+        {"title": "Top", "cooking_time": 1, "category": category["id"], "ingredients": "ingredients",
+         "description": "description"}
+    recipe_id = test_app.post("/recipes/", content=json.dumps(test_request_payload), ).json()["id"]
+    test_app.patch(f"/recipes/{recipe_id}/", content=json.dumps({"cooking_time": 2}))
+    # Lists read views from the database, views of earlier tests are flushed to compare the top with them.
+    test_app.portal.call(view_counter.flush)
+
+    for params in ({"n": 3}, {"n": 1000}, {"n": 5, "category": category["id"]}):
+        response = test_app.get("/recipes/top", params=params)
+        assert response.status_code == 200
+        url = f"/categories/{params['category']}" if "category" in params else "/recipes/"
+        assert response.json() == test_app.get(url, params={"limit": params["n"]}).json()
+    assert test_app.get("/diagnostics/leaderboard").json()["consistent"]
+
+    viewed = {**test_request_payload, "title": "Viewed", "cooking_time": 5}
+    viewed_id = test_app.post("/recipes/", json=viewed).json()["id"]
+    for _ in range(2):
+        test_app.get(f"/recipes/{viewed_id}")
+    top = test_app.get("/recipes/top", params={"n": 1, "category": category["id"]}).json()
+    assert top == [{"id": viewed_id, "title": "Viewed", "cooking_time": 5, "category": category["title"], "views": 2}]
+    assert test_app.get(f"/recipes/{viewed_id}").json()["views"] == 2
+
+    test_app.delete(f"/recipes/{recipe_id}/")
+    assert recipe_id not in [recipe["id"] for recipe in test_app.get("/recipes/top", params={"n": 1000}).json()]
+    assert test_app.get("/diagnostics/leaderboard").json()["consistent"]
+
+    assert test_app.get("/recipes/top", params={"category": 999}).status_code == 404
+    assert test_app.get("/recipes/top", params={"n": 0}).status_code == 422
+
+
+def test_read_all_recipes_not_modified(test_app, category):
+    response = test_app.get("/recipes/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = test_app.get("/recipes/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    # Not a query-free response, one SELECT of collection_versions.
+    assert response.headers["X-SQL-Statements"] == "1"
+    assert test_app.get("/recipes/", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+
+    created = test_app.post("/recipes/", json={"title": "Changed", "cooking_time": 5, "category": category["id"],
+                                               "ingredients": "ingredients", "description": "description"})
+    response = test_app.get("/recipes/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert test_app.get(f"/categories/{category['id']}",
+                        headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_read_recipes_batch(test_app, category):
+    created = [test_app.post("/recipes/", json={"title": f"Batch {number}", "cooking_time": 5,
+                                                "category": category["id"],
+                                                "ingredients": "ingredients", "description": "description"}).json()
+               for number in range(3)]
+    ids = [recipe["id"] for recipe in created]
+    test_app.get(f"/recipes/{ids[1]}")
+
+    response = test_app.get("/recipes/batch", params={"ids": [ids[2], 100000, ids[0], ids[1], ids[2]]})
+    assert response.status_code == 200
+    assert response.headers["X-SQL-Statements"] == "1"
+    assert [recipe["id"] for recipe in response.json()["recipes"]] == [ids[2], ids[0], ids[1]]
+    assert response.json()["recipes"][2]["views"] == 1
+    assert response.json()["missing"] == [100000]
+
+    test_app.get("/recipes/batch", params={"ids": ids, "count_views": True})
+    views = [recipe["views"] for recipe in test_app.get("/recipes/batch", params={"ids": ids}).json()["recipes"]]
+    assert views == [1, 2, 1]
+
+    assert test_app.get("/recipes/batch").status_code == 422
+
+
+def test_read_recipes_filtered_and_sorted(test_app):
+    categories = [test_app.post("/categories/", json={"title": f"Filtered {number}"}).json()["id"]
+                  for number in range(3)]
+    created = [test_app.post("/recipes/", json={"title": f"Filtered {number}", "cooking_time": cooking_time,
+                                                "category": category, "ingredients": "ingredients",
+                                                "description": "description"}).json()["id"]
+               for number, (cooking_time, category) in enumerate([(20, categories[0]), (10, categories[1]),
+                                                                  (40, categories[1]), (15, categories[2])])]
+    params = {"category": categories[:2], "sort": "quickest", "limit": 1, "cooking_time_max": 30}
+
+    response = test_app.get("/recipes/", params=params)
+    assert response.status_code == 200
+    assert [recipe["id"] for recipe in response.json()] == [created[1]]
+    response = test_app.get("/recipes/", params={**params, "cursor": response.headers["X-Next-Cursor"]})
+    assert int(response.headers["X-SQL-Statements"]) <= 4
+    assert [recipe["id"] for recipe in response.json()] == [created[0]]
+    assert "X-Next-Cursor" not in response.headers
+
+    response = test_app.get("/recipes/", params={"category": categories, "sort": "newest"})
+    assert [recipe["id"] for recipe in response.json()] == created[::-1]
+    response = test_app.get("/recipes/", params={"category": categories, "cooking_time_min": 15, "views_min": 0})
+    assert sorted(recipe["id"] for recipe in response.json()) == [created[0], created[2], created[3]]
+
+    assert test_app.get("/recipes/", params={"sort": "title"}).status_code == 422
+    assert test_app.get("/recipes/", params={"sort": "newest", "cursor": "WzEsMiwzXQ"}).status_code == 400
+    for category in categories:
+        test_app.delete(f"/categories/{category}")
+
+
+def test_read_recipes_by_ingredients(test_app, category):
+    recipes = [("Pantry soup", "Quinoa, 2 Kohlrabi (diced); saffron"), ("Pantry salad", "quinoa, 100 g kohlrabi"),
+               ("Pantry stew", "quinoa, tamarind, kohlrabi, saffron")]
+    created = [test_app.post("/recipes/", json={"title": title, "cooking_time": 5, "category": category["id"],
+                                                "ingredients": ingredients, "description": "description"})
+               for title, ingredients in recipes]
+    assert created[0].headers["X-SQL-Statements"] == "3"
+    ids = [response.json()["id"] for response in created]
+
+    response = test_app.get("/recipes/by-ingredients", params={"have": "kohlrabi, Quinoa, saffron"})
+    assert response.status_code == 200
+    assert response.headers["X-SQL-Statements"] == "1"
+    found = [(recipe["id"], recipe["ingredients_matched"], recipe["ingredients_total"]) for recipe in response.json()]
+    assert found == [(ids[0], 3, 3), (ids[1], 2, 2), (ids[2], 3, 4)]
+
+    response = test_app.get("/recipes/by-ingredients", params={"have": "saffron", "limit": 1})
+    assert [recipe["id"] for recipe in response.json()] == [ids[0]]
+    response = test_app.get("/recipes/by-ingredients",
+                            params={"have": "saffron", "limit": 1, "cursor": response.headers["X-Next-Cursor"]})
+    assert [recipe["id"] for recipe in response.json()] == [ids[2]]
+
+    test_app.patch(f"/recipes/{ids[2]}", json={"ingredients": "tamarind"})
+    test_app.delete(f"/recipes/{ids[0]}")
+    response = test_app.get("/recipes/by-ingredients", params={"have": "saffron;tamarind"})
+    assert [recipe["id"] for recipe in response.json()] == [ids[2]]
+    assert test_app.get("/recipes/by-ingredients", params={"have": "2 g"}).status_code == 400
@@ -0,0 +1,84 @@
+import os
+import sys
+import signal
+import sqlite3
+import asyncio
+import subprocess
+import httpx
+from bench import serve, free_port
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_workers_share_database(tmp_path, monkeypatch):
+    database = tmp_path / "run.db"
+    monkeypatch.setenv("COOKBOOK_DATABASE_URL", f"sqlite+aiosqlite:///{database}")
+    port = free_port()
+
+    async def write():
+        server = await serve(2, port)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+                responses = await asyncio.gather(*(client.post("/categories/", json={"title": f"Category {number}"})
+                                                   for number in range(100)))
+        finally:
+            server.send_signal(signal.SIGINT)
+            assert server.wait(30) == 0
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(write()) == [201] * 100
+    connection = sqlite3.connect(database)
+    assert connection.execute("SELECT count(*) FROM recipe_cat").fetchone() == (100,)
+    connection.close()
+
+
+def test_workers_refresh_state(tmp_path, monkeypatch):
+    monkeypatch.setenv("COOKBOOK_DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'state.db'}")
+    monkeypatch.setenv("COOKBOOK_LEADERBOARD_TTL", "0.2")
+    monkeypatch.setenv("COOKBOOK_RECIPE_CACHE_TTL", "0.2")
+    port = free_port()
+
+    async def read_everywhere(client, url):
+        # Concurrent requests are spread over the workers.
+        return [response.json() for response in await asyncio.gather(*(client.get(url) for _ in range(20)))]
+
+    async def check():
+        server = await serve(2, port)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+                await read_everywhere(client, "/recipes/top")
+                category = (await client.post("/categories/", json={"title": "Shared"})).json()["id"]
+                recipe = (await client.post("/recipes/", json={"title": "Shared", "cooking_time": 5,
+                                                               "category": category, "ingredients": "ingredients",
+                                                               "description": "description"})).json()["id"]
+                await read_everywhere(client, f"/recipes/{recipe}")
+                await client.patch(f"/recipes/{recipe}", json={"title": "Changed"})
+                await asyncio.sleep(0.3)
+                top = await read_everywhere(client, "/recipes/top")
+                recipes = await read_everywhere(client, f"/recipes/{recipe}")
+                lists = await asyncio.gather(*(client.get("/recipes/") for _ in range(20)))
+        finally:
+            server.send_signal(signal.SIGINT)
+            assert server.wait(30) == 0
+        return top, recipes, {response.headers["ETag"] for response in lists}
+
+    top, recipes, etags = asyncio.run(check())
+    assert all([recipe["title"] for recipe in response] == ["Changed"] for response in top)
+    assert all(recipe["title"] == "Changed" for recipe in recipes)
+    # Every worker reads collection versions from the database.
+    assert len(etags) == 1
+
+
+def test_begin_immediate():
+    code = ("import asyncio, sqlite3, sqlalchemy, db\n"
+            "async def check():\n"
+            "    async with db.async_session() as session:\n"
+            "        await session.execute(sqlalchemy.text('SELECT 1'))\n"
+            "        try:\n"
+            "            sqlite3.connect(db.engine.url.database, timeout=0).execute('BEGIN IMMEDIATE')\n"
+            "        except sqlite3.OperationalError:\n"
+            "            return\n"
+            "        raise AssertionError('write lock is not taken')\n"
+            "asyncio.run(check())")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, cwd=ROOT)
+    assert result.returncode == 0, result.stderr
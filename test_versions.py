@@ -0,0 +1,88 @@
+import asyncio
+from sqlalchemy import text
+from versions import CollectionVersions, none_match, RECIPES, CATEGORIES
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def etag(session_factory, versions, *collections):
+    async def read():
+        async with session_factory() as session:
+            return await versions.etag(session, *collections)
+
+    return asyncio.run(read())
+
+
+def execute(session_factory, *statements, flushed=None):
+    async def write():
+        async with session_factory() as session:
+            for statement in statements:
+                await session.execute(text(statement))
+            if flushed is not None:
+                await flushed.views_flushed(session)
+            await session.commit()
+
+    asyncio.run(write())
+
+
+def test_views_bump_recipes_version_coarsely(session_factory):
+    clock = Clock()
+    versions = CollectionVersions(views_interval=60, clock=clock)
+    execute(session_factory, "INSERT INTO recipe_cat (id, title) VALUES (1, 'Category')",
+            "INSERT INTO recipes (id, title, category, cooking_time, ingredients, description, views) "
+            "VALUES (1, 'Title', 1, 5, 'ingredients', 'description', 0)")
+    recipes, categories = etag(session_factory, versions, RECIPES), etag(session_factory, versions, CATEGORIES)
+
+    # The first flush after a quiet period changes the tag at once, later ones once per interval.
+    execute(session_factory, "UPDATE recipes SET views = views + 3", flushed=versions)
+    changed = etag(session_factory, versions, RECIPES)
+    assert changed != recipes
+    execute(session_factory, "UPDATE recipes SET views = views + 1", flushed=versions)
+    assert etag(session_factory, versions, RECIPES) == changed
+    clock.now += 60
+    later = etag(session_factory, versions, RECIPES)
+    assert later != changed
+    execute(session_factory, "UPDATE recipes SET views = views + 1", flushed=versions)
+    assert etag(session_factory, versions, RECIPES) == later
+    assert etag(session_factory, versions, CATEGORIES) == categories
+
+    execute(session_factory, "INSERT INTO recipe_cat (id, title) VALUES (2, 'Other')")
+    assert etag(session_factory, versions, CATEGORIES) != categories
+    assert etag(session_factory, versions, RECIPES) == later
+
+    both = etag(session_factory, versions, CATEGORIES, RECIPES)
+    execute(session_factory, "UPDATE recipes SET cooking_time = 10")
+    assert etag(session_factory, versions, CATEGORIES, RECIPES) != both
+    both = etag(session_factory, versions, CATEGORIES, RECIPES)
+    execute(session_factory, "UPDATE recipe_cat SET title = 'Renamed' WHERE id = 1")
+    recipes = etag(session_factory, versions, RECIPES)
+    assert recipes != later
+    execute(session_factory, "UPDATE recipe_cat SET recipe_count = recipe_count")
+    assert etag(session_factory, versions, RECIPES) == recipes
+
+
+def test_tags_agree_between_processes(session_factory):
+    clock = Clock()
+    worker, other = CollectionVersions(clock=clock), CollectionVersions(clock=clock)
+    assert etag(session_factory, worker, CATEGORIES, RECIPES) == etag(session_factory, other, CATEGORIES, RECIPES)
+
+    tag = etag(session_factory, worker, RECIPES)
+    execute(session_factory, "INSERT INTO recipe_cat (id, title) VALUES (1, 'Category')",
+            "INSERT INTO recipes (id, title, category, cooking_time, ingredients, description, views) "
+            "VALUES (1, 'Title', 1, 5, 'ingredients', 'description', 0)")
+    assert etag(session_factory, worker, RECIPES) == etag(session_factory, other, RECIPES) != tag
+    execute(session_factory, "UPDATE recipes SET views = views + 1", flushed=other)
+    assert etag(session_factory, worker, RECIPES) == etag(session_factory, other, RECIPES)
+
+
+def test_none_match():
+    assert not none_match(None, '"1"')
+    assert none_match("*", '"1"')
+    assert none_match('"2", W/"1"', '"1"')
+    assert not none_match('"2"', '"1"')
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+import contextlib
+from sqlalchemy import select
+from models import Recipes, RecipeCategory
+from view_counter import ViewCounter
+from write_queue import WriteQueue
+
+
+@pytest.fixture()
+def seed_rows():
+    return [RecipeCategory(id=1, title="Category")] + [
+        Recipes(id=recipe_id, title="Title", category=1, cooking_time=5, ingredients="ingredients",
+                description="description", views=0) for recipe_id in (1, 2)]
+
+
+async def get_views(session_factory):
+    async with session_factory() as session:
+        result = await session.execute(select(Recipes.id, Recipes.views).order_by(Recipes.id))
+        return dict(result.all())
+
+
+def test_flush_batches_increments(session_factory):
+    counter = ViewCounter(session_factory)
+    flushed = []
+    counter.on_flush(flushed.append)
+    for recipe_id in (1, 1, 2, 1):
+        counter.add(recipe_id)
+
+    assert counter.pending == 4
+    assert counter.pending_for(1) == 3
+
+    assert asyncio.run(counter.flush()) == 4
+    assert counter.pending == 0
+    assert flushed == [{1: 3, 2: 1}]
+    assert asyncio.run(get_views(session_factory)) == {1: 3, 2: 1}
+
+
+@pytest.mark.parametrize("use_writer", [False, True])
+def test_flush_hooks_run_with_commit(session_factory, use_writer):
+    seen = []
+
+    @contextlib.asynccontextmanager
+    async def slow_close():
+        async with session_factory() as session:
+            yield session
+            # A recipe read after the commit, while the session is being closed.
+            seen.append((counter.pending_for(1), list(flushed), (await get_views(session_factory))[1]))
+
+    writer = WriteQueue(slow_close) if use_writer else None
+    counter = ViewCounter(session_factory if use_writer else slow_close, writer=writer)
+    flushed = []
+    counter.on_flush(flushed.append)
+    counter.add(1, 2)
+
+    async def run():
+        if writer is not None:
+            writer.start()
+        await counter.flush()
+        if writer is not None:
+            await writer.stop()
+
+    asyncio.run(run())
+    assert seen == [(0, [{1: 2}], 2)]
+
+
+def test_max_buffer_triggers_flush(session_factory):
+    counter = ViewCounter(session_factory, flush_interval=60, max_buffer=3)
+
+    async def run():
+        counter.start()
+        for _ in range(3):
+            counter.add(2)
+        for _ in range(100):
+            if not counter.pending:
+                break
+            await asyncio.sleep(0.01)
+        await counter.stop()
+
+    asyncio.run(run())
+    assert counter.pending == 0
+    assert asyncio.run(get_views(session_factory)) == {1: 0, 2: 3}
+
+
+def test_stop_flushes_pending(session_factory):
+    counter = ViewCounter(session_factory, flush_interval=60)
+
+    async def run():
+        counter.start()
+        counter.add(1)
+        await counter.stop()
+
+    asyncio.run(run())
+    assert asyncio.run(get_views(session_factory)) == {1: 1, 2: 0}
+
+
+def test_failed_flush_keeps_increments():
+    def broken_factory():
+        raise RuntimeError("database is unavailable")
+
+    counter = ViewCounter(broken_factory)
+    counter.add(1)
+    with pytest.raises(Exception):
+        asyncio.run(counter.flush())
+    assert counter.pending == 1
+    assert counter.pending_for(1) == 1
+
+
+def test_discard_deleted_recipes(session_factory):
+    counter = ViewCounter(session_factory)
+    for recipe_id in (1, 1, 2):
+        counter.add(recipe_id)
+
+    counter.discard([1, 3])
+    assert counter.pending == 1
+    assert counter.pending_for(1) == 0
+    assert asyncio.run(counter.flush()) == 1
+    assert asyncio.run(get_views(session_factory)) == {1: 0, 2: 1}
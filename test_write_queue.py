@@ -0,0 +1,83 @@
+import asyncio
+from sqlalchemy import select, text
+from models import RecipeCategory
+from crud_cats import create_cat, update_cat, DuplicateCategory
+from write_queue import WriteQueue, after_commit, commit
+
+
+async def titles(session_factory):
+    async with session_factory() as session:
+        return (await session.execute(select(RecipeCategory.title).order_by(RecipeCategory.id))).scalars().all()
+
+
+def test_group_commit(session_factory):
+    queue = WriteQueue(session_factory, max_batch=10, max_wait=0.05)
+    effects = []
+
+    async def failing(session):
+        await session.execute(text("INSERT INTO recipe_cat (title) VALUES ('Lost')"))
+        after_commit(session, lambda: effects.append("lost"))
+        raise RuntimeError("failed")
+
+    async def succeeding(session):
+        await session.execute(text("INSERT INTO recipe_cat (title) VALUES ('Kept')"))
+        after_commit(session, lambda: effects.append("kept"))
+        await commit(session)
+        return "kept"
+
+    async def run():
+        queue.start()
+        async with session_factory() as session:
+            results = await asyncio.gather(
+                queue.run(lambda session: create_cat("Soups", session), session),
+                queue.run(lambda session: create_cat("SOUPS", session), session),
+                queue.run(failing, session),
+                queue.run(lambda session: update_cat("soups", 2, session), session),
+                queue.run(succeeding, session),
+                return_exceptions=True,
+            )
+        await queue.stop()
+        return results
+
+    created, duplicate, failed, renamed, kept = asyncio.run(run())
+    assert created.title == "Soups"
+    assert duplicate is None
+    assert isinstance(failed, RuntimeError)
+    assert renamed is None
+    assert kept == "kept"
+    assert effects == ["kept"]
+    assert queue.stats() == {"groups": 1, "operations": 5}
+    assert asyncio.run(titles(session_factory)) == ["Soups", "Kept"]
+
+
+def test_operation_error_in_group(session_factory):
+    queue = WriteQueue(session_factory, max_wait=0.05)
+
+    async def run():
+        queue.start()
+        async with session_factory() as session:
+            await queue.run(lambda session: create_cat("Soups", session), session)
+            results = await asyncio.gather(
+                queue.run(lambda session: create_cat("Salads", session), session),
+                queue.run(lambda session: update_cat("Salads", 1, session), session),
+                return_exceptions=True,
+            )
+        await queue.stop()
+        return results
+
+    created, duplicate = asyncio.run(run())
+    assert created.title == "Salads"
+    assert isinstance(duplicate, DuplicateCategory)
+    assert asyncio.run(titles(session_factory)) == ["Soups", "Salads"]
+
+
+def test_direct_run_without_writer(session_factory):
+    queue = WriteQueue(session_factory)
+
+    async def run():
+        async with session_factory() as session:
+            return await queue.run(lambda session: create_cat("Soups", session), session)
+
+    assert asyncio.run(run()).title == "Soups"
+    assert queue.stats() == {"groups": 0, "operations": 0}
+    assert asyncio.run(titles(session_factory)) == ["Soups"]
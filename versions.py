@@ -0,0 +1,103 @@
+import time
+from typing import Callable, Dict
+from sqlalchemy import select, update, case, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import CollectionVersion
+from settings import settings
+from view_counter import view_counter
+
+# Collections with their own change counters. Recipe lists depend on views as well, which change much more often.
+RECIPES = "recipes"
+CATEGORIES = "categories"
+VIEWS = "views"
+
+
+class CollectionVersions:
+    """
+    Change counters of recipe and category collections, exposed as entity tags of list endpoints.
+
+    Counters are stored in the database and bumped by triggers in the transaction of every mutation, so every
+    worker process builds the same tag, and a tag read in the transaction of a list matches the list. Flushed
+    views mark the views counter pending, it counts as bumped once views_interval passed since its last bump,
+    so lists are refetched for popularity changes with that delay.
+
+    A conditional request is answered after one SELECT of the counters, not before any SQL: a version cached in
+    the process would miss mutations made by other workers and by direct writes to the database.
+    """
+
+    def __init__(self, views_interval: float = 60, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            views_interval: Minimum number of seconds between bumps of the views counter.
+            clock: Wall clock time source, the same in all processes.
+        """
+
+        self.views_interval = views_interval
+        self.clock = clock
+
+    async def views_flushed(self, session: AsyncSession) -> None:
+        """
+        Marks views changed in the transaction of a flush. A pending bump which is already due is stored,
+        so the counter keeps its value and the new views are pending until the next interval.
+        Args:
+            session: AsyncSession instance of the flush.
+
+        Returns:
+            None.
+        """
+
+        now = self.clock()
+        due = and_(CollectionVersion.pending, now - CollectionVersion.changed_at >= self.views_interval)
+        await session.execute(update(CollectionVersion)
+                              .where(CollectionVersion.name == VIEWS)
+                              .values(version=CollectionVersion.version + case((due, 1), else_=0),
+                                      changed_at=case((due, now), else_=CollectionVersion.changed_at),
+                                      pending=True)
+                              .execution_options(synchronize_session=False))
+
+    async def etag(self, session: AsyncSession, *collections: str) -> str:
+        """
+        Returns entity tag of current version of collections, read with a single query.
+        Args:
+            session: AsyncSession instance, the one which reads the collections.
+            collections: RECIPES, CATEGORIES or both for lists depending on both.
+
+        Returns:
+            Quoted entity tag.
+        """
+
+        now = self.clock()
+        counters: Dict[str, int] = {}
+        rows = await session.execute(select(CollectionVersion.name, CollectionVersion.version,
+                                            CollectionVersion.changed_at, CollectionVersion.pending))
+        for name, version, changed_at, pending in rows:
+            counters[name] = version + (pending and now - changed_at >= self.views_interval)
+        versions = []
+        for collection in collections:
+            if collection == CATEGORIES:
+                versions.append(str(counters[CATEGORIES]))
+            else:
+                versions.append(f"{counters[RECIPES]}.{counters[VIEWS]}")
+        return f'"{"-".join(versions)}"'
+
+
+def none_match(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks If-None-Match header against entity tag with weak comparison.
+    Args:
+        if_none_match: Header value.
+        etag: Current entity tag.
+
+    Returns:
+        True if the client has the current version.
+    """
+
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+collection_versions = CollectionVersions(settings.views_etag_interval)
+view_counter.on_write(collection_versions.views_flushed)
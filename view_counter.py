@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import metrics
+from typing import Dict, Callable, List, Iterable, Awaitable
+from db import async_session
+from settings import settings
+from models import Recipes
+from sqlalchemy import update, bindparam
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
+from write_queue import WriteQueue, write_queue, after_commit, commit
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Write-behind accumulator of recipe views.
+
+    Increments are collected in memory per recipe ID and written to the database periodically
+    (and on shutdown) in a single batched UPDATE transaction.
+    """
+
+    def __init__(self, session_factory: sessionmaker, flush_interval: float = 5, max_buffer: int = 1000,
+                 writer: WriteQueue | None = None):
+        """
+        Args:
+            session_factory: Factory of AsyncSession instances used for flushing.
+            flush_interval: Seconds between periodic flushes.
+            max_buffer: Number of pending increments which triggers an immediate flush.
+            writer: Write queue which commits flushes together with other mutations when it is started.
+        """
+
+        self.session_factory = session_factory
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: Dict[int, int] = {}
+        self._in_flight: Dict[int, int] = {}
+        self._buffered = 0
+        self._flush_hooks: List[Callable[[Dict[int, int]], None]] = []
+        self._write_hooks: List[Callable[[AsyncSession], Awaitable[None]]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of increments which are not committed to the database yet.
+        """
+
+        return self._buffered + sum(self._in_flight.values())
+
+    def pending_for(self, recipe_id: int) -> int:
+        """
+        Returns number of not committed increments of the recipe.
+        Args:
+            recipe_id: Recipe ID.
+
+        Returns:
+            Number of pending increments.
+        """
+
+        return self._buffer.get(recipe_id, 0) + self._in_flight.get(recipe_id, 0)
+
+    def pending_views(self) -> Dict[int, int]:
+        """
+        Returns not committed increments of every recipe which has them.
+        Returns:
+            Mapping of recipe ID to number of pending increments.
+        """
+
+        views = dict(self._in_flight)
+        for recipe_id, count in self._buffer.items():
+            views[recipe_id] = views.get(recipe_id, 0) + count
+        return views
+
+    def add(self, recipe_id: int, count: int = 1) -> None:
+        """
+        Registers recipe views.
+        Args:
+            recipe_id: Recipe ID.
+            count: Number of views.
+
+        Returns:
+            None.
+        """
+
+        self._buffer[recipe_id] = self._buffer.get(recipe_id, 0) + count
+        self._buffered += count
+        if self._buffered >= self.max_buffer and self._wakeup is not None:
+            self._wakeup.set()
+
+    def discard(self, recipe_ids: Iterable[int]) -> None:
+        """
+        Drops buffered views of deleted recipes, so they are not added to a recipe which reuses the ID.
+        Args:
+            recipe_ids: IDs of deleted recipes.
+
+        Returns:
+            None.
+        """
+
+        for recipe_id in recipe_ids:
+            self._buffered -= self._buffer.pop(recipe_id, 0)
+
+    def on_flush(self, hook: Callable[[Dict[int, int]], None]) -> None:
+        """
+        Registers callback which receives every committed batch of increments, called right after the commit,
+        in the same step as the increments stop being pending.
+        Args:
+            hook: Callable accepting mapping of recipe ID to increment.
+
+        Returns:
+            None.
+        """
+
+        self._flush_hooks.append(hook)
+
+    def on_write(self, hook: Callable[[AsyncSession], Awaitable[None]]) -> None:
+        """
+        Registers coroutine function which is awaited with the session of every flush before it is committed.
+        Args:
+            hook: Coroutine function accepting AsyncSession instance.
+
+        Returns:
+            None.
+        """
+
+        self._write_hooks.append(hook)
+
+    async def flush(self) -> int:
+        """
+        Writes all buffered increments to the database in one transaction.
+        Returns:
+            Number of flushed increments.
+        """
+
+        if not self._buffer:
+            return 0
+        batch, self._buffer, self._buffered = self._buffer, {}, 0
+        for recipe_id, count in batch.items():
+            self._in_flight[recipe_id] = self._in_flight.get(recipe_id, 0) + count
+        committed = []
+        try:
+            async with self.session_factory() as session:
+                if self.writer is None:
+                    await self._write(batch, session, committed)
+                else:
+                    await self.writer.run(lambda session: self._write(batch, session, committed), session)
+        except BaseException:
+            if not committed:
+                self._release(batch)
+                for recipe_id, count in batch.items():
+                    self._buffer[recipe_id] = self._buffer.get(recipe_id, 0) + count
+                self._buffered += sum(batch.values())
+            raise
+        return sum(batch.values())
+
+    async def _write(self, batch: Dict[int, int], session: AsyncSession, committed: List[bool]) -> None:
+        await session.execute(update(Recipes)
+                              .where(Recipes.id == bindparam("recipe_id"))
+                              .values(views=Recipes.views + bindparam("increment"))
+                              .execution_options(synchronize_session=False),
+                              [{"recipe_id": recipe_id, "increment": count} for recipe_id, count in batch.items()])
+        for hook in self._write_hooks:
+            await hook(session)
+        after_commit(session, lambda: self._committed(batch, committed))
+        await commit(session)
+
+    def _committed(self, batch: Dict[int, int], committed: List[bool]) -> None:
+        # Runs with the commit, no await in between: a recipe read concurrently has the flushed views either
+        # pending or in the database and the cache, never in both.
+        committed.append(True)
+        self._release(batch)
+        for hook in self._flush_hooks:
+            hook(batch)
+
+    def _release(self, batch: Dict[int, int]) -> None:
+        for recipe_id, count in batch.items():
+            left = self._in_flight[recipe_id] - count
+            if left:
+                self._in_flight[recipe_id] = left
+            else:
+                del self._in_flight[recipe_id]
+
+    def start(self) -> None:
+        """
+        Starts background flushing.
+        Returns:
+            None.
+        """
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops background flushing and writes the rest of increments.
+        Returns:
+            None.
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush recipe views")
+
+
+view_counter = ViewCounter(async_session, settings.views_flush_interval, settings.views_max_buffer, write_queue)
+metrics.VIEWS_PENDING.set_function(lambda: view_counter.pending)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Tuple
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import async_session
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Write operation: coroutine function making changes in provided session and committing them with commit().
+Operation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+def after_commit(session: AsyncSession, effect: Callable[[], None]) -> None:
+    """
+    Registers an in-memory change, e.g. of a cache, to be made once changes of the session are committed.
+    Args:
+        session: AsyncSession instance.
+        effect: Function making the change.
+
+    Returns:
+        None.
+    """
+
+    session.info.setdefault("after_commit", []).append(effect)
+
+
+async def commit(session: AsyncSession) -> None:
+    """
+    Commits changes of a write operation and makes its registered in-memory changes. Operations run by
+    the write queue are committed by the queue together with the rest of their group.
+    Args:
+        session: AsyncSession instance.
+
+    Returns:
+        None.
+    """
+
+    if "savepoint" in session.info:
+        return
+    await session.commit()
+    for effect in session.info.pop("after_commit", []):
+        effect()
+
+
+async def rollback(session: AsyncSession) -> None:
+    """
+    Discards changes of a write operation and its registered in-memory changes. Operations run by the write
+    queue roll back their savepoint only.
+    Args:
+        session: AsyncSession instance.
+
+    Returns:
+        None.
+    """
+
+    savepoint = session.info.get("savepoint")
+    if savepoint is None:
+        await session.rollback()
+        session.info.pop("after_commit", None)
+    elif session.in_nested_transaction():
+        await savepoint.rollback()
+        del session.info["after_commit"][session.info["effects"]:]
+
+
+class WriteQueue:
+    """
+    Single writer which runs write operations from a queue and commits them in groups, so concurrent
+    mutations share one transaction and one fsync instead of contending for the SQLite write lock.
+
+    Every operation of a group runs in its own savepoint, so an operation which fails is rolled back alone
+    and its caller gets the error, while other callers get their results after the group is committed.
+    Groups are limited by max_batch operations and by max_wait seconds the first operation waits for others.
+    Operations are run directly in the caller's session while the queue is not started.
+    """
+
+    def __init__(self, session_factory: sessionmaker, max_batch: int = 100, max_wait: float = 0.001):
+        """
+        Args:
+            session_factory: Factory of AsyncSession instances used for groups.
+            max_batch: Maximum number of operations committed together.
+            max_wait: Seconds the first operation of a group waits for more operations.
+        """
+
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.groups = 0
+        self.operations = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def run(self, operation: Operation, session: AsyncSession) -> Any:
+        """
+        Runs write operation in the next group or directly in provided session.
+        Args:
+            operation: Write operation.
+            session: Session of the caller, used while the queue is not started.
+
+        Returns:
+            Result of the operation.
+        """
+
+        if self._task is None:
+            return await operation(session)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    def start(self) -> None:
+        """
+        Starts the writer.
+        Returns:
+            None.
+        """
+
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the writer after queued operations are committed.
+        Returns:
+            None.
+        """
+
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+            self._queue = None
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Number of committed groups and operations.
+        """
+
+        return {"groups": self.groups, "operations": self.operations}
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            deadline = loop.time() + self.max_wait
+            while len(group) < self.max_batch:
+                try:
+                    if self._queue.empty():
+                        item = await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time()))
+                    else:
+                        item = self._queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                group.append(item)
+            try:
+                await self._commit(group)
+            except Exception as exc:
+                logger.exception("Failed to commit a group of %s write operations", len(group))
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(exc)
+
+    async def _commit(self, group: List[Tuple[Operation, asyncio.Future]]) -> None:
+        results = []
+        async with self.session_factory() as session:
+            effects = session.info["after_commit"] = []
+            for operation, future in group:
+                session.info["effects"] = len(effects)
+                session.info["savepoint"] = savepoint = await session.begin_nested()
+                try:
+                    result = await operation(session)
+                    if session.in_nested_transaction():
+                        await savepoint.commit()
+                except Exception as exc:
+                    if session.in_nested_transaction():
+                        await savepoint.rollback()
+                    del effects[session.info["effects"]:]
+                    results.append((future, exc, False))
+                else:
+                    results.append((future, result, True))
+            del session.info["savepoint"]
+            try:
+                await session.commit()
+            except Exception as exc:
+                # Changes of succeeded operations are lost as well.
+                logger.exception("Failed to commit a group of %s write operations", len(group))
+                results = [(future, result if not succeeded else exc, False)
+                           for future, result, succeeded in results]
+                effects = []
+            else:
+                self.groups += 1
+                self.operations += len(group)
+            # Made right after the commit, before closing the session yields to concurrent readers.
+            for effect in effects:
+                effect()
+        for future, result, succeeded in results:
+            if future.done():
+                continue
+            if succeeded:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+
+write_queue = WriteQueue(async_session, settings.write_batch_size, settings.write_batch_wait)